@@ -51,7 +51,7 @@ def nfm_demodulate(samples, sample_rate, bandwidth, last_phase=0):
 def process_data(rate, duration, data_queue, b_file_path, frequency, factor_queue):
     print("[Thread] >processing data and saving to binary file")
     last_phase = 0  # Initialize last phase
-    total_decimation_factor = 1  # To accumulate decimation factors
+    total_decimation_factor = 1  # Decimation of the chunks, the same for all of them
     with open(b_file_path, 'wb') as f:
         start_time = time.time()
         while True:
@@ -62,7 +62,7 @@ def process_data(rate, duration, data_queue, b_file_path, frequency, factor_queu
                 print("[Thread] >pass ended, processing remaining data...")
             samples = data_queue.get()
             data_demodulated, last_phase, decimation_factor = nfm_demodulate(samples, rate, 34e3, last_phase)  # Pass and retrieve last phase
-            total_decimation_factor *= decimation_factor  # Accumulate total decimation factor
+            total_decimation_factor = decimation_factor  # Every chunk is decimated by the same factor
             data_int = np.int16(data_demodulated * (2**15 - 1))
             if np.max(data_int) > 32767 or np.min(data_int) < -32768:
                 print("Warning: Clipping detected")
@@ -157,7 +157,7 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
     # Convert the binary file to a WAV file
     print("Converting binary file to WAV format")
     data = np.fromfile(bin_file_path, dtype=np.int16)
-    write(file_path, int(sdr.sample_rate), data)
+    write(file_path, int(final_sample_rate), data)
     print(f"[WARNING]: check file duration, should be {duration} or {int((duration// 60) % 60)}:{int(duration %60)}!!")
     # Delete the binary file
     #os.remove(bin_file_path)
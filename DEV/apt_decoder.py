@@ -0,0 +1,231 @@
+import zlib
+import struct
+import numpy as np
+from scipy.signal import fftconvolve
+from apt_envelope import SubcarrierEnvelope
+
+APT_WORD_RATE = 4160   # words/s
+APT_LINE_RATE = 2      # lines/s
+APT_LINE_WIDTH = 2080  # words per line
+# Sync A: 7 cycles of a 1040 Hz square wave (2 words high, 2 words low) between black words
+SYNC_A = [0] * 4 + [1, 1, 0, 0] * 7 + [0] * 7
+
+
+# Function to build the Sync A template at a given sample rate (zero mean, unit norm)
+def sync_a_template(rate):
+    n = int(round(len(SYNC_A) * rate / APT_WORD_RATE))
+    words = (np.arange(n) * APT_WORD_RATE / rate).astype(int)
+    template = np.array(SYNC_A, dtype=np.float32)[words]
+    template -= template.mean()
+    return template / np.linalg.norm(template)
+
+# Function to compute the normalized cross-correlation of data against a zero mean, unit norm template
+def normalized_correlation(data, template):
+    n = len(template)
+    corr = fftconvolve(data, template[::-1], mode='valid')
+    # Local energy of the data around its mean, over every window of the template length
+    s1 = np.cumsum(np.concatenate(([0.0], data)))
+    s2 = np.cumsum(np.concatenate(([0.0], np.square(data, dtype=np.float64))))
+    energy = (s2[n:] - s2[:-n]) - np.square(s1[n:] - s1[:-n]) / n
+    return corr / np.sqrt(np.maximum(energy, 1e-12))
+
+# Function to refine a correlation peak with a parabola through its neighbours
+def refine_peak(corr, index):
+    if index <= 0 or index >= len(corr) - 1:
+        return float(index)
+    y0, y1, y2 = corr[index - 1], corr[index], corr[index + 1]
+    denom = y0 - 2 * y1 + y2
+    if denom == 0:
+        return float(index)
+    return index + 0.5 * (y0 - y2) / denom
+
+
+class LineSync:
+    """
+    Streaming APT line synchronizer.
+
+    Envelope blocks are correlated against the Sync A pattern, the position
+    of every line is tracked with an alpha-beta filter so that the line period
+    follows the drift of the sample clock, and each line is resampled to
+    exactly 2080 pixels. Lines keep coming at the tracked period when the sync
+    is lost, so the image stays continuous in time.
+
+    Parameters:
+    rate (float): nominal sample rate of the envelope.
+    lock_threshold (float): minimum normalized correlation accepted as a sync.
+    max_misses (int): consecutive missed syncs before searching a whole line again.
+    alpha (float): gain of the position correction.
+    beta (float): gain of the period correction.
+    """
+
+    def __init__(self, rate, lock_threshold=0.4, max_misses=8, alpha=0.3, beta=0.05):
+        self.rate = rate
+        self.nominal_period = rate / APT_LINE_RATE
+        self.period = self.nominal_period
+        self.template = sync_a_template(rate)
+        self.lock_threshold = lock_threshold
+        self.max_misses = max_misses
+        self.alpha = alpha
+        self.beta = beta
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0          # absolute index of buffer[0]
+        self.next_sync = None    # absolute (fractional) position of the next line start
+        self.misses = 0
+        self.lines = 0
+        self.synced_lines = 0
+
+    @property
+    def clock_ratio(self):
+        # Ratio between the true and the nominal sample rate
+        return self.period / self.nominal_period
+
+    @property
+    def locked(self):
+        return self.next_sync is not None and self.misses == 0
+
+    def _window(self):
+        # Search a whole line when acquiring or after losing lock, a small window otherwise
+        if self.next_sync is None or self.misses >= self.max_misses:
+            return int(self.period / 2)
+        return max(4, int(0.005 * self.period))
+
+    def _resample_line(self, start):
+        # Fractional sample index of every pixel, linear interpolation between neighbours
+        positions = start - self.offset + np.arange(APT_LINE_WIDTH) * (self.period / APT_LINE_WIDTH)
+        index = positions.astype(np.int64)
+        frac = (positions - index).astype(np.float32)
+        return self.buffer[index] * (1 - frac) + self.buffer[index + 1] * frac
+
+    def feed(self, envelope):
+        self.buffer = np.concatenate((self.buffer, np.asarray(envelope, dtype=np.float32)))
+        tlen = len(self.template)
+        if len(self.buffer) < tlen:
+            return np.zeros((0, APT_LINE_WIDTH), dtype=np.float32)
+        corr = normalized_correlation(self.buffer, self.template)
+
+        lines = []
+        while True:
+            window = self._window()
+            if self.next_sync is None:
+                # Acquisition: first line start is the best sync within the first period
+                if len(corr) < int(self.period):
+                    break
+                peak = int(np.argmax(corr[:int(self.period)]))
+                if corr[peak] < self.lock_threshold:
+                    # No signal yet, drop one period and keep looking
+                    drop = int(self.period)
+                    self.buffer = self.buffer[drop:]
+                    self.offset += drop
+                    corr = corr[drop:]
+                    continue
+                self.next_sync = self.offset + refine_peak(corr, peak)
+
+            expected = self.next_sync
+            # Samples needed to search the sync and to resample the whole line
+            needed = int(expected - self.offset + max(self.period + 2, window + tlen + 1))
+            if needed > len(self.buffer):
+                break
+            lo = max(0, int(expected - self.offset) - window)
+            hi = min(len(corr), int(expected - self.offset) + window + 1)
+            peak = lo + int(np.argmax(corr[lo:hi]))
+            period = self.period
+            synced = corr[peak] >= self.lock_threshold
+            if synced:
+                error = self.offset + refine_peak(corr, peak) - expected
+                if self.misses >= self.max_misses:
+                    # Re-acquired after losing lock: jump to the sync, keep the period
+                    start = expected + error
+                else:
+                    start = expected + self.alpha * error
+                    # Larger period gain on the first lines so the estimate converges quickly
+                    period += max(self.beta, 1 / (self.synced_lines + 2)) * error
+                    # A sample clock more than 1% off is not plausible, keep the estimate sane
+                    period = float(np.clip(period, 0.99 * self.nominal_period, 1.01 * self.nominal_period))
+                start = max(start, float(self.offset))
+            else:
+                start = expected
+            # A sync found late in the window moves the line past the samples checked above: wait for the rest
+            if int(start - self.offset + period + 2) > len(self.buffer):
+                break
+            self.period = period
+            if synced:
+                self.misses = 0
+                self.synced_lines += 1
+            else:
+                self.misses += 1
+            lines.append(self._resample_line(start))
+            self.lines += 1
+            self.next_sync = start + self.period
+
+            # Forget the samples that can no longer be part of a line or a sync search
+            drop = max(0, int(self.next_sync - self.offset) - int(self.period / 2) - 1)
+            self.buffer = self.buffer[drop:]
+            self.offset += drop
+            corr = corr[drop:]
+
+        if not lines:
+            return np.zeros((0, APT_LINE_WIDTH), dtype=np.float32)
+        return np.vstack(lines)
+
+
+# Function to decode a whole audio recording into raw APT lines
+def decode_audio(audio, rate, block_size=None):
+    envelope_detector = SubcarrierEnvelope(rate)
+    sync = LineSync(rate)
+    if block_size is None:
+        block_size = int(rate)
+    lines = []
+    for i in range(0, len(audio), block_size):
+        lines.append(sync.feed(envelope_detector.process(audio[i:i + block_size])))
+    return np.vstack(lines), sync
+
+# Function to stretch raw line values to 8 bit grey levels
+def to_uint8(image, low=None, high=None):
+    if low is None or high is None:
+        low, high = np.percentile(image, [0.5, 99.5]) if image.size else (0, 1)
+    scaled = (image - low) * (255 / max(high - low, 1e-12))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+# Function to write a greyscale uint8 image as PNG (no imaging library needed)
+def save_png(path, image):
+    height, width = image.shape
+    # Every scanline starts with filter type 0 (none)
+    raw = np.hstack((np.zeros((height, 1), dtype=np.uint8), image.astype(np.uint8))).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(chunk(b'IEND', b''))
+
+# Function to read a greyscale 8 bit PNG, such as the ones written by save_png
+def load_png(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError(f"{path} is not a PNG file")
+    offset, idat = 8, []
+    while offset < len(data):
+        (length,), kind = struct.unpack('>I', data[offset:offset + 4]), data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        if kind == b'IHDR':
+            width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', body)
+            if depth != 8 or color != 0 or interlace:
+                raise ValueError(f"{path}: only 8 bit greyscale PNGs without interlacing are supported")
+        elif kind == b'IDAT':
+            idat.append(body)
+        offset += length + 12
+    rows = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape(height, width + 1)
+    image = rows[:, 1:].copy()
+    for y in np.flatnonzero(rows[:, 0]):
+        kind = rows[y, 0]
+        if kind == 1:    # Sub: running sum along the row
+            image[y] = np.cumsum(image[y], dtype=np.uint8)
+        elif kind == 2:  # Up: add the row above
+            image[y] += image[y - 1] if y else 0
+        else:
+            raise ValueError(f"{path}: PNG filter {kind} is not supported")
+    return image
@@ -0,0 +1,41 @@
+import numpy as np
+from fft_filter import OverlapSaveFilter, lowpass_taps
+
+APT_SUBCARRIER = 2400  # Hz
+APT_BANDWIDTH = 2080   # Hz, half of the 4160 words/s pixel rate
+
+
+class SubcarrierEnvelope:
+    """
+    Streaming envelope detector for the APT 2400 Hz AM subcarrier.
+
+    The audio is mixed down with a 2400 Hz complex oscillator and lowpass
+    filtered, the envelope is the magnitude of the result. Oscillator phase
+    and filter history are carried across chunks, so there are no seams at
+    chunk boundaries.
+
+    Parameters:
+    rate (float): sample rate of the audio fed to process().
+    cutoff (float): lowpass cutoff, the image at 4800 Hz and the DC of the
+        audio (moved to 2400 Hz by the mixer) must fall in the stopband.
+    numtaps (int): length of the lowpass FIR.
+    decimation (int): keep one envelope sample every `decimation`.
+    """
+
+    def __init__(self, rate, cutoff=APT_BANDWIDTH, numtaps=151, decimation=1):
+        self.rate = rate
+        self.step = 2 * np.pi * APT_SUBCARRIER / rate
+        self.phase = 0.0
+        self.lowpass = OverlapSaveFilter(lowpass_taps(cutoff, rate, numtaps=numtaps), decimation=decimation)
+
+    def reset(self):
+        self.phase = 0.0
+        self.lowpass.reset()
+
+    def process(self, audio):
+        # Local oscillator continuing from the phase reached at the end of the previous chunk
+        phases = self.phase + self.step * np.arange(len(audio))
+        self.phase = (self.phase + self.step * len(audio)) % (2 * np.pi)
+        baseband = np.asarray(audio, dtype=np.float32) * np.exp(-1j * phases).astype(np.complex64)
+        # Factor 2 restores the amplitude lost to the image removed by the lowpass
+        return 2 * np.abs(self.lowpass.filter(baseband))
@@ -0,0 +1,63 @@
+import os
+import time
+import numpy as np
+from apt_envelope import SubcarrierEnvelope
+from apt_decoder import LineSync, APT_LINE_WIDTH, to_uint8, save_png
+
+
+class LiveDecoder:
+    """
+    Incremental APT decoder fed with audio blocks while the pass is running.
+
+    Decoded lines are appended to a growing image and a preview PNG is
+    rewritten at most once every `preview_interval` seconds, so the image can
+    be watched while it builds up. The preview is written to a temporary file
+    and renamed, a viewer never sees a half written PNG.
+
+    Parameters:
+    rate (float): sample rate of the audio.
+    preview_path (str): PNG rewritten during the pass, None to disable previews.
+    preview_interval (float): minimum number of seconds between two previews.
+    """
+
+    def __init__(self, rate, preview_path=None, preview_interval=10.0):
+        self.envelope_detector = SubcarrierEnvelope(rate)
+        self.sync = LineSync(rate)
+        self.preview_path = preview_path
+        self.preview_interval = preview_interval
+        self.image = np.zeros((1024, APT_LINE_WIDTH), dtype=np.float32)  # grows by doubling
+        self.lines = 0
+        self.last_preview = 0.0
+
+    def feed(self, audio):
+        new_lines = self.sync.feed(self.envelope_detector.process(audio))
+        if len(new_lines):
+            if self.lines + len(new_lines) > len(self.image):
+                grown = np.zeros((max(2 * len(self.image), self.lines + len(new_lines)), APT_LINE_WIDTH), dtype=np.float32)
+                grown[:self.lines] = self.image[:self.lines]
+                self.image = grown
+            self.image[self.lines:self.lines + len(new_lines)] = new_lines
+            self.lines += len(new_lines)
+        if self.preview_path and time.time() - self.last_preview >= self.preview_interval:
+            self.flush(self.preview_path)
+        return new_lines
+
+    def flush(self, path):
+        if not self.lines:
+            return
+        tmp_path = path + ".tmp"
+        save_png(tmp_path, to_uint8(self.image[:self.lines]))
+        os.replace(tmp_path, path)
+        self.last_preview = time.time()
+
+    def run(self, audio_queue, final_path):
+        # Thread body: decode audio blocks until the None sentinel, then write the final image
+        while True:
+            audio = audio_queue.get()
+            if audio is None:
+                break
+            self.feed(audio)
+        self.flush(final_path)
+        if self.preview_path and os.path.exists(self.preview_path):
+            os.remove(self.preview_path)
+        print(f"[Live] >{self.lines} lines, {self.sync.synced_lines} synced, sample clock error {(self.sync.clock_ratio - 1) * 1e6:.0f} ppm")
@@ -0,0 +1,253 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from apt_decoder import APT_WORD_RATE, APT_LINE_WIDTH, SYNC_A, load_png, save_png, to_uint8
+from apt_envelope import APT_SUBCARRIER
+from nfm_dsp import FM_DEVIATION, WIDEBAND_DECIMATION
+from iq_archive import IQArchiveWriter
+from propagation import PropagationBatch, STATION, doppler_offsets
+
+# Synthetic APT passes with known content, for benchmarks and image regression tests:
+#
+#     python apt_synth.py NOAA_19_01-06-24_10-00-00.iqz --satellite "NOAA 19" --seconds 120 --snr 20 --reference ref.png
+#
+# A test image (two channels plus the telemetry wedges, or complete APT lines)
+# is sent at 4160 words/s on the 2400 Hz AM subcarrier, FM modulated with the
+# chosen deviation. The carrier follows the Doppler curve of a real pass of the
+# satellite and Gaussian noise is added for the target SNR. Samples are built one
+# block at a time with array operations only, so a pass takes seconds to make.
+# The IQ is written as an IQ archive like the receivers write them: 'raw'
+# (2.4 MHz uint8, as read from the dongle) or 'decimated' (150 kHz int16, the
+# output of the wideband filter), ready for reprocess.py.
+RAW_RATE = 2.4e6
+FORMATS = {'raw': (RAW_RATE, 'uint8'), 'decimated': (RAW_RATE / WIDEBAND_DECIMATION, 'int16')}
+CHANNEL_WIDTH = 909         # words of image per channel
+# Sync B: 7 cycles of an 832 Hz square wave (3 words high, 2 words low) after black words
+SYNC_B = [0] * 4 + [1, 1, 1, 0, 0] * 7
+PATTERN_LINES = 128         # lines of the test pattern, one telemetry frame
+# Telemetry frame: 16 wedges of 8 lines. 1-8 grey scale, 9 zero modulation, 10-15 temperatures
+# and calibration (fixed plausible values), 16 the wedge matching the AVHRR channel of the image
+TELEMETRY = [k / 8 for k in range(1, 9)] + [0.0, 0.45, 0.45, 0.45, 0.45, 0.3, 0.2]
+CHANNEL_IDS = (2, 4)        # AVHRR channels of image A and B, daytime NOAA default
+SNR_BANDWIDTH = 34e3        # Hz, band of the SNR, the same as SpectrumMonitor
+REFERENCE_RANGE = 850.0     # km, range at which the signal has its nominal amplitude (path loss)
+GEOMETRY_STEP = 1.0         # seconds between propagated positions, interpolated in between
+TRACKING_STEP = 20          # Hz, retune step of a receiver that follows the Doppler (RETUNE_STEP)
+BLOCK_SECONDS = 1.0         # seconds of IQ generated at a time
+TLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt")
+
+
+# Function to build the telemetry wedges of `lines` lines for an image of AVHRR channel `channel_id`
+def telemetry_wedges(lines, channel_id):
+    wedges = np.array(TELEMETRY + [channel_id / 8], dtype=np.float32)
+    return np.repeat(wedges[(np.arange(lines) // 8) % 16, None], 45, axis=1)
+
+# Function to assemble APT lines (rows of 2080 words in [0, 1]) from the images of the two channels
+def apt_frame(channel_a, channel_b, channel_ids=CHANNEL_IDS):
+    lines = len(channel_a)
+    frame = np.zeros((lines, APT_LINE_WIDTH), dtype=np.float32)
+    for start, sync, image, channel_id in ((0, SYNC_A, channel_a, channel_ids[0]), (1040, SYNC_B, channel_b, channel_ids[1])):
+        frame[:, start:start + 39] = sync
+        frame[:, start + 39:start + 86] = 0.0 if start == 0 else 1.0  # space A black, space B white
+        frame[:, start + 86:start + 995] = image
+        frame[:, start + 995:start + 1040] = telemetry_wedges(lines, channel_id)
+    return frame
+
+# Function to build a test pattern: horizontal ramp in channel A, bars in channel B
+def test_pattern(lines=PATTERN_LINES):
+    row = np.arange(lines)[:, None]
+    channel_a = np.broadcast_to(np.linspace(0, 1, CHANNEL_WIDTH, dtype=np.float32), (lines, CHANNEL_WIDTH))
+    channel_b = ((np.arange(CHANNEL_WIDTH) // 101 + row // 16) % 2).astype(np.float32) * 0.8 + 0.1
+    return apt_frame(channel_a, channel_b)
+
+# Function to load a test image (.png or .npy): 2080 words wide is used as complete APT lines,
+# 909 wide goes to both channels, 1818 wide is split between channel A and B
+def load_image(path):
+    image = np.load(path) if path.endswith(".npy") else load_png(path)
+    if image.dtype == np.uint8:
+        image = image.astype(np.float32) / 255
+    elif image.size and (image.min() < 0 or image.max() > 1):
+        # Raw decoder lines (_lines.npy): stretched like the rendered images
+        image = to_uint8(image).astype(np.float32) / 255
+    image = image.astype(np.float32)
+    if image.ndim != 2 or image.shape[1] not in (APT_LINE_WIDTH, CHANNEL_WIDTH, 2 * CHANNEL_WIDTH):
+        raise ValueError(f"{path}: test images are {APT_LINE_WIDTH}, {2 * CHANNEL_WIDTH} or {CHANNEL_WIDTH} pixels wide, "
+                         f"not {image.shape[-1]}")
+    if image.shape[1] == APT_LINE_WIDTH:
+        return image
+    return apt_frame(image[:, :CHANNEL_WIDTH], image[:, -CHANNEL_WIDTH:])
+
+# Function to build the APT audio at the given seconds of the transmission: 2400 Hz subcarrier AM by the words
+def apt_audio(frame, seconds):
+    words = (seconds * APT_WORD_RATE).astype(np.int64)
+    # Levels of the few thousand words spanned, then one small lookup per sample
+    first = words[0] if len(words) else 0
+    levels = 0.05 + 0.9 * frame.ravel()[np.arange(first, words.max(initial=first) + 1) % frame.size]
+    return levels[words - first] * np.sin(2 * np.pi * APT_SUBCARRIER * seconds)
+
+
+class AptSynthesizer:
+    """
+    Generator of the IQ of an APT pass with known content.
+
+    read() returns the next samples of the recording as complex64: the
+    frame sent in a loop from the first sample, FM modulated around the
+    tuned frequency, with the Doppler shift of the satellite (positions
+    every GEOMETRY_STEP, interpolated in between) and complex Gaussian
+    noise. The SNR is the carrier power over the noise in SNR_BANDWIDTH,
+    the way SpectrumMonitor measures it.
+
+    Parameters:
+    frame (array): APT lines (rows of 2080 words in [0, 1]), test_pattern() if None.
+    record: TLE record (tle_store.TLE) or (name, line1, line2), None for no Doppler.
+    frequency (float): carrier frequency in Hz.
+    start (float): POSIX time of the first sample, for the position of the satellite.
+    rate (float): sample rate of the IQ.
+    deviation (float): FM deviation in Hz at full scale of the audio.
+    snr_db (float): SNR in dB, None for no noise.
+    amplitude (float): amplitude of the carrier (full scale is 1).
+    station (tuple): latitude, longitude (degrees) and elevation (m) of the receiving antenna.
+    path_loss (bool): scale the amplitude with REFERENCE_RANGE / range, nothing below the horizon.
+    doppler_corrected (bool): the receiver follows the Doppler in TRACKING_STEP steps, only the residual is left.
+    seed (int): seed of the noise.
+    """
+
+    def __init__(self, frame=None, record=None, frequency=137.1e6, start=0.0, rate=RAW_RATE, deviation=FM_DEVIATION,
+                 snr_db=30.0, amplitude=0.3, station=STATION, path_loss=False, doppler_corrected=False, seed=None):
+        self.frame = test_pattern() if frame is None else np.asarray(frame, dtype=np.float32)
+        self.batch = PropagationBatch([record], station) if record is not None else None
+        self.frequency = frequency
+        self.start = start
+        self.rate = rate
+        self.deviation = deviation
+        self.snr_db = snr_db
+        self.amplitude = amplitude
+        self.path_loss = path_loss
+        self.doppler_corrected = doppler_corrected
+        # Noise power over the whole band for the target SNR in SNR_BANDWIDTH, split between I and Q
+        self.noise = 0.0 if snr_db is None else amplitude * np.sqrt(rate / SNR_BANDWIDTH / 10 ** (snr_db / 10) / 2)
+        self.rng = np.random.default_rng(seed)
+        self.position = 0   # samples generated so far
+        self.cycles = 0.0   # carrier phase at `position`, in cycles
+
+    @property
+    def seconds(self):
+        return self.position / self.rate
+
+    def geometry(self, seconds):
+        # Carrier offset (Hz) and amplitude at seconds of the recording, on the propagation grid
+        if self.batch is None:
+            return np.zeros(len(seconds)), np.full(len(seconds), self.amplitude)
+        azimuth, elevation, distance, range_rate = self.batch.look_angles(self.start + seconds, 0)
+        offset = doppler_offsets(self.frequency, range_rate)
+        if self.doppler_corrected:
+            offset = offset - np.round(offset / TRACKING_STEP) * TRACKING_STEP
+        amplitude = np.full(len(seconds), self.amplitude)
+        if self.path_loss:
+            amplitude = np.where(elevation > 0, self.amplitude * REFERENCE_RANGE / distance, 0.0)
+        return offset, amplitude
+
+    def read(self, count):
+        seconds = (self.position + np.arange(count)) / self.rate
+        grid = np.arange(np.floor(seconds[0] / GEOMETRY_STEP), np.ceil(seconds[-1] / GEOMETRY_STEP) + 1) * GEOMETRY_STEP
+        offsets, amplitudes = self.geometry(grid)
+        frequency = np.interp(seconds, grid, offsets) + self.deviation * apt_audio(self.frame, seconds)
+        cycles = self.cycles + np.cumsum(frequency) / self.rate
+        self.cycles = cycles[-1] % 1
+        self.position += count
+        # Single precision from here on, the phase is wrapped first so nothing is lost
+        phase = (2 * np.pi * (cycles - np.floor(cycles))).astype(np.float32)
+        if self.path_loss:
+            envelope = np.interp(seconds, grid, amplitudes).astype(np.float32)
+        else:
+            envelope = np.float32(self.amplitude)
+        iq = np.empty(count, dtype=np.complex64)
+        iq.real = envelope * np.cos(phase)
+        iq.imag = envelope * np.sin(phase)
+        if self.noise:
+            noise = self.rng.standard_normal(2 * count, dtype=np.float32) * np.float32(self.noise)
+            iq += noise.view(np.complex64)
+        return iq
+
+    def blocks(self, seconds, block_seconds=BLOCK_SECONDS):
+        # Yields the samples of the next `seconds` of the recording, one block at a time
+        remaining = int(round(seconds * self.rate))
+        block = int(block_seconds * self.rate)
+        while remaining > 0:
+            count = min(block, remaining)
+            remaining -= count
+            yield self.read(count)
+
+    def reference(self, seconds):
+        # Lines sent during `seconds` of recording from the start, the ground truth of the decoded image
+        lines = int(seconds * APT_WORD_RATE) // APT_LINE_WIDTH
+        return self.frame[np.arange(lines) % len(self.frame)]
+
+
+# Function to write `seconds` of a synthesizer to an IQ archive in one of FORMATS, returns the seconds it took
+def write_archive(path, synthesizer, seconds, iq_format='raw', **metadata):
+    rate, dtype = FORMATS[iq_format]
+    if synthesizer.rate != rate:
+        raise ValueError(f"{iq_format} archives are at {rate:.0f} Hz, the synthesizer runs at {synthesizer.rate:.0f} Hz")
+    clock = time.perf_counter()
+    with IQArchiveWriter(path, rate, dtype, synthetic=True, snr_db=synthesizer.snr_db, deviation=synthesizer.deviation,
+                         center_freq=synthesizer.frequency, doppler_corrected=synthesizer.doppler_corrected,
+                         start_time=datetime.fromtimestamp(synthesizer.start, timezone.utc).isoformat(), **metadata) as archive:
+        for block in synthesizer.blocks(seconds):
+            archive.write(block)
+    return time.perf_counter() - clock
+
+# Function to pick the best pass of a satellite in the day after its TLE epoch, returns the POSIX time of its culmination
+def best_culmination(record, station=STATION):
+    epoch = record.epoch
+    passes = PropagationBatch([record], station).passes(epoch, epoch + timedelta(days=1))
+    if not passes:
+        raise ValueError(f"{record.name} does not pass over the station in the day after its TLE epoch")
+    return max(passes, key=lambda p: p.max_elevation).culmination.timestamp()
+
+
+def main(argv=None):
+    from tle_store import TLEStore
+    from reprocess import FREQUENCIES
+    parser = argparse.ArgumentParser(description="Write the IQ of a synthetic APT pass with known content.")
+    parser.add_argument("output", help="IQ archive to write (.iqz)")
+    parser.add_argument("--satellite", default="NOAA 19", help="satellite whose TLE gives the Doppler curve")
+    parser.add_argument("--tle", default=TLE_PATH, help="TLE store")
+    parser.add_argument("--time", help="UTC time of the middle of the recording, ISO format (default: culmination of "
+                                       "the best pass in the day after the TLE epoch)")
+    parser.add_argument("--seconds", type=float, default=60, help="length of the recording")
+    parser.add_argument("--format", choices=sorted(FORMATS), default='decimated', help="IQ archive format")
+    parser.add_argument("--snr", type=float, default=30, help=f"SNR in dB over {SNR_BANDWIDTH / 1e3:.0f} kHz")
+    parser.add_argument("--deviation", type=float, default=FM_DEVIATION, help="FM deviation in Hz")
+    parser.add_argument("--image", help="test image (.png or .npy), the test pattern if not given")
+    parser.add_argument("--path-loss", action="store_true", help="scale the signal with the range of the satellite")
+    parser.add_argument("--doppler-corrected", action="store_true", help="leave only the residual of a receiver tracking the Doppler")
+    parser.add_argument("--no-doppler", action="store_true", help="carrier on the nominal frequency")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the noise")
+    parser.add_argument("--reference", help="write the lines sent to this PNG, the reference of the decoded image")
+    args = parser.parse_args(argv)
+
+    record = TLEStore(args.tle).get(args.satellite)
+    if args.time:
+        middle = datetime.fromisoformat(args.time)
+        middle = (middle if middle.tzinfo else middle.replace(tzinfo=timezone.utc)).timestamp()
+    else:
+        middle = best_culmination(record)
+    rate, dtype = FORMATS[args.format]
+    synthesizer = AptSynthesizer(load_image(args.image) if args.image else None, None if args.no_doppler else record,
+                                 FREQUENCIES.get(record.name, 137.1e6), middle - args.seconds / 2, rate, args.deviation,
+                                 args.snr, path_loss=args.path_loss, doppler_corrected=args.doppler_corrected, seed=args.seed)
+    elapsed = write_archive(args.output, synthesizer, args.seconds, args.format, satellite=record.name,
+                            tle=[record.line1, record.line2])
+    print(f"[Synth] >{args.seconds:.0f} s of {args.format} IQ at {rate / 1e3:.0f} kHz in {elapsed:.1f} s "
+          f"({args.seconds / elapsed:.1f}x real time) -> {args.output}")
+    if args.reference:
+        save_png(args.reference, to_uint8(synthesizer.reference(args.seconds), 0, 1))
+    return 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+
+
+class BackgroundWriter:
+    """
+    File writer that moves disk I/O off the DSP thread.
+
+    write() copies the data into one of `buffers` preallocated buffers (no
+    tobytes() copy) and returns; when a buffer is full it is handed to a
+    writer thread, which writes it from a memoryview and gives it back. The
+    caller only blocks if every buffer is waiting for the disk (a stall).
+    Behaves like a binary file: write(), tell(), flush(), close().
+
+    Parameters:
+    path (str): output file.
+    buffer_size (int): bytes per buffer.
+    buffers (int): number of buffers (2 = double, 3 = triple buffering).
+    fsync_interval (float): seconds between two fsync, 0 after every buffer, None never.
+    drop_cache (bool): sync and posix_fadvise(DONTNEED) every buffer so it leaves the page cache.
+    metrics (PipelineMetrics): optional, receives the 'disk_write' latencies.
+    """
+
+    def __init__(self, path, buffer_size=4 << 20, buffers=3, fsync_interval=None, drop_cache=False, metrics=None):
+        self.file = open(path, "wb", buffering=0)
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self.drop_cache = drop_cache and hasattr(os, "posix_fadvise")
+        self.metrics = metrics
+        self.free = queue.Queue()
+        for _ in range(buffers):
+            self.free.put(bytearray(buffer_size))
+        self.full = queue.Queue()
+        self.current = self.free.get()
+        self.fill = 0
+        self.position = 0        # bytes accepted by write()
+        self.written = 0         # bytes on disk
+        self.last_fsync = time.time()
+        self.latencies = []
+        self.stalls = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="background-writer", daemon=True)
+        self.thread.start()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        view = memoryview(data).cast("B")
+        size = len(view)
+        while len(view):
+            n = min(len(view), self.buffer_size - self.fill)
+            self.current[self.fill:self.fill + n] = view[:n]
+            self.fill += n
+            view = view[n:]
+            if self.fill == self.buffer_size:
+                self._submit()
+        self.position += size
+        return size
+
+    def _submit(self):
+        self.full.put((self.current, self.fill))
+        try:
+            self.current = self.free.get_nowait()
+        except queue.Empty:
+            # Every buffer is waiting for the disk
+            self.stalls += 1
+            self.current = self.free.get()
+        self.fill = 0
+
+    def flush(self):
+        if self.fill:
+            self._submit()
+
+    def _run(self):
+        while True:
+            item = self.full.get()
+            if item is None:
+                break
+            buffer, n = item
+            try:
+                start = time.perf_counter()
+                view = memoryview(buffer)[:n]
+                while len(view):
+                    view = view[self.file.write(view):]
+                offset = self.written
+                self.written += n
+                if self.fsync_interval is not None and time.time() - self.last_fsync >= self.fsync_interval:
+                    os.fsync(self.file.fileno())
+                    self.last_fsync = time.time()
+                if self.drop_cache:
+                    # Only clean pages can be dropped, so the buffer is synced first
+                    os.fdatasync(self.file.fileno())
+                    os.posix_fadvise(self.file.fileno(), offset, n, os.POSIX_FADV_DONTNEED)
+                latency = time.perf_counter() - start
+                self.latencies.append(latency)
+                if self.metrics is not None:
+                    self.metrics.record("disk_write", latency)
+            except OSError as e:
+                self.error = e
+            self.free.put(buffer)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.full.put(None)
+        self.thread.join()
+        if self.fsync_interval is not None:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {"writes": len(self.latencies), "bytes": self.written, "stalls": self.stalls,
+                "p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(latencies.max())}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
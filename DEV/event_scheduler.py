@@ -0,0 +1,140 @@
+import time
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+
+class ScheduledEvent:
+    """
+    One planned run of a coroutine function, returned by EventScheduler.at().
+
+    Attributes:
+    when (float): planned start, POSIX timestamp.
+    name (str): shown in logs and in the countdown.
+    tag (str): groups events that are re-planned together (e.g. 'capture').
+    late (float): seconds between the planned and the actual start, once started.
+    """
+
+    def __init__(self, when, action, name, tag):
+        self.when = when
+        self.action = action
+        self.name = name
+        self.tag = tag
+        self.cancelled = False
+        self.started = False
+        self.late = None
+        self.task = None
+
+    @property
+    def time(self):
+        return datetime.fromtimestamp(self.when, timezone.utc)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventScheduler:
+    """
+    Asyncio scheduler that sleeps until the next planned event.
+
+    Events are kept in a heap ordered by start time. run() sleeps on the
+    event loop timer until the first one is due and starts it as a task, so
+    a job starts within a few milliseconds of its time instead of at the
+    next poll. Planning or cancelling an event wakes run() up to recompute
+    the sleep. Long sleeps are cut in slices of `max_sleep` seconds, so a
+    wall clock step (NTP, suspend) only delays the next event by one slice
+    at most. Behaves the same on every platform, nothing is left to cron or
+    to the task scheduler of the OS.
+
+    Parameters:
+    max_sleep (float): longest sleep before the wall clock is read again.
+    """
+
+    def __init__(self, max_sleep=60.0):
+        self.max_sleep = max_sleep
+        self.heap = []
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+        self.tasks = set()
+
+    def at(self, when, action, name=None, tag=None):
+        # when: aware datetime or POSIX timestamp, action: coroutine function without arguments
+        if isinstance(when, datetime):
+            when = when.timestamp()
+        event = ScheduledEvent(when, action, name or getattr(action, "__name__", "event"), tag)
+        heapq.heappush(self.heap, (when, next(self.counter), event))
+        self.changed.set()
+        return event
+
+    def after(self, delay, action, name=None, tag=None):
+        return self.at(time.time() + delay, action, name, tag)
+
+    def every(self, interval, action, name=None, tag=None, first=None):
+        # Drift free: every run is planned from the previous planned time, not from when it ended
+        async def repeat():
+            nonlocal event
+            event = self.at(event.when + interval, repeat, event.name, tag)
+            await action()
+        event = self.at(time.time() if first is None else first, repeat, name or getattr(action, "__name__", "event"), tag)
+        return event
+
+    def cancel(self, tag):
+        # Cancel the planned events of a tag, events already started keep running
+        cancelled = 0
+        for when, count, event in self.heap:
+            if event.tag == tag and not event.cancelled:
+                event.cancel()
+                cancelled += 1
+        self.changed.set()
+        return cancelled
+
+    def planned(self, tag=None):
+        return sorted((event for when, count, event in self.heap
+                       if not event.cancelled and (tag is None or event.tag == tag)), key=lambda event: event.when)
+
+    @property
+    def next_event(self):
+        planned = self.planned()
+        return planned[0] if planned else None
+
+    async def run(self):
+        while True:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            self.changed.clear()
+            if not self.heap:
+                await self.changed.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(delay, self.max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            when, count, event = heapq.heappop(self.heap)
+            self._start(event)
+
+    def _start(self, event):
+        event.started = True
+        event.late = time.time() - event.when
+        if event.late > 1:
+            print(f"\n[Scheduler] >{event.name} started {event.late:.1f} s late")
+        event.task = asyncio.create_task(self._run_event(event), name=event.name)
+        self.tasks.add(event.task)
+        event.task.add_done_callback(self.tasks.discard)
+
+    async def _run_event(self, event):
+        try:
+            await event.action()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # One failing job must not stop the scheduler
+            print(f"\n[Scheduler] >{event.name} failed: {type(e).__name__}: {e}")
+
+    async def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
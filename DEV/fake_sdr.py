@@ -0,0 +1,221 @@
+import time
+import asyncio
+import numpy as np
+from nfm_dsp import FM_DEVIATION
+from apt_synth import REFERENCE_RANGE, apt_audio, test_pattern
+from propagation import PropagationBatch, STATION, doppler_offsets
+
+FAKE_SERIALS = ["00000001", "00000002"]  # serials reported when listing fake devices
+DEFAULT_TRANSMITTERS = {'NOAA 15': 137.62e6, 'NOAA 18': 137.9125e6, 'NOAA 19': 137.1e6}
+
+
+class Transmitter:
+    """
+    APT transmitter of a satellite, seen from a station.
+
+    Parameters:
+    record: TLE record (tle_store.TLE) or (name, line1, line2).
+    frequency (float): carrier frequency in Hz.
+    station (tuple): latitude, longitude (degrees) and elevation (m) of the receiving antenna.
+    amplitude (float): carrier amplitude at REFERENCE_RANGE, full scale of the ADC is 1.
+    frame (array): APT lines (rows of 2080 words in [0, 1]) sent in a loop, apt_synth.test_pattern() if None.
+    """
+
+    def __init__(self, record, frequency, station=STATION, amplitude=0.3, frame=None):
+        self.batch = PropagationBatch([record], station)
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.frame = test_pattern() if frame is None else frame
+
+    def geometry(self, timestamps):
+        # Received frequency (Hz) and amplitude at two times, the signal is interpolated in between
+        azimuth, elevation, distance, range_rate = self.batch.look_angles(np.asarray(timestamps, dtype=float), 0)
+        frequency = self.frequency + doppler_offsets(self.frequency, range_rate)
+        amplitude = np.where(elevation > 0, self.amplitude * REFERENCE_RANGE / distance, 0.0)
+        return frequency, amplitude
+
+    def audio(self, seconds):
+        # APT audio at the given seconds of the stream
+        return apt_audio(self.frame, seconds)
+
+
+class FakeRtlSdr:
+    """
+    Simulated RTL-SDR, drop-in for rtlsdr.RtlSdr on machines without a dongle.
+
+    Implements read_samples, read_bytes, read_samples_async, stream(),
+    set_center_freq and the sample_rate, center_freq, gain and
+    freq_correction attributes. Samples are complex Gaussian noise plus
+    the FM APT signal of every transmitter inside the tuned band, with the
+    Doppler shift and the path loss of its position at that time. Samples
+    go through the 8-bit ADC, so too much gain clips like the real thing.
+    Reads block for the time the hardware would take (realtime=True), the
+    stream clock starts at `epoch`.
+
+    Faults can be injected: USB drops lose samples (the read comes back
+    short) or fail the read with IOError, retunes block for a while and
+    only take effect once done.
+
+    Parameters:
+    device_index (int): picks one of FAKE_SERIALS when no serial is given.
+    serial_number (str): serial number reported by the device.
+    transmitters (list): Transmitter objects, none for noise only.
+    realtime (bool): pace reads like the hardware, False to return at once.
+    epoch (float): POSIX time of the first sample, now if None.
+    noise (float): standard deviation of I and Q at 30 dB gain.
+    ppm_error (float): actual error of the crystal, corrected by freq_correction.
+    drop_rate (float): probability that a read loses samples.
+    error_rate (float): probability that a read fails with IOError.
+    retune_latency (float): seconds set_center_freq blocks, the tuner settles at the end.
+    seed (int): seed of the noise and of the faults.
+    """
+
+    def __init__(self, device_index=0, serial_number=None, transmitters=(), realtime=True, epoch=None, noise=0.05,
+                 ppm_error=0.0, drop_rate=0.0, error_rate=0.0, retune_latency=0.0, seed=None):
+        self.serial = serial_number or FAKE_SERIALS[device_index % len(FAKE_SERIALS)]
+        self.transmitters = list(transmitters)
+        self.realtime = realtime
+        self.epoch = time.time() if epoch is None else epoch
+        self.noise = noise
+        self.ppm_error = ppm_error
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.retune_latency = retune_latency
+        self.rng = np.random.default_rng(seed)
+        self.sample_rate = 2.4e6
+        self.center_freq = 100e6
+        self.freq_correction = 0
+        self.gain = 'auto'
+        self.bias_tee = False
+        self.closed = False
+        self.position = 0           # samples since the epoch, lost ones included
+        self.phases = {}            # transmitter -> phase of its signal at `position`
+        self.next_read = None
+        self.streaming = False
+        self.stats = {"reads": 0, "dropped_samples": 0, "errors": 0, "clipped_values": 0, "retunes": 0}
+
+    @staticmethod
+    def get_device_serial_addresses():
+        return list(FAKE_SERIALS)
+
+    def set_center_freq(self, frequency):
+        # The tuner takes retune_latency to settle, the new frequency only applies after that
+        if self.retune_latency:
+            time.sleep(self.retune_latency)
+        self.center_freq = frequency
+        self.stats["retunes"] += 1
+
+    def get_center_freq(self):
+        return self.center_freq
+
+    def set_bias_tee(self, enabled):
+        self.bias_tee = bool(enabled)
+
+    @property
+    def gain_scale(self):
+        # `noise` and the amplitudes are those at 30 dB, which is also what 'auto' gives
+        gain = 30.0 if self.gain == 'auto' else float(self.gain)
+        return 10 ** ((gain - 30.0) / 20)
+
+    def _deadline(self, num_samples):
+        # Time the last of num_samples arrives, counted from the previous read unless the reader fell behind
+        now = time.monotonic()
+        if self.next_read is None or self.next_read < now:
+            self.next_read = now
+        self.next_read += num_samples / self.sample_rate
+        return self.next_read
+
+    def _signal(self, start, num_samples):
+        # Noise and signal of `num_samples` samples from sample `start` of the stream, interleaved I and Q
+        rate = self.sample_rate
+        iq = self.rng.standard_normal(2 * num_samples, dtype=np.float32) * np.float32(self.noise)
+        # The local oscillator is off by the uncorrected part of the crystal error
+        oscillator = self.center_freq * (1 + (self.ppm_error - self.freq_correction) * 1e-6)
+        seconds = (start + np.arange(num_samples)) / rate
+        for transmitter in self.transmitters:
+            frequency, amplitude = transmitter.geometry(self.epoch + np.array([seconds[0], seconds[-1]]))
+            if abs(frequency[0] - oscillator) > rate / 2 or not amplitude.any():
+                self.phases.pop(transmitter, None)
+                continue
+            # Carrier offset and amplitude move linearly over one read
+            ramp = np.linspace(0, 1, num_samples)
+            offset = (frequency[0] - oscillator) + (frequency[1] - frequency[0]) * ramp
+            deviation = FM_DEVIATION * transmitter.audio(seconds)
+            phase = self.phases.get(transmitter, 0.0) + 2 * np.pi * np.cumsum(offset + deviation) / rate
+            self.phases[transmitter] = phase[-1] % (2 * np.pi)
+            # Single precision from here on, the phase is wrapped first so nothing is lost
+            phase = (phase % (2 * np.pi)).astype(np.float32)
+            envelope = (amplitude[0] + (amplitude[1] - amplitude[0]) * ramp).astype(np.float32)
+            iq[0::2] += envelope * np.cos(phase)
+            iq[1::2] += envelope * np.sin(phase)
+        return iq * np.float32(self.gain_scale)
+
+    def _adc(self, iq):
+        # 8-bit ADC: quantize I and Q to 0..255, clipping everything beyond full scale
+        codes = np.round(iq * np.float32(127.5) + np.float32(127.5))
+        self.stats["clipped_values"] += int(np.count_nonzero((codes < 0) | (codes > 255)))
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _read(self, num_samples):
+        if self.closed:
+            raise IOError("device closed")
+        deadline = self._deadline(num_samples)
+        self.stats["reads"] += 1
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            self.position += num_samples
+            self._wait(deadline)
+            raise IOError("LIBUSB_ERROR_IO: simulated USB failure")
+        start = self.position
+        self.position += num_samples
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            # USB overflow: the tail of the transfer is lost
+            kept = int(num_samples * self.rng.uniform(0.2, 0.9))
+            self.stats["dropped_samples"] += num_samples - kept
+            num_samples = kept
+        codes = self._adc(self._signal(start, num_samples))
+        # The samples are computed while the hardware would be receiving them
+        self._wait(deadline)
+        return codes
+
+    def _wait(self, deadline):
+        if self.realtime:
+            time.sleep(max(0, deadline - time.monotonic()))
+
+    def read_bytes(self, num_bytes=2048):
+        # Interleaved unsigned 8-bit I and Q, as delivered over USB
+        return bytearray(self._read(num_bytes // 2).tobytes())
+
+    def read_samples(self, num_samples=1024):
+        codes = self._read(num_samples).astype(np.float64)
+        # Same scaling as pyrtlsdr: codes 0..255 to [-1, 1]
+        return (codes / 127.5 - 1).view(np.complex128)
+
+    def read_samples_async(self, callback, num_samples=1024, context=None):
+        # Blocks, calling callback(samples, context) for every buffer until cancel_read_async()
+        self.streaming = True
+        while self.streaming:
+            callback(self.read_samples(num_samples), context)
+
+    def cancel_read_async(self):
+        self.streaming = False
+
+    async def stream(self, num_samples_or_bytes=131072, format='samples'):
+        # Async generator like RtlSdrAio.stream(), reads run in a thread
+        loop = asyncio.get_running_loop()
+        read = self.read_samples if format == 'samples' else self.read_bytes
+        self.streaming = True
+        while self.streaming:
+            yield await loop.run_in_executor(None, read, num_samples_or_bytes)
+
+    async def stop(self):
+        self.streaming = False
+
+    def close(self):
+        self.closed = True
+
+
+# Function to build the transmitters of the NOAA satellites from a TLE store
+def default_transmitters(store, station=STATION):
+    return [Transmitter(store.get(name), frequency, station) for name, frequency in DEFAULT_TRANSMITTERS.items()
+            if name in store]
@@ -0,0 +1,131 @@
+import numpy as np
+from fractions import Fraction
+from scipy import fft
+from scipy.signal import firwin
+
+
+# Function to design a lowpass FIR for the overlap-save filter
+def lowpass_taps(cutoff, fs, numtaps=255, window='blackman'):
+    return firwin(numtaps, cutoff, fs=fs, window=window).astype(np.float32)
+
+# Function to design a bandpass FIR for the overlap-save filter
+def bandpass_taps(lowcut, highcut, fs, numtaps=255, window='blackman'):
+    return firwin(numtaps, [lowcut, highcut], pass_zero=False, fs=fs, window=window).astype(np.float32)
+
+
+class OverlapSaveFilter:
+    """
+    Streaming FIR filter using FFT overlap-save.
+
+    The filter keeps the last len(taps)-1 input samples between calls, so a
+    stream can be fed chunk by chunk and the output is identical to filtering
+    the whole recording at once. Every call returns one output sample per input
+    sample (or one every `decimation` samples), with no extra latency besides
+    the group delay of the taps.
+
+    Parameters:
+    taps (numpy array): FIR coefficients, e.g. from lowpass_taps().
+    decimation (int): keep one output sample every `decimation`.
+    complex_input (bool): True for IQ (complex64), False for audio (float32).
+    nfft (int): FFT size, defaults to a power of two >= 8 * len(taps).
+    batch (int): number of FFT blocks transformed together in one call.
+    """
+
+    def __init__(self, taps, decimation=1, complex_input=True, nfft=None, batch=64):
+        self.taps = np.asarray(taps, dtype=np.float32)
+        self.numtaps = len(self.taps)
+        self.decimation = int(decimation)
+        self.complex_input = complex_input
+        if nfft is None:
+            nfft = 1 << int(np.ceil(np.log2(8 * self.numtaps)))
+        if nfft < self.numtaps:
+            raise ValueError(f"nfft ({nfft}) must be at least the number of taps ({self.numtaps})")
+        self.nfft = nfft
+        self.step = nfft - self.numtaps + 1  # new samples consumed per FFT block
+        self.batch = batch
+        self.dtype = np.complex64 if complex_input else np.float32
+
+        # Frequency response computed once and reused for every block
+        if complex_input:
+            self.H = fft.fft(self.taps, nfft).astype(np.complex64)
+        else:
+            self.H = fft.rfft(self.taps, nfft).astype(np.complex64)
+
+        # Preallocated work buffer: filter history followed by one batch of new samples
+        self.buffer = np.zeros(self.numtaps - 1 + batch * self.step, dtype=self.dtype)
+        self.phase = 0  # decimation phase carried across chunks
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.phase = 0
+
+    def _filter_batch(self, nblocks):
+        # Strided view of `nblocks` overlapping segments of length nfft, transformed in one call
+        segments = np.lib.stride_tricks.as_strided(
+            self.buffer, shape=(nblocks, self.nfft),
+            strides=(self.step * self.buffer.itemsize, self.buffer.itemsize), writeable=False)
+        if self.complex_input:
+            spectrum = fft.fft(segments, axis=1, workers=-1)
+            spectrum *= self.H
+            out = fft.ifft(spectrum, axis=1, overwrite_x=True, workers=-1)
+        else:
+            spectrum = fft.rfft(segments, axis=1, workers=-1)
+            spectrum *= self.H
+            out = fft.irfft(spectrum, self.nfft, axis=1, overwrite_x=True, workers=-1)
+        # The first numtaps-1 outputs of every block are circular-convolution garbage
+        return out[:, self.numtaps - 1:].astype(self.dtype, copy=False).reshape(-1)
+
+    def filter(self, data):
+        data = np.asarray(data, dtype=self.dtype)
+        history = self.numtaps - 1
+        out = np.empty(len(data), dtype=self.dtype)
+        pos = 0
+        while pos < len(data):
+            n = min(len(data) - pos, self.batch * self.step)
+            nblocks = -(-n // self.step)
+            self.buffer[history:history + n] = data[pos:pos + n]
+            # Zero padding past the end of the data does not affect the valid outputs
+            self.buffer[history + n:] = 0
+            out[pos:pos + n] = self._filter_batch(nblocks)[:n]
+            # Keep the last numtaps-1 real input samples as history for the next batch
+            if history:
+                self.buffer[:history] = self.buffer[n:n + history]
+            pos += n
+
+        if self.decimation > 1:
+            out = out[self.phase::self.decimation]
+            self.phase = (self.phase - len(data)) % self.decimation
+        return out
+
+
+class StreamingResampler:
+    """
+    Streaming rational resampler for real signals.
+
+    The input is zero-stuffed by `up`, lowpass filtered by an overlap-save
+    FIR at up * rate and decimated by `down`. Filter history and decimation
+    phase carry over from one call to the next, so a long recording can be
+    converted block by block with the same result as in one piece.
+
+    Parameters:
+    rate (float): sample rate of the input.
+    out_rate (float): sample rate of the output, up/down is the closest fraction with a denominator up to max_denominator.
+    cutoff (float): lowpass cutoff, below out_rate / 2.
+    numtaps (int): length of the FIR at the upsampled rate.
+    max_denominator (int): largest decimation factor considered.
+    """
+
+    def __init__(self, rate, out_rate, cutoff, numtaps=8191, max_denominator=1000):
+        ratio = Fraction(out_rate / rate).limit_denominator(max_denominator)
+        self.up, self.down = ratio.numerator, ratio.denominator
+        self.filter = OverlapSaveFilter(lowpass_taps(cutoff, rate * self.up, numtaps=numtaps), decimation=self.down,
+                                        complex_input=False)
+
+    def process(self, data):
+        data = np.asarray(data, dtype=np.float32)
+        if self.up > 1:
+            # Zero stuffing divides the level by `up`, restored here
+            stuffed = np.zeros(len(data) * self.up, dtype=np.float32)
+            stuffed[::self.up] = data * self.up
+            data = stuffed
+        return self.filter.filter(data)
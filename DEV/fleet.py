@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import hmac
+import time
+import asyncio
+import secrets
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from tle_store import TLEStore
+from propagation import PropagationBatch
+
+# Fleet of ground stations, one agent (pass.py --agent) per station:
+#
+#     {"satellites": {"NOAA 15": "137.6200", ...},
+#      "stations": [{"name": "home", "location": [44.384477, 7.542671, 500], "address": "192.168.1.20:7355",
+#                    "devices": 2, "min_elevation": 30}, ...]}
+#
+# The coordinator predicts the passes of every satellite from every station in
+# one propagation, gives each pass to a single station (the one with the best
+# elevation that still has a free dongle at that time) and pushes to every
+# agent its plan. Agents replace their planned captures with the plan they get.
+#
+# Protocol: TCP, one JSON object per line. The coordinator sends
+# {"type": "plan", "token": ..., "station": ..., "generated": ..., "passes": [...]}
+# and the agent answers {"ok": true, "accepted": n} (or {"ok": false, "error": ...}).
+# The token is shared by the coordinator and the agents (environment variable
+# TOKEN_ENV), agents refuse the messages without it.
+FLEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet.json")
+AGENT_PORT = 7355           # default port of the agents
+TOKEN_ENV = "NOAA_FLEET_TOKEN"  # environment variable holding the token of the fleet
+PUSH_TIMEOUT = 10           # seconds to connect, send a plan and get the answer
+HORIZON = 5                 # degrees, AOS and LOS of a pass
+SATELLITES = {'NOAA 15': '137.6200', 'NOAA 18': '137.9125', 'NOAA 19': '137.1000'}
+
+
+class Station:
+    """
+    One ground station of the fleet.
+
+    Parameters:
+    name (str): unique name, also the station label of its metrics and catalog.
+    location (tuple): latitude, longitude (degrees) and elevation (m) of the antenna.
+    address (str): host:port of its agent.
+    devices (int): dongles, passes the station can capture at the same time.
+    min_elevation (float): passes culminating lower are not worth capturing there.
+    """
+
+    def __init__(self, name, location, address=None, devices=1, min_elevation=30):
+        self.name = name
+        self.location = tuple(location)
+        self.address = address or f"127.0.0.1:{AGENT_PORT}"
+        self.devices = devices
+        self.min_elevation = min_elevation
+
+    def __repr__(self):
+        return f"Station({self.name!r}, {self.address})"
+
+
+# Function to read the fleet configuration, returns the stations and the satellites with their frequency
+def load_fleet(path=FLEET_PATH):
+    with open(path) as f:
+        config = json.load(f)
+    stations = [Station(**entry) for entry in config["stations"]]
+    if len({station.name for station in stations}) != len(stations):
+        raise ValueError(f"{path}: station names must be unique")
+    return stations, config.get("satellites", SATELLITES)
+
+# Function to predict the passes of every satellite over every station, grouped by pass
+def predict(batch, stations, start, end):
+    per_station = batch.passes_from([station.location for station in stations], start, end, HORIZON)
+    # The same pass seen from several stations overlaps in time: one group per satellite pass
+    candidates = sorted(((p, station) for station, passes in zip(stations, per_station) for p in passes
+                         if p.max_elevation >= station.min_elevation), key=lambda c: (c[0].norad, c[0].rise))
+    groups = []
+    for p, station in candidates:
+        last = groups[-1] if groups else None
+        if last and last[0][0].norad == p.norad and p.rise < max(c[0].set for c in last):
+            last.append((p, station))
+        else:
+            groups.append([(p, station)])
+    return sorted(groups, key=lambda group: min(c[0].rise for c in group))
+
+# Function to assign every pass to one station, best elevation first among the stations with a free dongle
+def assign(groups, stations):
+    busy = {station.name: [] for station in stations}  # (rise, set) of the captures given to a station
+    plans = {station.name: [] for station in stations}
+    missed = []
+    for group in groups:
+        for p, station in sorted(group, key=lambda c: (-c[0].max_elevation, -(c[0].set - c[0].rise).total_seconds())):
+            if station.name not in plans:
+                continue
+            overlapping = sum(1 for rise, los in busy[station.name] if rise < p.set and p.rise < los)
+            if overlapping < station.devices:
+                busy[station.name].append((p.rise, p.set))
+                plans[station.name].append(p)
+                break
+        else:
+            missed.append(group[0][0])
+    return plans, missed
+
+# Function to build the message sent to an agent
+def plan_message(station, passes, satellites, store):
+    entries = []
+    for p in sorted(passes, key=lambda p: p.rise):
+        record = store.get(p.norad)
+        entries.append({"satellite": p.name, "norad": p.norad, "frequency": satellites[p.name],
+                        "rise": p.rise.isoformat(), "culmination": p.culmination.isoformat(), "set": p.set.isoformat(),
+                        "max_elevation": round(p.max_elevation, 1), "line1": record.line1, "line2": record.line2})
+    return {"type": "plan", "station": station.name, "location": list(station.location),
+            "generated": datetime.now(timezone.utc).isoformat(), "passes": entries}
+
+# Function to send a message to an agent and wait for its answer
+async def send(address, message, timeout=PUSH_TIMEOUT):
+    host, port = address.rsplit(":", 1)
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+            return json.loads(await reader.readline())
+        finally:
+            writer.close()
+    return await asyncio.wait_for(exchange(), timeout)
+
+# Function to serve plans to a handler (coroutine function: message -> answer) until cancelled, only to
+# the messages carrying the token (None: any message) sent from one of the peers (IP addresses, None: any host)
+async def serve_plans(host, port, handler, token=None, peers=None):
+    async def client(reader, writer):
+        try:
+            line = await reader.readline()
+            peer = writer.get_extra_info("peername")[0]
+            try:
+                message = json.loads(line)
+                if (peers and peer not in peers) or \
+                   (token is not None and not hmac.compare_digest(str(message.pop("token", "")), token)):
+                    print(f"[Fleet] >message from {peer} refused")
+                    answer = {"ok": False, "error": "unauthorized"}
+                else:
+                    answer = await handler(message)
+            except Exception as e:
+                answer = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(answer).encode() + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        await server.serve_forever()
+
+# Function to plan the whole fleet and push the plans, stations that cannot be reached get nothing
+async def coordinate(stations, satellites, store, hours=24, token=None):
+    batch = PropagationBatch([store.get(name) for name in satellites])
+    start = datetime.now(timezone.utc)
+    clock = time.perf_counter()
+    groups = predict(batch, stations, start, start + timedelta(hours=hours))
+    print(f"[Fleet] >{len(groups)} passes over {len(stations)} stations predicted in {time.perf_counter() - clock:.2f} s")
+    reachable = list(stations)
+    while True:
+        plans, missed = assign(groups, reachable)
+        messages = [dict(plan_message(station, plans[station.name], satellites, store), token=token) for station in reachable]
+        answers = await asyncio.gather(*(send(station.address, message) for station, message in zip(reachable, messages)),
+                                       return_exceptions=True)
+        failed = []
+        for station, answer in zip(reachable, answers):
+            if isinstance(answer, Exception) or not answer.get("ok"):
+                error = answer if isinstance(answer, Exception) else answer.get("error")
+                print(f"[Fleet] >{station.name} ({station.address}) did not take its plan: {error}")
+                failed.append(station)
+            else:
+                print(f"[Fleet] >{station.name}: {answer.get('accepted', 0)} captures planned")
+        if not failed:
+            break
+        # Give the passes of the stations that did not answer to the others
+        reachable = [station for station in reachable if station not in failed]
+        if not reachable:
+            return {}, [group[0][0] for group in groups]
+    for p in missed:
+        print(f"[Fleet] >not captured (no free station): {p.name} {p.rise:%d/%m %H:%M:%S} max elevation {p.max_elevation:.0f}°")
+    return plans, missed
+
+
+# Function to run a stand-in agent that only records the plans it gets, for tests without stations
+def stand_in_agent(name, port, log_path=None, token=None):
+    async def handler(message):
+        if message.get("type") != "plan":
+            return {"ok": False, "error": f"unknown message {message.get('type')}"}
+        now = datetime.now(timezone.utc)
+        accepted = [entry for entry in message["passes"] if datetime.fromisoformat(entry["rise"]) > now]
+        print(f"[Agent {name}] >plan with {len(accepted)} captures")
+        if log_path:
+            with open(log_path, "a") as f:
+                f.write(json.dumps(message) + "\n")
+        return {"ok": True, "accepted": len(accepted)}
+    try:
+        asyncio.run(serve_plans("127.0.0.1", port, handler, token))
+    except KeyboardInterrupt:
+        pass
+
+# Function to start one stand-in agent process per station, on local ports from base_port
+def start_stand_ins(stations, base_port, log_dir=None, token=None):
+    processes = []
+    for i, station in enumerate(stations):
+        station.address = f"127.0.0.1:{base_port + i}"
+        log_path = os.path.join(log_dir, f"{station.name}.jsonl") if log_dir else None
+        process = multiprocessing.Process(target=stand_in_agent, args=(station.name, base_port + i, log_path, token), daemon=True)
+        process.start()
+        processes.append(process)
+    # Wait until every stand-in listens
+    deadline = time.time() + 10
+    for station in stations:
+        while True:
+            try:
+                asyncio.run(send(station.address, {"type": "ping", "token": token}, timeout=1))
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+    return processes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan the passes of the whole fleet and push them to the stations.")
+    parser.add_argument("--fleet", default=FLEET_PATH, help="fleet configuration (JSON)")
+    parser.add_argument("--tle", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt"), help="TLE store")
+    parser.add_argument("--hours", type=float, default=24, help="planning window from now")
+    parser.add_argument("--local", type=int, metavar="PORT", help="run a stand-in agent per station on local ports from PORT")
+    args = parser.parse_args(argv)
+
+    # The stand-ins share a token of their own when the fleet has none
+    token = os.environ.get(TOKEN_ENV) or (secrets.token_hex(16) if args.local else None)
+    if not token:
+        parser.error(f"set {TOKEN_ENV} to the token of the fleet agents")
+    stations, satellites = load_fleet(args.fleet)
+    processes = start_stand_ins(stations, args.local, token=token) if args.local else []
+    try:
+        plans, missed = asyncio.run(coordinate(stations, satellites, TLEStore(args.tle), args.hours, token))
+    finally:
+        for process in processes:
+            process.terminate()
+    return 1 if not plans else 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
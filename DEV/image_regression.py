@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from datetime import datetime, timezone
+from scipy.ndimage import gaussian_filter
+from apt_decoder import load_png, to_uint8
+from apt_synth import AptSynthesizer, FORMATS, TLE_PATH, best_culmination, write_archive
+from reprocess import reprocess_pass, stage_paths, FREQUENCIES
+
+# Image fidelity against throughput of the whole receive chain:
+#
+#     python image_regression.py --save results.json                 # record the current state
+#     python image_regression.py --baseline results.json             # compare a change against it
+#     python image_regression.py --recorded NOAA_19_....iqz:good.png  # a recorded pass and a known good image
+#
+# Every case is an IQ archive (synthesized from the test pattern with apt_synth,
+# or recorded) processed by reprocess_pass like any recorded pass: demodulation
+# and resampling to WAV, line sync and decoding, rendering. The rendered image is
+# compared to the reference (the lines sent, or a known good image) with PSNR and
+# SSIM, next to the wall time of every stage and the peak memory of the chain
+# (measured by a second run under tracemalloc, which would slow the timed one).
+# Against a baseline, a case fails when its quality drops by more than the
+# tolerance; time and memory changes are shown, so a change that buys speed with
+# quality (or the reverse) is visible either way.
+SYNTHETIC_CASES = [
+    # name, IQ format, seconds, SNR (dB), Doppler: 'corrected' (tracking residual), 'full' or None
+    ("clean", "decimated", 60, 40, "corrected"),
+    ("snr-20", "decimated", 60, 20, "corrected"),
+    ("snr-12", "decimated", 60, 12, "corrected"),
+    ("doppler", "decimated", 60, 25, "full"),
+    ("raw-snr-20", "raw", 30, 20, "corrected"),
+]
+SATELLITE = "NOAA 19"
+# Words of a line that are scored: image and telemetry of both channels. The sync pulses and the
+# spaces are square waves the 2080 Hz bandwidth cannot reproduce, they would swamp the image
+SCORED_WORDS = np.r_[86:1040, 1126:2080]
+MAX_LINE_SHIFT = 4          # lines the decoded image may start late, searched when aligning
+PSNR_TOLERANCE = 0.5        # dB of PSNR a case may lose against the baseline
+SSIM_TOLERANCE = 0.01       # SSIM a case may lose against the baseline
+TIME_TOLERANCE = 0.25       # fraction of wall time a case may gain before it is flagged (not a failure)
+
+
+# Function to compute the PSNR (dB) of an 8 bit image against its reference
+def psnr(image, reference):
+    mse = np.mean((image.astype(np.float64) - reference.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+# Function to compute the mean SSIM of an 8 bit image against its reference (Gaussian window, sigma 1.5)
+def ssim(image, reference, sigma=1.5):
+    x, y = image.astype(np.float64), reference.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_x, mu_y = gaussian_filter(x, sigma), gaussian_filter(y, sigma)
+    var_x = gaussian_filter(x * x, sigma) - mu_x ** 2
+    var_y = gaussian_filter(y * y, sigma) - mu_y ** 2
+    cov = gaussian_filter(x * y, sigma) - mu_x * mu_y
+    ssim_map = (2 * mu_x * mu_y + c1) * (2 * cov + c2) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+# Function to line up a decoded image with its reference: best line offset, then a linear fit of the grey levels
+# (the rendered levels are stretched on percentiles, the wedges calibrate them in practice)
+def align(image, reference):
+    best = None
+    for shift in range(min(MAX_LINE_SHIFT, len(reference) - 1) + 1):
+        lines = min(len(image), len(reference) - shift)
+        if lines <= 0:
+            break
+        a = image[:lines].astype(np.float64).ravel()
+        b = reference[shift:shift + lines].astype(np.float64).ravel()
+        score = np.corrcoef(a, b)[0, 1] if a.std() and b.std() else -1.0
+        if best is None or score > best[0]:
+            best = (score, shift, lines)
+    if best is None:
+        return np.zeros((0, len(SCORED_WORDS)), dtype=np.uint8), reference[:0, SCORED_WORDS], 0
+    score, shift, lines = best
+    decoded, expected = image[:lines, SCORED_WORDS].astype(np.float64), reference[shift:shift + lines, SCORED_WORDS]
+    gain, offset = np.polyfit(decoded.ravel(), expected.astype(np.float64).ravel(), 1)
+    return np.clip(np.round(gain * decoded + offset), 0, 255).astype(np.uint8), expected, shift
+
+# Function to synthesize the IQ archive of a case in a DATA_RAW folder, returns its path and its reference image
+def synthesize_case(root, name, iq_format, seconds, snr_db, doppler, store):
+    record = store.get(SATELLITE)
+    start = best_culmination(record) - seconds / 2
+    raw_folder = os.path.join(root, name, SATELLITE.replace(" ", "_"), "DATA_RAW")
+    os.makedirs(raw_folder, exist_ok=True)
+    stamp = datetime.fromtimestamp(start, timezone.utc).strftime("%d-%m-%y_%H-%M-%S")
+    path = os.path.join(raw_folder, f"{SATELLITE.replace(' ', '_')}_{stamp}.iqz")
+    synthesizer = AptSynthesizer(record=record if doppler else None, frequency=FREQUENCIES[SATELLITE], start=start,
+                                 rate=FORMATS[iq_format][0], snr_db=snr_db, doppler_corrected=doppler == "corrected", seed=0)
+    write_archive(path, synthesizer, seconds, iq_format, satellite=SATELLITE, tle=[record.line1, record.line2])
+    return path, to_uint8(synthesizer.reference(seconds), 0, 1)
+
+# Function to run the chain on one archive and score the rendered image against the reference: a timed run,
+# then a run under tracemalloc for the peak memory (tracing every allocation slows the chain down)
+def run_case(name, input_path, reference):
+    clock = time.perf_counter()
+    result = reprocess_pass(input_path, force=True)
+    seconds = time.perf_counter() - clock
+    image = load_png(stage_paths(input_path)["render"])
+    tracemalloc.start()
+    try:
+        reprocess_pass(input_path, force=True)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    fitted, expected, shift = align(image, reference)
+    return {"case": name, "lines": result.get("lines", 0), "synced_lines": result.get("synced_lines", 0),
+            "compared_lines": len(fitted), "line_shift": shift,
+            "psnr": psnr(fitted, expected) if len(fitted) else 0.0, "ssim": ssim(fitted, expected) if len(fitted) else 0.0,
+            "audio_seconds": result.get("audio_seconds"), "seconds": seconds, "stage_seconds": result["stage_seconds"],
+            "peak_mb": peak / 2**20}
+
+# Function to compare results with a baseline, returns the lines to print and whether quality regressed
+def compare(results, baseline):
+    previous = {entry["case"]: entry for entry in baseline["results"]}
+    report, regressed = [], False
+    width = max(len(entry["case"]) for entry in results)
+    for entry in results:
+        old = previous.get(entry["case"])
+        if old is None:
+            report.append(f"{entry['case']:<{width}} new case")
+            continue
+        d_psnr, d_ssim = entry["psnr"] - old["psnr"], entry["ssim"] - old["ssim"]
+        d_time = entry["seconds"] / old["seconds"] - 1
+        flags = []
+        if d_psnr < -PSNR_TOLERANCE or d_ssim < -SSIM_TOLERANCE:
+            flags.append("QUALITY REGRESSION")
+            regressed = True
+        if d_time > TIME_TOLERANCE:
+            flags.append("slower")
+        report.append(f"{entry['case']:<{width}} PSNR {d_psnr:+6.2f} dB  SSIM {d_ssim:+.4f}  time {d_time:+6.1%}  "
+                      f"memory {entry['peak_mb'] - old['peak_mb']:+7.1f} MB  {' '.join(flags)}")
+    return report, regressed
+
+# Function to name the commit the results belong to, None outside a git checkout
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    from tle_store import TLEStore
+    parser = argparse.ArgumentParser(description="Score the images of the receive chain against references, with time and memory.")
+    parser.add_argument("--case", action="append", choices=[case[0] for case in SYNTHETIC_CASES],
+                        help="synthetic case to run, repeatable (default: all)")
+    parser.add_argument("--recorded", action="append", default=[], metavar="IQZ:PNG",
+                        help="recorded archive in a DATA_RAW folder and its known good image, repeatable")
+    parser.add_argument("--tle", default=TLE_PATH, help="TLE store, for the Doppler of the synthetic passes")
+    parser.add_argument("--workdir", help="keep the synthesized passes and products here (default: temporary)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with, exits 1 if quality regressed")
+    args = parser.parse_args(argv)
+
+    recorded = [spec.rsplit(":", 1) for spec in args.recorded]
+    for spec, paths in zip(args.recorded, recorded):
+        if len(paths) != 2 or not all(os.path.exists(path) for path in paths):
+            parser.error(f"--recorded {spec}: archive or image not found")
+    store = TLEStore(args.tle)
+    cases = [case for case in SYNTHETIC_CASES if not args.case or case[0] in args.case]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.workdir or tmp
+        for name, iq_format, seconds, snr_db, doppler in cases:
+            input_path, reference = synthesize_case(root, name, iq_format, seconds, snr_db, doppler, store)
+            results.append(run_case(name, input_path, reference))
+        for input_path, reference_path in recorded:
+            results.append(run_case(os.path.splitext(os.path.basename(input_path))[0], input_path, load_png(reference_path)))
+
+    width = max([4] + [len(entry["case"]) for entry in results])
+    print(f"{'case':<{width}} {'lines':>5} {'synced':>6} {'PSNR dB':>8} {'SSIM':>6} {'demod s':>8} {'decode s':>8} "
+          f"{'render s':>8} {'total s':>8} {'realtime':>8} {'peak MB':>8}")
+    for entry in results:
+        stages = entry["stage_seconds"]
+        realtime = (entry["audio_seconds"] or 0) / entry["seconds"]
+        print(f"{entry['case']:<{width}} {entry['lines']:>5} {entry['synced_lines']:>6} {entry['psnr']:>8.2f} {entry['ssim']:>6.3f} "
+              f"{stages.get('demod', 0):>8.2f} {stages.get('decode', 0):>8.2f} {stages.get('render', 0):>8.2f} "
+              f"{entry['seconds']:>8.2f} {realtime:>7.1f}x {entry['peak_mb']:>8.1f}")
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report, regressed = compare(results, baseline)
+        print(f"\nagainst {args.baseline} (commit {baseline.get('commit') or 'unknown'}):")
+        print("\n".join(report))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"commit": current_commit(), "date": datetime.now(timezone.utc).isoformat(), "results": results}, f, indent=2)
+    return 1 if regressed else 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # zlib from the standard library is used instead
+    zstandard = None
+
+# Layout of an archive:
+#
+#     MAGIC | header length (uint32) | JSON header
+#     block header | compressed block      (repeated)
+#     index entries | JSON trailer | footer
+#
+# Every block holds `block_samples` IQ pairs, interleaved I/Q, delta encoded
+# per component and compressed on its own, so any range of samples can be read
+# by decompressing only the blocks it spans. The index at the end maps the first
+# sample of every block to its byte offset; if the file was not closed properly
+# the index is rebuilt by walking the block headers.
+#
+# Samples lost by the receiver are stored as zeros, so the sample index stays a
+# time from the start of the archive, and listed in the trailer as gaps (first
+# sample, samples). The header is written with the first block: metadata known
+# only once the first sample arrives (its time) can be added to it until then.
+MAGIC = b"APTIQ\x00\x01\x00"
+INDEX_MAGIC = b"APTIDX\x00\x01"
+BLOCK_HEADER = struct.Struct("<II")        # samples in block, compressed size
+INDEX_ENTRY = struct.Struct("<QQII")       # first sample, byte offset, compressed size, samples
+FOOTER = struct.Struct("<QI8s")            # index offset, number of blocks, INDEX_MAGIC
+DTYPES = {"uint8": np.uint8, "int8": np.int8, "int16": np.int16}
+
+
+# Function to compress one block with the codec named in the header
+def compress(data, codec, level):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+# Function to decompress one block with the codec named in the header
+def decompress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+# Function to delta encode interleaved IQ (wraps around, so it is lossless)
+def delta_encode(block):
+    pairs = block.reshape(-1, 2)
+    encoded = np.empty_like(pairs)
+    encoded[0] = pairs[0]
+    np.subtract(pairs[1:], pairs[:-1], out=encoded[1:])
+    if encoded.dtype.itemsize > 1:
+        # Byte shuffle: low bytes and high bytes compress better apart
+        return encoded.view(np.uint8).reshape(-1, encoded.dtype.itemsize).T.tobytes()
+    return encoded.tobytes()
+
+# Function to undo delta_encode
+def delta_decode(data, dtype):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if dtype.itemsize > 1:
+        raw = np.ascontiguousarray(raw.reshape(dtype.itemsize, -1).T)
+    pairs = raw.view(dtype).reshape(-1, 2)
+    return np.cumsum(pairs, axis=0, dtype=dtype).reshape(-1)
+
+
+class IQArchiveWriter:
+    """
+    Writer of chunked, compressed IQ archives.
+
+    Parameters:
+    path (str): output file, or an already open binary file object.
+    rate (float): sample rate of the stored IQ.
+    dtype (str): 'uint8' for raw RTL-SDR bytes, 'int8', or 'int16' for decimated IQ.
+    scale (float): full scale of complex samples for int16 (value stored = sample * scale).
+    block_samples (int): IQ pairs per independently compressed block.
+    level (int): compression level.
+    **metadata: stored in the header (center_freq, gain, tle, station, start_time...).
+    """
+
+    def __init__(self, path, rate, dtype="uint8", scale=None, block_samples=1 << 18, level=3, **metadata):
+        if dtype not in DTYPES:
+            raise ValueError(f"unsupported archive dtype {dtype}, use one of {list(DTYPES)}")
+        self.dtype = DTYPES[dtype]
+        if scale is None:
+            scale = 127.5 if dtype == "uint8" else float(np.iinfo(self.dtype).max)
+        self.scale = scale
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self.level = level
+        self.block_samples = block_samples
+        self.header = dict(metadata, rate=rate, dtype=dtype, scale=scale, codec=self.codec,
+                           block_samples=block_samples)
+        self.header_written = False
+        self.file = open(path, "wb") if isinstance(path, (str, os.PathLike)) else path
+        self.pending = []
+        self.pending_samples = 0
+        self.samples = 0
+        self.index = []
+        self.gaps = []  # (first sample, samples) lost by the receiver, stored as zeros
+
+    def _write_header(self):
+        header = json.dumps(self.header).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.header_written = True
+
+    def _to_storage(self, samples):
+        samples = np.asarray(samples)
+        if np.iscomplexobj(samples):
+            interleaved = np.empty(2 * len(samples), dtype=np.float32)
+            interleaved[0::2] = samples.real
+            interleaved[1::2] = samples.imag
+            if self.dtype == np.uint8:
+                # Inverse of the (x - 127.5) / 127.5 done by pyrtlsdr
+                interleaved = interleaved * self.scale + 127.5
+            else:
+                interleaved *= self.scale
+            info = np.iinfo(self.dtype)
+            return np.clip(np.round(interleaved), info.min, info.max).astype(self.dtype)
+        return samples.astype(self.dtype, copy=False).reshape(-1)
+
+    def write(self, samples):
+        data = self._to_storage(samples)
+        self.pending.append(data)
+        self.pending_samples += len(data) // 2
+        while self.pending_samples >= self.block_samples:
+            self._flush_block(self.block_samples)
+
+    def gap(self, nsamples):
+        # Zeros in place of nsamples lost samples, one block at a time
+        self.gaps.append((self.samples + self.pending_samples, int(nsamples)))
+        zero = np.round(127.5) if self.dtype == np.uint8 else 0
+        for start in range(0, int(nsamples), self.block_samples):
+            self.write(np.full(2 * min(self.block_samples, int(nsamples) - start), zero, dtype=self.dtype))
+
+    def _flush_block(self, nsamples):
+        if not self.header_written:
+            self._write_header()
+        data = np.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+        block, rest = data[:2 * nsamples], data[2 * nsamples:]
+        self.pending = [rest] if len(rest) else []
+        self.pending_samples = len(rest) // 2
+        compressed = compress(delta_encode(block), self.codec, self.level)
+        offset = self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(nsamples, len(compressed)) + compressed)
+        self.index.append((self.samples, offset, len(compressed), nsamples))
+        self.samples += nsamples
+
+    def close(self):
+        if self.file.closed:
+            return
+        if not self.header_written:
+            self._write_header()
+        if self.pending_samples:
+            self._flush_block(self.pending_samples)
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        if self.gaps:
+            self.file.write(json.dumps({"gaps": self.gaps}).encode())
+        self.file.write(FOOTER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class IQArchiveReader:
+    """
+    Random access reader of IQ archives.
+
+    read(start, count) returns complex64 samples, decompressing only the
+    blocks that overlap the requested range; read_time() does the same with
+    seconds from the start of the recording.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an IQ archive")
+        (length,) = struct.unpack("<I", self.file.read(4))
+        self.header = json.loads(self.file.read(length))
+        self.data_offset = self.file.tell()
+        self.rate = self.header["rate"]
+        self.dtype = DTYPES[self.header["dtype"]]
+        self.scale = self.header["scale"]
+        self.codec = self.header["codec"]
+        if self.codec == "zstd" and zstandard is None:
+            raise ImportError("this archive is compressed with zstd, install the zstandard package")
+        self.finalized = False  # footer written, the writer was closed
+        self.gaps = []          # (first sample, samples) lost by the receiver, from the trailer
+        self.index = self._read_index()
+        self.starts = np.array([entry[0] for entry in self.index], dtype=np.int64)
+        self.samples = self.index[-1][0] + self.index[-1][3] if self.index else 0
+
+    def _read_index(self):
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        if size - self.data_offset >= FOOTER.size:
+            self.file.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+            if magic == INDEX_MAGIC:
+                self.finalized = True
+                self.file.seek(index_offset)
+                raw = self.file.read(count * INDEX_ENTRY.size)
+                trailer = self.file.read(size - FOOTER.size - self.file.tell())
+                if trailer:
+                    self.gaps = [tuple(gap) for gap in json.loads(trailer)["gaps"]]
+                return [INDEX_ENTRY.unpack_from(raw, i * INDEX_ENTRY.size) for i in range(count)]
+        # No footer (recording interrupted): rebuild the index from the block headers
+        index = []
+        offset, first = self.data_offset, 0
+        while offset + BLOCK_HEADER.size <= size:
+            self.file.seek(offset)
+            nsamples, csize = BLOCK_HEADER.unpack(self.file.read(BLOCK_HEADER.size))
+            # Stop at the first thing that does not look like a complete block (partial block or index)
+            if not 0 < nsamples <= self.header["block_samples"] or csize == 0 or offset + BLOCK_HEADER.size + csize > size:
+                break
+            index.append((first, offset, csize, nsamples))
+            first += nsamples
+            offset += BLOCK_HEADER.size + csize
+        return index
+
+    @property
+    def duration(self):
+        return self.samples / self.rate
+
+    def _read_block(self, i):
+        first, offset, csize, nsamples = self.index[i]
+        self.file.seek(offset + BLOCK_HEADER.size)
+        return delta_decode(decompress(self.file.read(csize), self.codec), self.dtype)
+
+    def read_raw(self, start, count):
+        # Stored interleaved values of samples [start, start + count)
+        start = max(0, start)
+        end = min(self.samples, start + count)
+        if end <= start:
+            return np.zeros(0, dtype=self.dtype)
+        first = int(np.searchsorted(self.starts, start, side="right")) - 1
+        last = int(np.searchsorted(self.starts, end - 1, side="right")) - 1
+        data = np.concatenate([self._read_block(i) for i in range(first, last + 1)])
+        skip = start - self.index[first][0]
+        return data[2 * skip:2 * (skip + end - start)]
+
+    def read(self, start, count):
+        raw = self.read_raw(start, count).astype(np.float32)
+        if self.dtype == np.uint8:
+            raw -= 127.5
+        raw /= self.scale
+        return raw.view(np.complex64)
+
+    def read_time(self, start_seconds, end_seconds):
+        start = int(start_seconds * self.rate)
+        return self.read(start, int(end_seconds * self.rate) - start)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
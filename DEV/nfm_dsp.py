@@ -0,0 +1,76 @@
+import numpy as np
+from fft_filter import OverlapSaveFilter, lowpass_taps
+
+# Channel and audio filter settings
+WIDEBAND_DECIMATION = 16   # 2.4 MHz -> 150 kHz, seen by the spectrum monitor
+WIDEBAND_CUTOFF = 60e3
+CHANNEL_DECIMATION = 48    # 2.4 MHz -> 50 kHz (3 after the wideband stage)
+CHANNEL_CUTOFF = 20e3      # APT deviation is +-17 kHz around the (Doppler corrected) carrier
+FM_DEVIATION = 17e3
+AUDIO_DECIMATION = 4       # 50 kHz -> 12.5 kHz
+AUDIO_CUTOFF = 5e3         # 2400 Hz subcarrier + 2080 Hz sidebands
+
+
+def audio_sample_rate(rate):
+    return rate / (CHANNEL_DECIMATION * AUDIO_DECIMATION)
+
+def fm_demodulate(data, last_sample):
+    # Prepend the last sample of the previous chunk so no sample is lost at chunk boundaries
+    data = np.concatenate(([last_sample], data))
+    # Phase difference between consecutive samples (quadrature discriminator)
+    derivative = np.angle(data[1:] * np.conj(data[:-1]))
+    # Keep the last sample for the next chunk
+    last_sample = data[-1]
+    return derivative, last_sample
+
+# Function to convert audio in [-1, 1] to int16, returns (samples, clipped)
+def to_int16(audio):
+    return np.int16(np.clip(audio, -1, 1) * (2**15 - 1)), bool(np.max(np.abs(audio), initial=0) > 1)
+
+
+class NfmDemodulator:
+    """
+    NFM receive chain shared by the live receiver and the reprocessing tools.
+
+    wideband() selects the 150 kHz band around the carrier from the SDR IQ,
+    channel(), demodulate() and audio() take it down to 12.5 kHz audio scaled
+    so that the full deviation maps to full scale. The stages are separate so
+    the receiver can time them and skip the last three outside AOS/LOS.
+    process() runs them all on SDR IQ, process_wideband() runs the last three
+    on the 150 kHz output of wideband(), as kept in decimated archives.
+    Filter and discriminator state carries over from one call to the next.
+
+    Parameters:
+    rate (float): sample rate of the SDR IQ.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.wideband_rate = rate / WIDEBAND_DECIMATION
+        self.channel_rate = rate / CHANNEL_DECIMATION
+        self.audio_rate = audio_sample_rate(rate)
+        # The SDR is tuned on the carrier, so the channel is a lowpass around DC
+        self.wideband_filter = OverlapSaveFilter(lowpass_taps(WIDEBAND_CUTOFF, rate, numtaps=255), decimation=WIDEBAND_DECIMATION)
+        self.channel_filter = OverlapSaveFilter(lowpass_taps(CHANNEL_CUTOFF, self.wideband_rate, numtaps=127), decimation=CHANNEL_DECIMATION // WIDEBAND_DECIMATION)
+        self.audio_filter = OverlapSaveFilter(lowpass_taps(AUDIO_CUTOFF, self.channel_rate, numtaps=255), decimation=AUDIO_DECIMATION, complex_input=False)
+        self.demod_gain = self.channel_rate / (2 * np.pi * FM_DEVIATION)
+        self.last_sample = np.complex64(0)
+
+    def wideband(self, samples):
+        return self.wideband_filter.filter(samples)
+
+    def channel(self, wideband):
+        return self.channel_filter.filter(wideband)
+
+    def demodulate(self, channel):
+        derivative, self.last_sample = fm_demodulate(channel, self.last_sample)
+        return derivative
+
+    def audio(self, derivative):
+        return self.audio_filter.filter(derivative * self.demod_gain)
+
+    def process_wideband(self, wideband):
+        return self.audio(self.demodulate(self.channel(wideband)))
+
+    def process(self, samples):
+        return self.process_wideband(self.wideband(samples))
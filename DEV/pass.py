@@ -1,55 +1,55 @@
 import os
 import sys
 import time
-import schedule
-import requests
-from skyfield.api import Topos, load, EarthSatellite
+import asyncio
+import functools
 from datetime import datetime, timedelta
 from pytz import timezone
-
-
-# Function to calculate satellite passes
-def calculate_passes(satellite, observer, start_time, end_time, ts):
-    t, events = satellite.find_events(observer, ts.from_datetime(start_time), ts.from_datetime(end_time), altitude_degrees=5)
-    #print(f"{t} - {events}")
-
-    passes = []
-    alts=[]
-    for i in range(len(events) - 1):
-        if events[i] == 1:  # Satellite culminated and started to descend again
-            culmination_time = t[i]
-            alt, az, distance = (satellite - observer).at(culmination_time).altaz()
-            if alt.degrees >= 30:  # Check if the satellite reached an elevation of 30° or more
-                passes.append((t[i-1].astimezone(timezone('Europe/Rome')), t[i+1].astimezone(timezone('Europe/Rome'))))
-                alts.append(alt)
-
-    #print(passes)
-    return passes ,alts
-
-# Function to update TLE data
-def update_tle_data():
-    tle_data = {}
-    tle_file = open("TLE.txt")
-    s = tle_file.readlines()
-    tle_file.close()
-    if (datetime.now() - datetime.strptime(s[0].replace('\n',''), "%Y-%m-%d %H:%M:%S.%f")) > timedelta(days=2):
-        print("tle out of date, updating...")
-        url = "https://celestrak.org/NORAD/elements/gp.php?GROUP=weather&FORMAT=tle"
-        response = requests.get(url)
-        lines = response.text.split("\n")
-        tle_file=open("TLE.txt", "w")
-        tle_file.write(str(datetime.now()) + "\n")
-        tle_file.write(response.text.replace("\n", ""))
-        tle_file.close()
-        l=0  
-    else:
-        lines=s
-        l=1
-    for i in range(l, len(lines) - 2, 3):
-        if lines[i].strip():
-            tle_data[lines[i].strip()] = (lines[i+1].strip(), lines[i+2].strip())
-    #print(tle_data)
-    return tle_data
+from event_scheduler import EventScheduler
+from tle_store import TLEStore
+from tle_refresh import TLERefresher
+from propagation import PropagationBatch
+from sdr_pool import DevicePool
+from fleet import serve_plans, AGENT_PORT, TOKEN_ENV
+
+# Receiver started at every pass, from this folder
+RECEIVER = "recieve_process_multithread_AM.py"
+
+# Satellites to capture and their APT frequency in MHz
+SATELLITES = {
+    'NOAA 15': '137.6200',
+    'NOAA 18': '137.9125',
+    'NOAA 19': '137.1000'
+}
+
+# CelesTrak groups and NORAD numbers kept up to date in TLE.txt
+TLE_GROUPS = ("weather", "noaa")
+TLE_CATNRS = ()
+
+# Seconds between two TLE refreshes (and re-planning of the next 24 hours)
+REPLAN_INTERVAL = 12 * 3600
+
+# Fleet agent (--agent): interface facing the coordinator and IP addresses plans are accepted from (empty: any
+# host with the token of the fleet, in the environment variable fleet.TOKEN_ENV)
+AGENT_HOST = "127.0.0.1"
+COORDINATORS = ()
+
+# Archive handed to the retention job after every pass, None to disable
+ARCHIVE_ROOT = r"C:\Users\alexa\Desktop\NOAA"
+
+
+# Function to calculate the passes of all satellites at once (rise and set at 5°, culmination at 30° or more)
+def calculate_passes(batch, start_time, end_time):
+    rome = timezone('Europe/Rome')
+    return [(p.name, p.rise.astimezone(rome), p.set.astimezone(rome), p.max_elevation)
+            for p in batch.passes(start_time, end_time, horizon=5) if p.max_elevation >= 30]
+
+# Function to update TLE data (conditional requests, only changed feeds are downloaded and parsed)
+def update_tle_data(tle_refresher):
+    changed = tle_refresher.refresh()
+    if changed:
+        print(f"TLE updated for {len(changed)} objects")
+    return changed
 
 # Clears the console
 def clearConsole():
@@ -58,63 +58,159 @@ def clearConsole():
         command = "cls"
     os.system(command)
 
-# Function to print countdown to the next pass
-def print_countdown(next_pass, next_sat):
-    while datetime.now(timezone('Europe/Rome')) < next_pass:
-        time_left = next_pass - datetime.now(timezone('Europe/Rome'))
-        str_left = '{}:{}:{}'.format(time_left.seconds // 3600, (time_left.seconds // 60) % 60, time_left.seconds % 60)
-        sys.stdout.write(f"\rNext pass in: {str_left} for {next_sat}    ")
+# Function to print the countdown to the next planned event, once per second
+async def print_countdown(scheduler):
+    rome = timezone('Europe/Rome')
+    while True:
+        # Wake up on the next whole second, one clock read per tick
+        now = time.time()
+        await asyncio.sleep(1 - now % 1)
+        event = scheduler.next_event
+        if event is None or event.tag != "capture":
+            continue
+        seconds_left = max(0, int(round(event.when - time.time())))
+        str_left = '{}:{:02}:{:02}'.format(seconds_left // 3600, (seconds_left // 60) % 60, seconds_left % 60)
+        sys.stdout.write(f"\rNext pass in: {str_left} for {event.name} at {event.time.astimezone(rome).strftime('%H:%M:%S')}    ")
         sys.stdout.flush()
-        time.sleep(1)
-
-# Function to schedule passes and setup executions
-def schedule_passes():
-    # Define observer location
-    observer = Topos(44.384477, 7.542671, elevation_m=500)
 
-    # Define satellite objects
-    satellites = {
-        'NOAA 15': '137.6200',
-        'NOAA 18': '137.9125',
-        'NOAA 19': '137.1000'  
-    }
-
-    # Update TLE data
-    tle_data = update_tle_data()
+# Function to run the receiver for one pass on a free dongle, overlapping passes go to different dongles
+# (location: station of the fleet plan, None for the one configured for the dongle; end: set of the pass,
+# the receiver stops there however long the dongle kept it waiting)
+async def capture(satellite_name, frequency, tle1, tle2, devices, scheduler, location=None, end=None):
+    requested = time.time()
+    async with devices.claim() as device:
+        waited = time.time() - requested
+        if end is not None and time.time() >= end.timestamp():
+            print(f"\n[Scheduler] >{satellite_name} has set while waiting {waited:.0f} s for a dongle, not captured")
+            return
+        if waited >= 1:
+            print(f"\n[Scheduler] >waited {waited:.0f} s for a dongle, the capture of {satellite_name} is that much shorter")
+        print(f"\n[Scheduler] >capturing {satellite_name} at {frequency} MHz on dongle {device.serial or '(first)'}")
+        args = [satellite_name.replace(" ", "_"), frequency, tle1.replace(" ", "_"), tle2.replace(" ", "_")]
+        if device.serial:
+            args += ["--device", device.serial]
+        if location:
+            args += ["--location", ",".join(str(value) for value in location)]
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), RECEIVER), *args,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        returncode = await process.wait()
+        print(f"[Scheduler] >capture of {satellite_name} finished (exit code {returncode})")
+    # Post-processing runs as a job of its own so it never delays the next capture
+    scheduler.after(0, post_process, f"post-processing {satellite_name}", tag="post")
+
+# Function to run the post-processing jobs after a pass (retention of the recordings)
+async def post_process():
+    if not ARCHIVE_ROOT:
+        return
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "retention.py"), ARCHIVE_ROOT)
+    await process.wait()
+
+# Function to plan the captures of the next 24 hours
+def plan_passes(scheduler, tle_store, devices):
+    # Every satellite propagated in one batch, from the station of propagation.STATION
+    batch = PropagationBatch([tle_store.get(satellite_name) for satellite_name in SATELLITES])
 
     # Define start and end times for calculation
     start_time = datetime.now(timezone('Europe/Rome'))
     end_time = start_time + timedelta(days=1)  # Calculate passes for next 24 hours
-    #print(start_time, end_time)
-
-    # Load timescale
-    ts = load.timescale()
-
-    next_passes = []
-    for satellite_name, frequency in satellites.items():
-        tle1, tle2 = tle_data[satellite_name]
-        satellite = EarthSatellite(tle1, tle2, satellite_name, ts)
-        passes, alts = calculate_passes(satellite, observer, start_time, end_time, ts)
-
-
-        #print(f"passaggi: {passes}")
-        next_passes.extend([(pass_time[0], satellite_name) for pass_time in passes])
-        for pass_time, alt in zip(passes, alts):
-            begin=pass_time[0]
-            end=pass_time[1]
-            duration=(end-begin).total_seconds()
-            print(f"Satellite: {satellite_name} - {begin.strftime('%d/%m %H:%M:%S')} - Duration: {int((duration// 60) % 60)} mins - Max elevation: {int(alt.degrees)}°")
-            schedule.every().day.at(begin.strftime('%H:%M:%S')).do(os.system, f"python recieve_process_multithread_AM.py {satellite_name.replace(" ","_")} {frequency} {tle1.replace(" ","_")} {tle2.replace(" ","_")}")
-
-    # Start the countdown to the next pass
-    next_passes.sort()
-    if next_passes:
-        next_pass, next_satellite = next_passes[0]
-        print_countdown(next_pass, next_satellite)
-
-# Start the scheduler
-schedule_passes()
-
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+
+    for satellite_name, begin, end, max_elevation in calculate_passes(batch, start_time, end_time):
+        if begin <= start_time:
+            continue  # already running or captured
+        frequency = SATELLITES[satellite_name]
+        tle1, tle2 = tle_store[satellite_name]
+        duration = (end - begin).total_seconds()
+        print(f"Satellite: {satellite_name} - {begin.strftime('%d/%m %H:%M:%S')} - Duration: {int((duration // 60) % 60)} mins - Max elevation: {int(max_elevation)}°")
+        job = functools.partial(capture, satellite_name, frequency, tle1, tle2, devices, scheduler, end=end)
+        scheduler.at(begin, job, satellite_name, tag="capture")
+
+# Function to replace the planned captures with the passes of the next 24 hours
+def plan_again(scheduler, tle_store, devices):
+    cancelled = scheduler.cancel("capture")
+    if cancelled:
+        print(f"\n[Scheduler] >re-planning {cancelled} captures")
+    plan_passes(scheduler, tle_store, devices)
+
+# Function to plan the captures with the TLEs at hand, then refresh the TLEs and plan again if an epoch changed
+async def replan(scheduler, tle_store, tle_refresher, devices):
+    # A slow or failing CelesTrak must never hold the plan back
+    try:
+        plan_again(scheduler, tle_store, devices)
+        planned = {tle_store.get(satellite_name).norad for satellite_name in SATELLITES}
+    except KeyError as e:
+        print(f"\n[Scheduler] >{e.args[0]}, the captures are planned after the TLE refresh")
+        planned = None
+    # The downloads are blocking, they run in a thread so the countdown and running jobs go on
+    try:
+        changed = await asyncio.to_thread(update_tle_data, tle_refresher)
+    except Exception as e:
+        print(f"\n[Scheduler] >TLE refresh failed, the plan keeps the current TLEs: {type(e).__name__}: {e}")
+        return
+    if planned is None or set(changed) & planned:
+        plan_again(scheduler, tle_store, devices)
+
+# Function to replace the planned captures with the plan pushed by the fleet coordinator (fleet.py)
+async def apply_plan(scheduler, devices, message):
+    if message.get("type") != "plan":
+        return {"ok": False, "error": f"unknown message {message.get('type')}"}
+    cancelled = scheduler.cancel("capture")
+    now = datetime.now(timezone('UTC'))
+    accepted = 0
+    for entry in message["passes"]:
+        begin = datetime.fromisoformat(entry["rise"])
+        if begin <= now:
+            continue  # already running or captured
+        print(f"Satellite: {entry['satellite']} - {begin.astimezone(timezone('Europe/Rome')).strftime('%d/%m %H:%M:%S')} - Max elevation: {int(entry['max_elevation'])}°")
+        job = functools.partial(capture, entry["satellite"], entry["frequency"], entry["line1"], entry["line2"], devices, scheduler,
+                                message.get("location"), datetime.fromisoformat(entry["set"]))
+        scheduler.at(begin, job, entry["satellite"], tag="capture")
+        accepted += 1
+    print(f"\n[Scheduler] >plan from the coordinator: {accepted} captures, {cancelled} replaced")
+    return {"ok": True, "accepted": accepted}
+
+# Main function
+async def main(agent_port=None, token=None):
+    scheduler = EventScheduler()
+    # Dongles of sdr_devices.json, one capture at a time on each
+    devices = DevicePool()
+    if agent_port is None:
+        tle_store = TLEStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt"))
+        tle_refresher = TLERefresher(tle_store, TLE_GROUPS, TLE_CATNRS)
+        # Planned every REPLAN_INTERVAL, so the 24 hour window moves on and new TLEs are used
+        scheduler.every(REPLAN_INTERVAL, functools.partial(replan, scheduler, tle_store, tle_refresher, devices), "TLE refresh", tag="tle")
+        agent = None
+    else:
+        # Fleet member: the coordinator sends the passes to capture, with their TLEs
+        print(f"[Scheduler] >waiting for plans on {AGENT_HOST}:{agent_port}")
+        agent = asyncio.create_task(serve_plans(AGENT_HOST, agent_port, functools.partial(apply_plan, scheduler, devices),
+                                                token, COORDINATORS))
+    countdown = asyncio.create_task(print_countdown(scheduler))
+    try:
+        await scheduler.run()
+    finally:
+        countdown.cancel()
+        if agent is not None:
+            agent.cancel()
+        await scheduler.shutdown()
+
+if __name__ == "__main__":
+    # --receiver SCRIPT starts another receiver of this folder at every pass (as the WIN and LINUX schedulers do)
+    if "--receiver" in sys.argv:
+        i = sys.argv.index("--receiver")
+        RECEIVER = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    # --agent [PORT] takes the plans from the fleet coordinator instead of planning locally
+    agent_port = None
+    if "--agent" in sys.argv:
+        i = sys.argv.index("--agent")
+        agent_port = int(sys.argv[i + 1]) if i + 1 < len(sys.argv) else AGENT_PORT
+    token = os.environ.get(TOKEN_ENV)
+    if agent_port is not None and not token:
+        print(f"[Scheduler] >set {TOKEN_ENV} to the token of the fleet before running as an agent")
+        sys.exit(1)
+    try:
+        asyncio.run(main(agent_port, token))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+
+# One row per pass, one row per file it produced. Times are ISO 8601 UTC
+# strings, which sort and compare like the times they represent.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passes (
+    id INTEGER PRIMARY KEY,
+    satellite TEXT NOT NULL,
+    start_time TEXT NOT NULL,       -- predicted AOS, also the name of the files
+    end_time TEXT,                  -- predicted LOS
+    station TEXT,
+    frequency REAL,                 -- Hz
+    tle_epoch TEXT,
+    aos TEXT,                       -- signal acquired (signal gate)
+    los TEXT,                       -- signal lost (signal gate)
+    max_elevation REAL,             -- degrees
+    doppler_min REAL,               -- Hz from the nominal frequency
+    doppler_max REAL,
+    doppler_rate_max REAL,          -- Hz/s
+    snr_mean REAL,                  -- dB
+    snr_median REAL,
+    snr_p90 REAL,
+    snr_max REAL,
+    lines INTEGER,
+    synced_lines INTEGER,
+    clock_ppm REAL,
+    realtime_factor REAL,
+    UNIQUE (satellite, start_time)
+);
+CREATE INDEX IF NOT EXISTS passes_time ON passes (start_time);
+CREATE INDEX IF NOT EXISTS passes_satellite_time ON passes (satellite, start_time);
+CREATE INDEX IF NOT EXISTS passes_snr ON passes (snr_median);
+CREATE INDEX IF NOT EXISTS passes_elevation ON passes (max_elevation);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    pass_id INTEGER NOT NULL REFERENCES passes (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,             -- recording, archive, wav, raw_image, waterfall, MCIR...
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS files_pass ON files (pass_id, kind);
+"""
+PASS_COLUMNS = ("end_time", "station", "frequency", "tle_epoch", "aos", "los", "max_elevation",
+                "doppler_min", "doppler_max", "doppler_rate_max", "snr_mean", "snr_median", "snr_p90",
+                "snr_max", "lines", "synced_lines", "clock_ppm", "realtime_factor")
+PASS_NAME = re.compile(r"^(?P<satellite>.+)_(?P<time>\d{2}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+
+
+# Function to format a datetime as the ISO 8601 UTC string stored in the catalog
+def to_iso(time):
+    if time is None or isinstance(time, str):
+        return time
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+# Function to get satellite and start time back from a file name like NOAA_19_02-05-24_18-38-08.wav
+def parse_pass_name(filename):
+    match = PASS_NAME.match(os.path.basename(filename))
+    if match is None:
+        return None
+    start_time = datetime.strptime(match.group("time"), "%d-%m-%y_%H-%M-%S").replace(tzinfo=timezone.utc)
+    return match.group("satellite").replace("_", " "), start_time
+
+# Function to summarize the SNR estimates of a pass
+def snr_summary(snr_db):
+    if not len(snr_db):
+        return {}
+    snr_db = np.asarray(snr_db, dtype=float)
+    return {"snr_mean": float(snr_db.mean()), "snr_median": float(np.median(snr_db)),
+            "snr_p90": float(np.percentile(snr_db, 90)), "snr_max": float(snr_db.max())}
+
+# Function to summarize the Doppler correction of a pass from (time, offset in Hz) samples
+def doppler_summary(times, offsets):
+    if len(offsets) < 2:
+        return {}
+    times = np.asarray(times, dtype=float)
+    offsets = np.asarray(offsets, dtype=float)
+    rates = np.diff(offsets) / np.maximum(np.diff(times), 1e-3)
+    return {"doppler_min": float(offsets.min()), "doppler_max": float(offsets.max()),
+            "doppler_rate_max": float(np.abs(rates).max())}
+
+
+class PassCatalog:
+    """
+    SQLite catalog of the recorded passes and of every file they produced.
+
+    The receiver adds a pass at the end of the capture, the batch tools add
+    the products they derive. Passes are identified by satellite and start
+    time, adding the same pass again updates it. The database is in WAL mode,
+    so it can be queried while a pass is being written.
+
+    Parameters:
+    path (str): database file, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+
+    def add_pass(self, satellite, start_time, **fields):
+        unknown = set(fields) - set(PASS_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown pass fields: {', '.join(sorted(unknown))}")
+        fields = {key: to_iso(value) if isinstance(value, datetime) else value for key, value in fields.items()}
+        columns = ["satellite", "start_time"] + list(fields)
+        update = ", ".join(f"{column} = excluded.{column}" for column in fields) or "satellite = excluded.satellite"
+        with self.db:
+            self.db.execute(
+                f"INSERT INTO passes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (satellite, start_time) DO UPDATE SET {update}",
+                [satellite, to_iso(start_time)] + list(fields.values()))
+            row = self.db.execute("SELECT id FROM passes WHERE satellite = ? AND start_time = ?",
+                                  (satellite, to_iso(start_time))).fetchone()
+        return row["id"]
+
+    def add_file(self, pass_id, path, kind):
+        if not os.path.exists(path):
+            return
+        stat = os.stat(path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (path, pass_id, kind, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                            (os.path.abspath(path), pass_id, kind, stat.st_size, stat.st_mtime))
+
+    def remove_file(self, path):
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+
+    def find(self, satellite=None, since=None, until=None, min_elevation=None, min_snr=None, limit=None):
+        conditions, values = [], []
+        for condition, value in (("satellite = ?", satellite), ("start_time >= ?", to_iso(since)),
+                                 ("start_time < ?", to_iso(until)), ("max_elevation >= ?", min_elevation),
+                                 ("snr_median >= ?", min_snr)):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        query = "SELECT * FROM passes"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY start_time"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self.db.execute(query, values)]
+
+    def files(self, pass_id, kind=None):
+        query = "SELECT * FROM files WHERE pass_id = ?"
+        values = [pass_id]
+        if kind is not None:
+            query += " AND kind = ?"
+            values.append(kind)
+        return [dict(row) for row in self.db.execute(query + " ORDER BY kind", values)]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the pass catalog.")
+    parser.add_argument("catalog", help="catalog database")
+    parser.add_argument("--satellite", help="e.g. 'NOAA 19'")
+    parser.add_argument("--since", help="ISO date or time (UTC)")
+    parser.add_argument("--until", help="ISO date or time (UTC)")
+    parser.add_argument("--min-elevation", type=float, help="degrees")
+    parser.add_argument("--min-snr", type=float, help="median SNR in dB")
+    parser.add_argument("--files", action="store_true", help="list the files of every pass")
+    args = parser.parse_args(argv)
+
+    with PassCatalog(args.catalog) as catalog:
+        passes = catalog.find(args.satellite, args.since, args.until, args.min_elevation, args.min_snr)
+        for row in passes:
+            elevation = f"{row['max_elevation']:.0f}°" if row["max_elevation"] is not None else "-"
+            snr = f"{row['snr_median']:.1f} dB" if row["snr_median"] is not None else "-"
+            print(f"{row['start_time']}  {row['satellite']:<10} elevation {elevation:>4}  SNR {snr:>8}  "
+                  f"{row['synced_lines'] or 0}/{row['lines'] or 0} lines synced")
+            if args.files:
+                for entry in catalog.files(row["id"]):
+                    print(f"    {entry['kind']:<12} {entry['size'] / 1e6:8.1f} MB  {entry['path']}")
+        print(f"{len(passes)} passes")
+    return 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import gc
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+NULL_SPAN = nullcontext()
+
+
+class PassTrace:
+    """
+    Opt-in span tracer writing Chrome trace-event JSON (Perfetto, chrome://tracing).
+
+    A span only costs two perf_counter() calls and one list append, so the
+    tracer can stay enabled during real passes. Garbage collector pauses are
+    recorded as spans of their own. When disabled, span() returns a shared
+    no-op context manager.
+
+    Parameters:
+    enabled (bool): record spans, False turns every call into a no-op.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []  # (name, start, end, thread id, args)
+        self.thread_names = {}
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.gc_start = None
+        if enabled:
+            gc.callbacks.append(self._gc_callback)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, start, time.perf_counter(), threading.get_native_id(), args))
+
+    def name_thread(self, name):
+        if self.enabled:
+            self.thread_names[threading.get_native_id()] = name
+
+    def _gc_callback(self, phase, info):
+        if phase == "start":
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            self.events.append(("gc", self.gc_start, time.perf_counter(), threading.get_native_id(),
+                                {"generation": info["generation"], "collected": info["collected"]}))
+            self.gc_start = None
+
+    def close(self):
+        if self.enabled and self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+
+    def save(self, path):
+        if not self.enabled:
+            return
+        self.close()
+        events = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.thread_names.items()]
+        for name, start, end, tid, args in list(self.events):
+            events.append({
+                "name": name, "ph": "X", "pid": self.pid, "tid": tid,
+                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6, "args": args,
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
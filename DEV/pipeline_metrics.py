@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+
+# Function to read the resident set size of this process in bytes (None if unknown)
+def current_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # Peak instead of current RSS, in bytes on macOS and kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
+# Function to write a file so that readers never see it half written
+def write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class PipelineMetrics:
+    """
+    Per-chunk timings and counters of the capture and DSP pipeline.
+
+    Stages are timed with `with metrics.timer('read'):`, gauges keep their
+    last and maximum value, counters only grow. Everything is thread safe, the
+    reader and the processing thread share one instance. At the end of a pass
+    (or periodically during it) the metrics can be written as a Prometheus
+    textfile and as a JSON summary. The realtime factor only counts the
+    stages of the processing thread (DSP_STAGES); the disk writes of the
+    background writer are reported as its utilisation instead.
+
+    Parameters:
+    satellite (str): satellite name, used as a label.
+    station (str): station name, defaults to the host name.
+    """
+
+    DSP_STAGES = ("filter", "monitor", "archive", "demod", "write")  # timed on the processing thread
+    WRITER_STAGE = "disk_write"  # timed on the thread of the background writer
+
+    def __init__(self, satellite, station=None):
+        self.labels = {"satellite": satellite, "station": station or socket.gethostname()}
+        self.lock = threading.Lock()
+        self.stages = {}     # stage -> list of durations in seconds
+        self.gauges = {}     # name -> [last, max]
+        self.counters = {}   # name -> value
+        self.signal_seconds = 0.0  # seconds of signal pushed through the processing thread
+        self.start_time = time.time()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def gauge(self, name, value):
+        with self.lock:
+            last_max = self.gauges.setdefault(name, [value, value])
+            last_max[0] = value
+            last_max[1] = max(last_max[1], value)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_signal(self, seconds):
+        with self.lock:
+            self.signal_seconds += seconds
+
+    def summary(self):
+        with self.lock:
+            stages = {name: np.array(values) for name, values in self.stages.items()}
+            gauges = {name: list(values) for name, values in self.gauges.items()}
+            counters = dict(self.counters)
+            signal_seconds = self.signal_seconds
+        processing = sum(values.sum() for name, values in stages.items() if name in self.DSP_STAGES)
+        wall_seconds = time.time() - self.start_time
+        writer = stages.get(self.WRITER_STAGE)
+        rss = current_rss()
+        return {
+            "labels": self.labels,
+            "wall_seconds": wall_seconds,
+            "signal_seconds": signal_seconds,
+            # Processing thread time per second of signal, must stay well below 1
+            "realtime_factor": processing / signal_seconds if signal_seconds else None,
+            # Fraction of the wall time the background writer spends writing and syncing
+            "writer_utilisation": float(writer.sum()) / wall_seconds if writer is not None and wall_seconds else None,
+            "rss_bytes": rss,
+            "stages": {
+                name: {
+                    "count": int(len(values)),
+                    "total": float(values.sum()),
+                    "mean": float(values.mean()),
+                    "p50": float(np.percentile(values, 50)),
+                    "p99": float(np.percentile(values, 99)),
+                    "max": float(values.max()),
+                } for name, values in stages.items() if len(values)
+            },
+            "gauges": {name: {"last": values[0], "max": values[1]} for name, values in gauges.items()},
+            "counters": counters,
+        }
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path):
+        summary = self.summary()
+        labels = ",".join(f'{key}="{value}"' for key, value in summary["labels"].items())
+        lines = ["# TYPE noaa_apt_stage_seconds summary"]
+        for stage, stats in summary["stages"].items():
+            stage_labels = f'{labels},stage="{stage}"'
+            lines.append(f'noaa_apt_stage_seconds{{{stage_labels},quantile="0.5"}} {stats["p50"]}')
+            lines.append(f'noaa_apt_stage_seconds{{{stage_labels},quantile="0.99"}} {stats["p99"]}')
+            lines.append(f'noaa_apt_stage_seconds_sum{{{stage_labels}}} {stats["total"]}')
+            lines.append(f'noaa_apt_stage_seconds_count{{{stage_labels}}} {stats["count"]}')
+        for name, values in summary["gauges"].items():
+            lines.append(f"# TYPE noaa_apt_{name} gauge")
+            lines.append(f"noaa_apt_{name}{{{labels}}} {values['last']}")
+            lines.append(f"noaa_apt_{name}_max{{{labels}}} {values['max']}")
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE noaa_apt_{name}_total counter")
+            lines.append(f"noaa_apt_{name}_total{{{labels}}} {value}")
+        if summary["realtime_factor"] is not None:
+            lines.append("# TYPE noaa_apt_realtime_factor gauge")
+            lines.append(f"noaa_apt_realtime_factor{{{labels}}} {summary['realtime_factor']}")
+        if summary["writer_utilisation"] is not None:
+            lines.append("# TYPE noaa_apt_writer_utilisation gauge")
+            lines.append(f"noaa_apt_writer_utilisation{{{labels}}} {summary['writer_utilisation']}")
+        if summary["rss_bytes"] is not None:
+            lines.append("# TYPE noaa_apt_rss_bytes gauge")
+            lines.append(f"noaa_apt_rss_bytes{{{labels}}} {summary['rss_bytes']}")
+        write_atomic(path, "\n".join(lines) + "\n")
@@ -4,40 +4,46 @@ import time
 import queue
 import threading
 import subprocess
-from rtlsdr import RtlSdr
 import numpy as np
 from scipy.io.wavfile import write
-from scipy.signal import hilbert
-from scipy.signal import resample_poly
-from skyfield.api import Topos, load, EarthSatellite
+from fft_filter import OverlapSaveFilter, lowpass_taps
+from tle_store import TLEStore, make_tle
+from propagation import PropagationBatch, STATION
+from sdr_pool import find_device, open_device
 from datetime import datetime, timedelta, timezone
 
 
 def azimuth_to_compass(azimuth):
     directions = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N']
-    index = round((azimuth.degrees % 360) / 45)
+    index = round((azimuth % 360) / 45)
     return directions[index]
 
-# Function to calculate Doppler shift
-def doppler_shift(frequency, velocity):
-    speed_of_light = 299792458  # m/s
-    dop_freq=frequency * (1 + velocity / speed_of_light)
-    #print(dop_freq)
-    return dop_freq
-
 # Function to tune RTL-SDR to a frequency
 def set_frequency(sdr, frequency):
     sdr.set_center_freq(frequency)
 
-def am_demodulate(data):
+# Audio filter settings
+CHANNEL_DECIMATION = 48    # 2.4 MHz -> 50 kHz
+CHANNEL_CUTOFF = 20e3
+AUDIO_DECIMATION = 4       # 50 kHz -> 12.5 kHz
+AUDIO_CUTOFF = 5e3         # 2400 Hz subcarrier + 2080 Hz sidebands
+
+def audio_sample_rate(rate):
+    return rate / (CHANNEL_DECIMATION * AUDIO_DECIMATION)
+
+def am_demodulate(data, channel_filter, audio_filter):
     # Calculate the magnitude of the IQ samples
     magnitude_data = np.abs(data)
-    # Compute the envelope (magnitude of the analytic signal)
-    envelope = np.abs(hilbert(magnitude_data))
-    return envelope
+    # Bring the audio down to the audio rate, the 2400 Hz subcarrier is kept as is
+    audio = audio_filter.filter(channel_filter.filter(magnitude_data))
+    # Remove the carrier level, WXtoImg expects the subcarrier centred on zero
+    return audio - np.mean(audio)
 
 def process_data(rate, duration, data_queue, b_file_path):
     print("[Tread] >processing data and saving to binary file")
+    # Filters keep their state between chunks
+    channel_filter = OverlapSaveFilter(lowpass_taps(CHANNEL_CUTOFF, rate, numtaps=511), decimation=CHANNEL_DECIMATION, complex_input=False)
+    audio_filter = OverlapSaveFilter(lowpass_taps(AUDIO_CUTOFF, rate / CHANNEL_DECIMATION, numtaps=255), decimation=AUDIO_DECIMATION, complex_input=False)
     with open(b_file_path, 'wb') as f:
         start_time = time.time()
         while True:
@@ -48,12 +54,10 @@ def process_data(rate, duration, data_queue, b_file_path):
                 print("[Thread] >pass ended, processing remaining data...")
             # Get a chunk of data from the queue and process it
             samples = data_queue.get()
-            data_demodulated = am_demodulate(samples)  # Demodulate the data
-            #resampled_data = resample_poly(data_demodulated, up=11025, down=rate) #resample data to 11025Hz to save memory and conform to WxtoImg values
-            #data_int = np.int16(resampled_data / np.max(np.abs(resampled_data)) * (2**15 - 1))  # Convert the real numbers to 16-bit integers
-            data_rounded = np.around(data_demodulated)
-            data_int = data_rounded.astype(np.int16)
-            if np.max(data_int) > 32767 or np.min(data_int) < -32768:
+            data_demodulated = am_demodulate(samples, channel_filter, audio_filter)  # Demodulate the data
+            # The subcarrier of IQ samples in [-1, 1] stays within [-1, 1], scale it to int16
+            data_int = np.int16(np.clip(data_demodulated, -1, 1) * (2**15 - 1))
+            if np.max(np.abs(data_demodulated)) > 1:
                 print("Warning: Clipping detected")
             # Write the processed data to the binary file immediately
             f.write(data_int.tobytes())
@@ -62,30 +66,26 @@ def process_data(rate, duration, data_queue, b_file_path):
     print("[Thread] >processing complete")
 
 # Function to receive and process signals during a pass
-def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
-    # Connect to RTL-SDR
-    sdr = RtlSdr()
+def receive_and_process_pass(satellite_name, frequency, tle1, tle2, serial=None, location=None):
+    # Connect to the RTL-SDR (ppm, gain and bias-tee from sdr_devices.json)
+    device = find_device(serial)
+    if location is not None:
+        # Station of the fleet plan, over the location configured for the dongle
+        device.location = tuple(location)
+    sdr = open_device(device)
 
     # Set RTL-SDR parameters
     sdr.sample_rate = 2.4e6
-    sdr.freq_correction = 60
-    sdr.gain = 'auto'
 
-    # Define observer location
-    observer = Topos(44.384477, 7.542671, elevation_m=500)
-
-    # Load timescale
-    ts = load.timescale()
-    #print(ts)
-    # Define satellite
-    satellite = EarthSatellite(tle1, tle2, satellite_name)
-    #print(satellite)
+    # Define satellite, seen from the antenna of the dongle
+    tle = make_tle(satellite_name, tle1, tle2)
+    batch = PropagationBatch([tle], device.location or STATION)
 
     # Find ongoing pass
-    t0 = ts.utc(datetime.now(timezone.utc) - timedelta(minutes=115))  # current time
-    t, events = satellite.find_events(observer, t0, t0 + timedelta(minutes=115), altitude_degrees=5)  # look for events in the next 40 minutes
-    #print(f"T:{t}, eventi:{events}")
-    passes = [ti.utc_datetime() for ti, event in zip(t, events) if event in [0, 2]]  # consider only rising and setting events
+    t0 = datetime.now(timezone.utc)
+    # Passes above 5° around now, the current one is the first that has not set yet
+    upcoming = [p for p in batch.passes(t0 - timedelta(minutes=20), t0 + timedelta(minutes=50), horizon=5) if p.set > t0]
+    passes = [upcoming[0].rise, upcoming[0].set] if upcoming else []  # rising and setting time
 
     # Check if there is a pass happening right now
     #print(len(passes))
@@ -102,12 +102,15 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
     raw_folder_path=folder_path + r"\DATA_RAW"
     os.makedirs(raw_folder_path, exist_ok=True)
     bin_file_path=os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}.bin")
-    duration = (passes[1] - passes[0]).total_seconds()
+    # Started late (the dongle was busy, the pass is under way): the capture still ends at the set
+    duration = (passes[1] - max(passes[0], t0)).total_seconds()
 
     data_queue = queue.Queue()
     start_time = time.time()
     process_thread = threading.Thread(target=process_data, args=(sdr.sample_rate, duration, data_queue, bin_file_path))
     process_thread.start()
+    # Position and Doppler of the whole pass in one propagation, read once per loop
+    doppler_table = batch.doppler_table(tle.norad, start_time - 60, start_time + duration + 60, float(frequency) * 1e6)
 
     while True:
         time_elapsed = time.time() - start_time
@@ -118,27 +121,14 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
         progress_percent = int((time_elapsed / duration) * 100)
         
 
-        t = ts.now()
-        alt, az, distance = (satellite - observer).at(t).altaz()
-        geocentric = satellite.at(t)
-        # Get the observer's geocentric position and velocity
-        observer_geocentric = observer.at(t)
-        # Calculate the relative position and velocity of the satellite with respect to the observer
-        relative_position = geocentric.position.km - observer_geocentric.position.km
-        relative_velocity = geocentric.velocity.km_per_s - observer_geocentric.velocity.km_per_s
-        # Calculate the unit vector pointing from the observer to the satellite
-        unit_vector = relative_position / np.linalg.norm(relative_position)
-        # Calculate the component of the satellite's velocity along the line of sight
-        relative_velocity_along_line_of_sight = np.dot(relative_velocity, unit_vector)
-        # Use this relative velocity for the Doppler shift calculation
-        adjusted_frequency = doppler_shift(float(frequency) * 1e6, relative_velocity_along_line_of_sight)
+        alt, az, adjusted_frequency = doppler_table.at(time.time())
         set_frequency(sdr, adjusted_frequency)
         samples = sdr.read_samples(int(sdr.sample_rate))
         data_queue.put(samples)
         signal_strength = np.mean(np.abs(samples))
         
         # Print status update
-        sys.stdout.write(f"\rPass Progress: {progress_percent}%, Time Remaining: {int((time_remaining// 60) % 60)}:{int(time_remaining%60)} - Signal Strength: {signal_strength:.2f}, current frequency: {adjusted_frequency} - Current elevation: {int(alt.degrees)}°, current azimuth: {int(az.degrees)}° {azimuth_to_compass(az)}               ")
+        sys.stdout.write(f"\rPass Progress: {progress_percent}%, Time Remaining: {int((time_remaining// 60) % 60)}:{int(time_remaining%60)} - Signal Strength: {signal_strength:.2f}, current frequency: {adjusted_frequency} - Current elevation: {int(alt)}°, current azimuth: {int(az)}° {azimuth_to_compass(az)}               ")
         sys.stdout.flush()
 
     process_thread.join()
@@ -146,7 +136,7 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
     # Convert the binary file to a WAV file
     print("Converting binary file to WAV format")
     data = np.fromfile(bin_file_path, dtype=np.int16)
-    write(file_path, int(sdr.sample_rate), data)
+    write(file_path, int(audio_sample_rate(sdr.sample_rate)), data)
     print(f"[WARNING]: check file duration, should be {duration} or{int((duration// 60) % 60)}:{int(duration %60)}!!")
     # Delete the binary file
     #os.remove(bin_file_path)
@@ -167,23 +157,33 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
 
 # Main function
 if __name__ == "__main__":
-    """# Parse command-line arguments
-    satellite_name = sys.argv[1].replace("_"," ")
-    frequency = sys.argv[2]
-    tle1 = sys.argv[3].replace("_"," ")
-    tle2 = sys.argv[4].replace("_"," ")
-    #print(sys.argv)"""
-    """satellite_name = 'NOAA 15'
-    frequency = '137.6200'
-    tle1='1 25338U 98030A   24115.51118005  .00000653  00000+0  28852-3 0  9996'
-    tle2='2 25338  98.5736 143.7484 0011476 119.3572 240.8756 14.26547466349787'"""
+    # --device SERIAL selects the dongle (as passed by the scheduler), the first one by default
+    serial = None
+    if "--device" in sys.argv:
+        i = sys.argv.index("--device")
+        serial = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    # --location LAT,LON,ELEVATION is the station of the fleet plan (as passed by the scheduler)
+    location = None
+    if "--location" in sys.argv:
+        i = sys.argv.index("--location")
+        location = [float(value) for value in sys.argv[i + 1].split(",")]
+        del sys.argv[i:i + 2]
+    # Test values, replaced by the command-line arguments (as passed by the scheduler)
     satellite_name = 'NOAA 18'
     frequency = '137.9125'
-    tle1='1 28654U 05018A   24123.18790732  .00000331  00000+0  20054-3 0  9998'
-    tle2='2 28654  98.8746 200.5340 0014240 189.3128 170.7782 14.13187184976761'
-    """satellite_name = 'NOAA 19'
-    frequency = '137.1000'
-    tle1='1 33591U 09005A   24123.20371255  .00000299  00000+0  18481-3 0  9996'
-    tle2='2 33591  99.0507 178.5095 0014704  64.6883 295.5810 14.12986546785139'"""
+    if len(sys.argv) >= 5:
+        satellite_name = sys.argv[1].replace("_", " ")
+        frequency = sys.argv[2]
+        tle1 = sys.argv[3].replace("_", " ")
+        tle2 = sys.argv[4].replace("_", " ")
+    else:
+        if len(sys.argv) >= 3:
+            satellite_name = sys.argv[1].replace("_", " ")
+            frequency = sys.argv[2]
+        # No TLE given: the one of the local store with the epoch nearest to now
+        tle_store = TLEStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt"))
+        record = tle_store.nearest(satellite_name, datetime.now(timezone.utc))
+        tle1, tle2 = record.line1, record.line2
     print(f"Processing pass for {satellite_name} at {frequency}MHz") #\n[orbital data: {tle1}, {tle2}]
-    receive_and_process_pass(satellite_name, frequency, tle1, tle2)
\ No newline at end of file
+    receive_and_process_pass(satellite_name, frequency, tle1, tle2, serial, location)
\ No newline at end of file
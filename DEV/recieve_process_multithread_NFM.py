@@ -2,28 +2,33 @@ import os
 import sys
 import time
 import queue
+import asyncio
 import threading
 import subprocess
-from rtlsdr import RtlSdr
 import numpy as np
 from scipy.io.wavfile import write
-from scipy.signal import butter, lfilter
-from skyfield.api import Topos, load, EarthSatellite
+from nfm_dsp import NfmDemodulator, WIDEBAND_DECIMATION, audio_sample_rate, to_int16
+from apt_live import LiveDecoder
+from spectrum_monitor import SpectrumMonitor
+from signal_gate import SignalGate, format_seconds
+from pipeline_metrics import PipelineMetrics
+from pass_trace import PassTrace
+from sampling_profiler import SamplingProfiler
+from iq_archive import IQArchiveWriter
+from background_writer import BackgroundWriter
+from pass_catalog import PassCatalog, snr_summary, doppler_summary
+from tle_store import TLEStore, make_tle
+from propagation import PropagationBatch, STATION
+from sdr_pool import find_device, open_device
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 
 
 def azimuth_to_compass(azimuth):
     directions = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N']
-    index = round((azimuth.degrees % 360) / 45)
+    index = round((azimuth % 360) / 45)
     return directions[index]
 
-# Function to calculate Doppler shift
-def doppler_shift(frequency, velocity):
-    speed_of_light = 299792458  # m/s
-    dop_freq=frequency * (1 + velocity / speed_of_light)
-    #print(dop_freq)
-    return dop_freq
-
 # Function to tune RTL-SDR to a frequency
 def set_frequency(sdr, frequency):
     sdr.set_center_freq(frequency)
@@ -52,86 +57,288 @@ def set_frequency(sdr, frequency):
     return y"""
 
 
-def butter_bandpass(lowcut, highcut, fs, order=5):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
-
-def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = lfilter(b, a, data)
-    return y
-
-def fm_demodulate(data, last_phase):
-    # Compute the phase of the data
-    phase = np.angle(data)
-    # Adjust the first phase value by adding the last phase from the previous chunk
-    phase[0] += last_phase
-    # Unwrap the phase to remove discontinuities
-    unwrapped_phase = np.unwrap(phase)
-    # Compute the derivative of the phase
-    derivative = np.diff(unwrapped_phase)
-    # Compute the last phase value for the next chunk
-    last_phase = unwrapped_phase[-1]
-    return derivative, last_phase
-
-def process_data(rate, duration, data_queue, b_file_path, frequency):
+PREVIEW_INTERVAL = 10      # seconds between two live preview images
+
+# Signal gating: only demodulate and save between AOS and LOS detected on the carrier SNR
+SIGNAL_GATING = True
+GATE_OPEN_SNR = 6.0        # dB
+GATE_CLOSE_SNR = 3.0       # dB
+GATE_LOSS_TIME = 20        # seconds under GATE_CLOSE_SNR before LOS
+GATE_PRE_ROLL = 3          # seconds of signal kept from before the AOS
+
+# Pipeline metrics: Prometheus textfile rewritten during the pass, JSON summary at the end
+METRICS_TEXTFILE_DIR = None  # e.g. the node_exporter textfile collector directory, None for DATA_RAW
+METRICS_INTERVAL = 10        # seconds between two textfile updates
+
+# Trace of the pass in Chrome trace-event format (open it in Perfetto or chrome://tracing)
+TRACE_PASS = False
+
+# IQ archive for reprocessing: 'raw' (2.4 MHz uint8), 'decimated' (150 kHz int16) or None
+ARCHIVE_IQ = 'decimated'
+
+# Disk writes run on a background thread with preallocated buffers
+WRITER_BUFFERS = 3
+WRITER_FSYNC_INTERVAL = 5    # seconds between two fsync, None to leave it to the OS
+WRITER_DROP_CACHE = True     # keep recorded data out of the page cache (posix systems only)
+
+# Capture tasks: the reader runs back to back, Doppler and status have their own rates
+DOPPLER_RATE = 10            # Hz, position and Doppler updates
+RETUNE_STEP = 20             # Hz of Doppler drift before the SDR is tuned again
+STATUS_RATE = 1              # Hz, status line updates
+DATA_QUEUE_CHUNKS = 10       # 1 s chunks buffered for the processing thread before chunks are dropped
+READ_ERROR_LIMIT = 10        # consecutive failed reads before the dongle is given up and the pass ended
+READ_RETRY_DELAY = 0.1       # seconds between a failed read and the next one
+
+# SQLite catalog of every pass and product, None to disable
+CATALOG_PATH = r"C:\Users\alexa\Desktop\NOAA\passes.sqlite"
+
+def process_data(rate, duration, data_queue, b_file_path, frequency, audio_queue=None, monitor=None, gate=None, metrics=None, trace=None, archive=None, capture_done=None):
     print("[Thread] >processing data and saving to binary file")
-    last_phase = 0  # Variable to store the last phase value
-    with open(b_file_path, 'wb') as f:
+    demodulator = NfmDemodulator(rate)
+    position = 0.0  # seconds of samples received so far
+    if metrics is None:
+        metrics = PipelineMetrics("")
+    if trace is None:
+        trace = PassTrace(enabled=False)
+    trace.name_thread("process_data")
+    chunk_index = 0
+    archived = False  # the first archived sample gives the start time of the archive
+    kept_end = None  # end of the last chunk kept, in seconds
+    audio_rate = audio_sample_rate(rate)
+    with BackgroundWriter(b_file_path, buffer_size=1 << 20, buffers=WRITER_BUFFERS, fsync_interval=WRITER_FSYNC_INTERVAL, drop_cache=WRITER_DROP_CACHE, metrics=metrics) as f:
         start_time = time.time()
         while True:
             time_elapsed = time.time() - start_time
-            if time_elapsed > duration and data_queue.empty():
+            pass_ended = time_elapsed > duration or (gate is not None and gate.finished) or \
+                         (capture_done is not None and capture_done.is_set())
+            if pass_ended and data_queue.empty():
                 break
-            elif time_elapsed > duration:
+            elif pass_ended:
                 print("[Thread] >pass ended, processing remaining data...")
             # Get a chunk of data from the queue and process it
-            samples = data_queue.get()
-            # Demodulate the data and update the last phase value
-            filtered_data=butter_bandpass_filter(samples, frequency, 34e3, rate)
-            data_demodulated, last_phase = fm_demodulate(filtered_data, last_phase)
-            #resampled_data = resample_poly(data_demodulated, up=11025, down=rate) #resample data to 11025Hz to save memory and conform to WxtoImg values
-            #data_int = np.int16(resampled_data / np.max(np.abs(resampled_data)) * (2**15 - 1))  # Convert the real numbers to 16-bit integers
-            # Convert to int16
-            #data_rounded = np.around(data_demodulated)
-            #data_int = data_rounded.astype(np.int16)
-            data_int = np.int16(data_demodulated * (2**15 - 1))
-            if np.max(data_int) > 32767 or np.min(data_int) < -32768:
-                print("Warning: Clipping detected")
-            # Write the processed data to the binary file immediately
-            f.write(data_int.tobytes())
+            try:
+                with trace.span("data_queue.get", chunk=chunk_index + 1):
+                    samples, dropped = data_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            chunk_index += 1
+            # Samples the reader had to drop before this chunk: time goes on
+            position += dropped / rate
+            chunk_duration = len(samples) / rate
+            metrics.gauge("queue_depth", data_queue.qsize())
+            # Select the channel, demodulate and filter the audio
+            filter_start = time.perf_counter()
+            with trace.span("wideband_filter", chunk=chunk_index):
+                wideband = demodulator.wideband(samples)
+            wideband_time = time.perf_counter() - filter_start
+            if monitor is not None:
+                with metrics.timer("monitor"), trace.span("monitor", chunk=chunk_index):
+                    monitor.feed(wideband)
+            metrics.add_signal(chunk_duration)
+            # Outside AOS/LOS only the SNR estimate runs, the gate hands the pre-roll over when it opens
+            if gate is None:
+                kept = [(position, (samples, wideband))]
+            else:
+                kept = gate.update(monitor.snr_db, position, chunk_duration, (samples, wideband))
+            position += chunk_duration
+            if not kept:
+                metrics.record("filter", wideband_time)
+                data_queue.task_done()
+                continue
+            for i, (chunk_position, (samples, wideband)) in enumerate(kept):
+                filter_time = wideband_time if i == len(kept) - 1 else 0.0
+                # Dropped samples and signal lost in the middle of the pass: zeros keep the archive
+                # and the audio on the time line of the pass
+                missing = chunk_position - kept_end if kept_end is not None else 0.0
+                kept_end = chunk_position + len(samples) / rate
+                if missing > 0.5 / rate:
+                    if archived:
+                        archive.gap(round(missing * rate) if ARCHIVE_IQ == 'raw' else round(missing * rate / WIDEBAND_DECIMATION))
+                    silence = np.zeros(round(missing * audio_rate), dtype=np.float32)
+                    with metrics.timer("write"), trace.span("write", chunk=chunk_index):
+                        f.write(np.zeros(len(silence), dtype=np.int16))
+                    if audio_queue is not None:
+                        audio_queue.put(silence)
+                if archive is not None:
+                    if not archived:
+                        archive.header["start_time"] = datetime.fromtimestamp(start_time + chunk_position, timezone.utc).isoformat()
+                        archived = True
+                    with metrics.timer("archive"), trace.span("archive", chunk=chunk_index):
+                        archive.write(samples if ARCHIVE_IQ == 'raw' else wideband)
+                filter_start = time.perf_counter()
+                with trace.span("channel_filter", chunk=chunk_index):
+                    channel = demodulator.channel(wideband)
+                filter_time += time.perf_counter() - filter_start
+                with metrics.timer("demod"), trace.span("demod", chunk=chunk_index):
+                    data_demodulated = demodulator.demodulate(channel)
+                filter_start = time.perf_counter()
+                with trace.span("audio_filter", chunk=chunk_index):
+                    audio = demodulator.audio(data_demodulated)
+                metrics.record("filter", filter_time + time.perf_counter() - filter_start)
+                # Convert to int16
+                data_int, clipped = to_int16(audio)
+                if clipped:
+                    print("Warning: Clipping detected")
+                # Write the processed data to the binary file immediately
+                with metrics.timer("write"), trace.span("write", chunk=chunk_index):
+                    f.write(data_int)
+                # Hand the audio to the live decoder
+                if audio_queue is not None:
+                    audio_queue.put(audio)
             # Mark the task as done after processing
             data_queue.task_done()
     print("[Thread] >processing complete")
 
+# Capture task: reads the SDR on its own thread and hands every chunk to the processing thread
+async def read_samples(sdr, data_queue, stop, metrics, trace):
+    loop = asyncio.get_running_loop()
+    chunk_size = int(sdr.sample_rate)
+    chunk_start = None
+    chunk_index = 0
+    errors = 0  # consecutive failed reads
+    dropped = 0  # samples lost since the last chunk handed over, sent with the next one
+    # One dedicated thread, so the reads are never queued behind other blocking calls
+    with ThreadPoolExecutor(1, thread_name_prefix="sdr-reader") as reader:
+        await loop.run_in_executor(reader, trace.name_thread, "sdr_reader")
+        while not stop.is_set():
+            # Time lost between two reads is signal the dongle had to drop
+            now = time.time()
+            if chunk_start is not None:
+                late = (now - chunk_start) - chunk_size / sdr.sample_rate
+                if late > 0:
+                    metrics.count("late_samples", int(late * sdr.sample_rate))
+            chunk_start = now
+            chunk_index += 1
+            read_start = time.perf_counter()
+            try:
+                with trace.span("read_samples", chunk=chunk_index):
+                    samples = await loop.run_in_executor(reader, sdr.read_samples, chunk_size)
+            except IOError as e:
+                # USB errors are often transient: count them and read again, give up when they keep coming
+                metrics.count("read_errors")
+                errors += 1
+                print(f"\n[Reader] >read failed ({e}), {errors} in a row")
+                if errors >= READ_ERROR_LIMIT:
+                    raise
+                await asyncio.sleep(READ_RETRY_DELAY)
+                continue
+            errors = 0
+            metrics.record("read", time.perf_counter() - read_start)
+            if len(samples) < chunk_size:
+                metrics.count("dropped_samples", chunk_size - len(samples))
+                dropped += chunk_size - len(samples)
+            try:
+                with trace.span("data_queue.put", chunk=chunk_index, depth=data_queue.qsize()):
+                    data_queue.put_nowait((samples, dropped))
+                dropped = 0
+            except queue.Full:
+                # The processing thread is behind: drop the chunk rather than stall the reads
+                metrics.count("dropped_samples", len(samples))
+                dropped += len(samples)
+            metrics.gauge("queue_depth", data_queue.qsize())
+
+# Capture task: keeps the SDR on the Doppler corrected frequency and publishes the satellite position
+async def track_doppler(sdr, doppler_table, frequency, start_time, stop, positions, profile, metrics, trace):
+    loop = asyncio.get_running_loop()
+    period = 1 / DOPPLER_RATE
+    next_update = loop.time()
+    tuned = None
+    while not stop.is_set():
+        with metrics.timer("doppler"), trace.span("doppler"):
+            alt, az, adjusted_frequency = doppler_table.at(time.time())
+            if tuned is None or abs(adjusted_frequency - tuned) >= RETUNE_STEP:
+                with trace.span("set_frequency", frequency=adjusted_frequency):
+                    set_frequency(sdr, adjusted_frequency)
+                tuned = adjusted_frequency
+        profile["times"].append(time.time() - start_time)
+        profile["offsets"].append(adjusted_frequency - frequency)
+        profile["max_elevation"] = max(profile["max_elevation"], alt)
+        # Only the latest position matters to the status line
+        if positions.full():
+            positions.get_nowait()
+        positions.put_nowait((alt, az, adjusted_frequency))
+        next_update += period
+        await asyncio.sleep(max(0, next_update - loop.time()))
+
+# Capture task: status line and Prometheus textfile
+async def render_status(start_time, duration, monitor, stop, positions, metrics, metrics_path):
+    last_metrics = 0
+    alt, az, adjusted_frequency = await positions.get()
+    while not stop.is_set():
+        if not positions.empty():
+            alt, az, adjusted_frequency = positions.get_nowait()
+        now = time.time()
+        time_elapsed = now - start_time
+        time_remaining = max(0, duration - time_elapsed)
+        progress_percent = int((time_elapsed / duration) * 100)
+        if now - last_metrics >= METRICS_INTERVAL:
+            metrics.write_prometheus(metrics_path)
+            last_metrics = now
+        sys.stdout.write(f"\rPass Progress: {progress_percent}%, Time Remaining: {int((time_remaining// 60) % 60)}:{int(time_remaining%60)} - SNR: {monitor.snr_db:.1f} dB, carrier offset: {monitor.peak_offset / 1e3:+.1f} kHz, current frequency: {adjusted_frequency:.0f} - Current elevation: {int(alt)}°, current azimuth: {int(az)}° {azimuth_to_compass(az)}               ")
+        sys.stdout.flush()
+        await asyncio.sleep(1 / STATUS_RATE)
+
+# Capture task: ends the capture at the predicted LOS, or earlier when the signal gate sees the LOS or the reader stops
+async def wait_pass_end(start_time, duration, gate, stop, reader=None):
+    while True:
+        time_remaining = duration - (time.time() - start_time)
+        if time_remaining <= 0:
+            print("\npass complete, processing data...")
+            break
+        if gate is not None and gate.finished:
+            print(f"\nloss of signal at {format_seconds(gate.los)}, processing data...")
+            break
+        if reader is not None and reader.done():
+            print("\nno more samples from the dongle, processing data...")
+            break
+        await asyncio.sleep(min(time_remaining, 0.5))
+    stop.set()
+
+# Function to run the capture of a pass as cooperating tasks, returns the Doppler profile and max elevation
+async def capture_pass(sdr, doppler_table, frequency, start_time, duration, data_queue, monitor, gate, metrics, trace, metrics_path):
+    stop = asyncio.Event()
+    positions = asyncio.Queue(maxsize=1)
+    profile = {"times": [], "offsets": [], "max_elevation": 0.0}
+    # Tune before the first read
+    alt, az, adjusted_frequency = doppler_table.at(time.time())
+    set_frequency(sdr, adjusted_frequency)
+    reader = asyncio.create_task(read_samples(sdr, data_queue, stop, metrics, trace))
+    tasks = [
+        asyncio.create_task(track_doppler(sdr, doppler_table, frequency, start_time, stop, positions, profile, metrics, trace)),
+        asyncio.create_task(render_status(start_time, duration, monitor, stop, positions, metrics, metrics_path)),
+    ]
+    await wait_pass_end(start_time, duration, gate, stop, reader)
+    # The reader finishes its current read, the others stop right away
+    try:
+        await reader
+    except IOError as e:
+        print(f"[Reader] >dongle given up after {READ_ERROR_LIMIT} failed reads: {e}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return profile["times"], profile["offsets"], profile["max_elevation"]
+
 # Function to receive and process signals during a pass
-def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
-    # Connect to RTL-SDR
-    sdr = RtlSdr()
+def receive_and_process_pass(satellite_name, frequency, tle1, tle2, profile=False, serial=None, location=None):
+    # Connect to the RTL-SDR (ppm, gain and bias-tee from sdr_devices.json)
+    device = find_device(serial)
+    if location is not None:
+        # Station of the fleet plan, over the location configured for the dongle
+        device.location = tuple(location)
+    sdr = open_device(device)
 
     # Set RTL-SDR parameters
     sdr.sample_rate = 2.4e6
-    sdr.freq_correction = 60
-    sdr.gain = 'auto'
 
-    # Define observer location
-    observer = Topos(44.384477, 7.542671, elevation_m=500)
-
-    # Load timescale
-    ts = load.timescale()
-    #print(ts)
-    # Define satellite
-    satellite = EarthSatellite(tle1, tle2, satellite_name)
-    #print(satellite)
+    # Define satellite, seen from the antenna of the dongle
+    tle = make_tle(satellite_name, tle1, tle2)
+    batch = PropagationBatch([tle], device.location or STATION)
 
     # Find ongoing pass
-    t0 = ts.utc(datetime.now(timezone.utc) - timedelta(minutes=5))  # current time
-    t, events = satellite.find_events(observer, t0, t0 + timedelta(minutes=50), altitude_degrees=5)  # look for events in the next 40 minutes
-    #print(f"T:{t}, eventi:{events}")
-    passes = [ti.utc_datetime() for ti, event in zip(t, events) if event in [0, 2]]  # consider only rising and setting events
+    t0 = datetime.now(timezone.utc)
+    # Passes above 5° around now, the current one is the first that has not set yet
+    upcoming = [p for p in batch.passes(t0 - timedelta(minutes=20), t0 + timedelta(minutes=50), horizon=5) if p.set > t0]
+    passes = [upcoming[0].rise, upcoming[0].set] if upcoming else []  # rising and setting time
 
     # Check if there is a pass happening right now
     #print(len(passes))
@@ -148,51 +355,83 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
     raw_folder_path=folder_path + r"\DATA_RAW"
     os.makedirs(raw_folder_path, exist_ok=True)
     bin_file_path=os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}.bin")
-    duration = (passes[1] - passes[0]).total_seconds()
-
-    data_queue = queue.Queue()
+    # Started late (the dongle was busy, the pass is under way): the capture still ends at the set
+    duration = (passes[1] - max(passes[0], t0)).total_seconds()
+
+    image_path = os.path.join(folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_raw.png")
+    preview_path = os.path.join(folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_live.png")
+
+    data_queue = queue.Queue(maxsize=DATA_QUEUE_CHUNKS)
+    audio_queue = queue.Queue()
+    # Spectrum, SNR and waterfall of the wideband IQ, updated by the processing thread
+    monitor = SpectrumMonitor(sdr.sample_rate / WIDEBAND_DECIMATION)
+    gate = SignalGate(GATE_OPEN_SNR, GATE_CLOSE_SNR, close_after=GATE_LOSS_TIME, pre_roll=GATE_PRE_ROLL, pass_end=duration) if SIGNAL_GATING else None
+    metrics = PipelineMetrics(satellite_name)
+    metrics_path = os.path.join(METRICS_TEXTFILE_DIR or raw_folder_path, f"noaa_apt_{satellite_name.replace(' ', '_')}.prom")
+    trace = PassTrace(enabled=TRACE_PASS)
+    trace.name_thread("capture")
+    archive = None
+    if ARCHIVE_IQ:
+        archive_path = os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}.iqz")
+        archive_rate = sdr.sample_rate if ARCHIVE_IQ == 'raw' else sdr.sample_rate / WIDEBAND_DECIMATION
+        archive_file = BackgroundWriter(archive_path, buffers=WRITER_BUFFERS, fsync_interval=WRITER_FSYNC_INTERVAL, drop_cache=WRITER_DROP_CACHE, metrics=metrics)
+        archive = IQArchiveWriter(archive_file, archive_rate, 'uint8' if ARCHIVE_IQ == 'raw' else 'int16',
+                                  satellite=satellite_name, center_freq=float(frequency) * 1e6, doppler_corrected=True,
+                                  gain=sdr.gain, freq_correction=sdr.freq_correction, device=device.serial, tle=[tle1, tle2],
+                                  station=metrics.labels["station"], start_time=datetime.now(timezone.utc).isoformat())  # until the first archived sample
+    # The live decoder builds the image while the pass is running
+    live_decoder = LiveDecoder(audio_sample_rate(sdr.sample_rate), preview_path, PREVIEW_INTERVAL)
+    live_thread = threading.Thread(target=live_decoder.run, args=(audio_queue, image_path))
+    live_thread.start()
     start_time = time.time()
-    process_thread = threading.Thread(target=process_data, args=(sdr.sample_rate, duration, data_queue, bin_file_path, float(frequency) * 1e6))
+    capture_done = threading.Event()
+    process_thread = threading.Thread(target=process_data, args=(sdr.sample_rate, duration, data_queue, bin_file_path, float(frequency) * 1e6, audio_queue, monitor, gate, metrics, trace, archive, capture_done))
     process_thread.start()
-
-    while True:
-        time_elapsed = time.time() - start_time
-        if time_elapsed > duration:
-            print("\npass complete, processing data...")
-            break
-        time_remaining = duration - time_elapsed
-        progress_percent = int((time_elapsed / duration) * 100)
-        
-
-        t = ts.now()
-        alt, az, distance = (satellite - observer).at(t).altaz()
-        geocentric = satellite.at(t)
-        # Get the observer's geocentric position and velocity
-        observer_geocentric = observer.at(t)
-        # Calculate the relative position and velocity of the satellite with respect to the observer
-        relative_position = geocentric.position.km - observer_geocentric.position.km
-        relative_velocity = geocentric.velocity.km_per_s - observer_geocentric.velocity.km_per_s
-        # Calculate the unit vector pointing from the observer to the satellite
-        unit_vector = relative_position / np.linalg.norm(relative_position)
-        # Calculate the component of the satellite's velocity along the line of sight
-        relative_velocity_along_line_of_sight = np.dot(relative_velocity, unit_vector)
-        # Use this relative velocity for the Doppler shift calculation
-        adjusted_frequency = doppler_shift(float(frequency) * 1e6, relative_velocity_along_line_of_sight)
-        set_frequency(sdr, adjusted_frequency)
-        samples = sdr.read_samples(int(sdr.sample_rate))
-        data_queue.put(samples)
-        signal_strength = np.mean(np.abs(samples))
-        
-        # Print status update
-        sys.stdout.write(f"\rPass Progress: {progress_percent}%, Time Remaining: {int((time_remaining// 60) % 60)}:{int(time_remaining%60)} - Signal Strength: {signal_strength:.2f}, current frequency: {adjusted_frequency} - Current elevation: {int(alt.degrees)}°, current azimuth: {int(az.degrees)}° {azimuth_to_compass(az)}               ")
-        sys.stdout.flush()
-
-    process_thread.join()
+    # Statistical profile of the DSP thread, saved as collapsed stacks next to the recording
+    if profile:
+        profiler = SamplingProfiler(process_thread)
+        profiler.start()
+
+    # Position and Doppler of the whole pass in one propagation, read at DOPPLER_RATE during the capture
+    doppler_table = batch.doppler_table(tle.norad, start_time - 60, start_time + duration + 60, float(frequency) * 1e6)
+    try:
+        doppler_times, doppler_offsets, max_elevation = asyncio.run(capture_pass(
+            sdr, doppler_table, float(frequency) * 1e6, start_time, duration, data_queue, monitor, gate, metrics, trace, metrics_path))
+    finally:
+        # However the capture ended, the processing thread drains the queue and the archive gets its index
+        capture_done.set()
+        process_thread.join()
+        if archive is not None:
+            archive.close()
+        # Let the live decoder finish the last lines and write the final image
+        audio_queue.put(None)
+        with trace.span("live_image"):
+            live_thread.join()
+    if archive is not None:
+        stats = archive_file.stats()
+        print(f"archive: {stats['bytes'] / 1e6:.1f} MB, write latency p50 {stats['p50'] * 1e3:.1f} ms, p99 {stats['p99'] * 1e3:.1f} ms, {stats['stalls']} stalls")
+    if profile:
+        profiler.stop()
+        profile_path = os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}.prof")
+        profiler.save(profile_path)
+        print(f"profile of the processing thread ({profiler.samples} samples) saved to {profile_path}")
+    if gate is not None:
+        gate.finish(time.time() - start_time)
+    metrics.write_prometheus(metrics_path)
+    metrics.write_json(os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_metrics.json"))
+    summary = metrics.summary()
+    if summary["realtime_factor"] is not None:
+        print(f"realtime factor {summary['realtime_factor']:.2f}, {summary['counters'].get('late_samples', 0)} late and {summary['counters'].get('dropped_samples', 0)} dropped samples")
+    if summary["writer_utilisation"] is not None:
+        print(f"background writer busy {summary['writer_utilisation']:.1%} of the pass")
+    print(f"raw image saved to {image_path}")
+    monitor.save_waterfall(os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_waterfall.png"))
     
     # Convert the binary file to a WAV file
     print("Converting binary file to WAV format")
-    data = np.fromfile(bin_file_path, dtype=np.int16)
-    write(file_path, int(sdr.sample_rate), data)
+    with trace.span("wav_conversion"):
+        data = np.fromfile(bin_file_path, dtype=np.int16)
+        write(file_path, int(audio_sample_rate(sdr.sample_rate)), data)
     print(f"[WARNING]: check file duration, should be {duration} or {int((duration// 60) % 60)}:{int(duration %60)}!!")
     # Delete the binary file
     #os.remove(bin_file_path)
@@ -206,32 +445,78 @@ def receive_and_process_pass(satellite_name, frequency, tle1, tle2):
         for image_type in image_types:
             print(f">Processing {image_type} image")
             output_path=os.path.join(folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_{image_type}.png")
-            subprocess.run([r"C:\Program Files (x86)\WXtoImg\wxtoimg.exe", "-n", f"-e{image_type}", "-o", "-tNOAA", file_path, output_path])
+            with trace.span("wxtoimg", image_type=image_type):
+                subprocess.run([r"C:\Program Files (x86)\WXtoImg\wxtoimg.exe", "-n", f"-e{image_type}", "-o", "-tNOAA", file_path, output_path])
     else:
         pass
         #meteor satellite
+    trace_path = os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_trace.json")
+    trace.save(trace_path)
+
+    # Record the pass and everything it produced in the catalog
+    if CATALOG_PATH:
+        # The gate counts seconds of signal from the start of the capture
+        aos = los = None
+        if gate is not None and gate.aos is not None:
+            aos = datetime.fromtimestamp(start_time + gate.aos, timezone.utc)
+        if gate is not None and gate.los is not None:
+            los = datetime.fromtimestamp(start_time + gate.los, timezone.utc)
+        with PassCatalog(CATALOG_PATH) as catalog:
+            pass_id = catalog.add_pass(
+                satellite_name, cur_pass, end_time=passes[1], station=metrics.labels["station"],
+                frequency=float(frequency) * 1e6, tle_epoch=tle.epoch,
+                aos=aos, los=los,
+                max_elevation=max_elevation, lines=live_decoder.lines, synced_lines=live_decoder.sync.synced_lines,
+                clock_ppm=(live_decoder.sync.clock_ratio - 1) * 1e6, realtime_factor=summary["realtime_factor"],
+                **snr_summary(monitor.snr_history), **doppler_summary(doppler_times, doppler_offsets))
+            base_path = os.path.join(raw_folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}")
+            products = [(bin_file_path, "recording"), (file_path, "wav"), (image_path, "raw_image"),
+                        (base_path + "_waterfall.png", "waterfall"), (base_path + "_metrics.json", "metrics"),
+                        (base_path + ".prof", "profile"), (trace_path, "trace")]
+            if archive is not None:
+                products.append((archive_path, "archive"))
+            if 'NOAA' in satellite_name:
+                products += [(os.path.join(folder_path, f"{satellite_name.replace(' ', '_')}_{cur_pass.strftime('%d-%m-%y_%H-%M-%S')}_{image_type}.png"), image_type)
+                             for image_type in image_types]
+            for path, kind in products:
+                catalog.add_file(pass_id, path, kind)
+        print(f"pass recorded in the catalog {CATALOG_PATH}")
 
 # Main function
 if __name__ == "__main__":
-    # Parse command-line arguments
-    """satellite_name = sys.argv[1].replace("_"," ")
-    frequency = sys.argv[2]
-    tle1 = sys.argv[3].replace("_"," ")
-    tle2 = sys.argv[4].replace("_"," ")
-    #print(sys.argv)"""
-    """satellite_name = 'NOAA 15'
-    frequency = '137.6200'
-    tle1='1 25338U 98030A   24115.51118005  .00000653  00000+0  28852-3 0  9996'
-    tle2='2 25338  98.5736 143.7484 0011476 119.3572 240.8756 14.26547466349787'"""
-    """satellite_name = 'NOAA 18'
-    frequency = '137.9125'
-    tle1='1 28654U 05018A   24123.18790732  .00000331  00000+0  20054-3 0  9998'
-    tle2='2 28654  98.8746 200.5340 0014240 189.3128 170.7782 14.13187184976761'"""
+    # --profile samples the processing thread for the whole pass
+    profile = "--profile" in sys.argv
+    if profile:
+        sys.argv.remove("--profile")
+    # --device SERIAL selects the dongle (as passed by the scheduler), the first one by default
+    serial = None
+    if "--device" in sys.argv:
+        i = sys.argv.index("--device")
+        serial = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    # --location LAT,LON,ELEVATION is the station of the fleet plan (as passed by the scheduler)
+    location = None
+    if "--location" in sys.argv:
+        i = sys.argv.index("--location")
+        location = [float(value) for value in sys.argv[i + 1].split(",")]
+        del sys.argv[i:i + 2]
+    # Test values, replaced by the command-line arguments (as passed by the scheduler)
     satellite_name = 'NOAA 19'
     frequency = '137.1000'
-    tle1='1 33591U 09005A   24141.82693966  .00000484  00000+0  28357-3 0  9999'
-    tle2='2 33591  99.0486 197.3345 0013878  14.0975 346.0581 14.13007727787768'
+    if len(sys.argv) >= 5:
+        satellite_name = sys.argv[1].replace("_", " ")
+        frequency = sys.argv[2]
+        tle1 = sys.argv[3].replace("_", " ")
+        tle2 = sys.argv[4].replace("_", " ")
+    else:
+        if len(sys.argv) >= 3:
+            satellite_name = sys.argv[1].replace("_", " ")
+            frequency = sys.argv[2]
+        # No TLE given: the one of the local store with the epoch nearest to now
+        tle_store = TLEStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt"))
+        record = tle_store.nearest(satellite_name, datetime.now(timezone.utc))
+        tle1, tle2 = record.line1, record.line2
     print(f"Processing pass for {satellite_name} at {frequency}MHz") #\n[orbital data: {tle1}, {tle2}]
-    receive_and_process_pass(satellite_name, frequency, tle1, tle2)
+    receive_and_process_pass(satellite_name, frequency, tle1, tle2, profile, serial, location)
 
 
@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.io import wavfile
+from scipy.signal import welch
+from nfm_dsp import NfmDemodulator, WIDEBAND_DECIMATION, FM_DEVIATION, AUDIO_CUTOFF, to_int16
+from fft_filter import StreamingResampler
+from apt_decoder import decode_audio, to_uint8, save_png
+from apt_envelope import APT_SUBCARRIER
+from iq_archive import IQArchiveReader
+from pipeline_metrics import write_atomic
+from pass_catalog import PassCatalog, parse_pass_name, doppler_summary
+from tle_store import TLEStore
+from propagation import PropagationBatch, doppler_offsets
+
+# Bulk reprocessing of recorded passes:
+#
+#     python reprocess.py C:\Users\alexa\Desktop\NOAA --workers 4 --memory-limit 1500
+#
+# Every NOAA_xx/DATA_RAW/<pass>.iqz (IQ archive) or <pass>.bin (headerless samples) goes
+# through three stages, each skipped when its output is newer than its input:
+#
+#     demod   <pass>.iqz / .bin  -> NOAA_xx/<pass>.wav
+#     decode  <pass>.wav         -> NOAA_xx/DATA_RAW/<pass>_lines.npy
+#     render  <pass>_lines.npy   -> NOAA_xx/<pass>_raw.png (and the WXtoImg enhancements)
+#
+# Passes are spread over a process pool. The checkpoint file records every
+# finished pass, so an interrupted run picks up where it stopped; it is removed
+# once a run completes without failures. Processed passes and their products are
+# added to the pass catalog; when the catalog has no geometry for a pass (passes
+# recorded before it existed), elevation and Doppler are rebuilt from the TLE of
+# the archive with the epoch nearest to the pass.
+AUDIO_RATE = 12500          # rate of the .bin audio written by the receiver
+SDR_RATE = 2.4e6
+# Headerless .bin recordings of older scripts: sample rate -> gain to audio at full scale.
+# Below the SDR rate the samples are already audio, at the SDR rate (and after GPT_NFM.py's
+# decimation by 35) they are the FM discriminator output in radians per sample at 2.4 MHz
+BIN_RATES = {
+    AUDIO_RATE: 1.0,                                        # NFM and AM receivers
+    SDR_RATE / 35: SDR_RATE / (2 * np.pi * FM_DEVIATION),   # GPT_NFM.py
+    SDR_RATE: SDR_RATE / (2 * np.pi * FM_DEVIATION),        # recieve_process_multithread.py, full rate
+}
+TYPICAL_PASS_SECONDS = 720  # length of a pass, tells the rate of a .bin from its size when there is no signal
+SNIFF_SAMPLES = 1 << 20     # samples from the middle of a .bin searched for the APT subcarrier
+BLOCK_SECONDS = 10          # seconds of IQ demodulated at a time, bounds worker memory
+CHECKPOINT_NAME = "reprocess_checkpoint.json"
+CATALOG_NAME = "passes.sqlite"
+WXTOIMG_TYPES = ['NO', 'MCIR', 'MSA', 'HVCT', 'HVCT-precip', 'sea', 'therm']
+TLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt")
+FREQUENCIES = {'NOAA 15': 137.62e6, 'NOAA 18': 137.9125e6, 'NOAA 19': 137.1e6}
+GEOMETRY_STEP = 1.0         # seconds between the positions of a rebuilt pass
+
+
+# Function to find the recordings of an archive tree, one per pass (IQ archive preferred)
+def find_passes(root):
+    passes = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.basename(dirpath) != "DATA_RAW":
+            continue
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            if ext not in (".iqz", ".bin"):
+                continue
+            key = os.path.join(dirpath, base)
+            if key not in passes or ext == ".iqz":
+                passes[key] = os.path.join(dirpath, filename)
+    return [passes[key] for key in sorted(passes)]
+
+# Function to name the outputs of every stage of a pass
+def stage_paths(input_path):
+    raw_folder = os.path.dirname(input_path)
+    folder = os.path.dirname(raw_folder)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    return {
+        "demod": os.path.join(folder, base + ".wav"),
+        "decode": os.path.join(raw_folder, base + "_lines.npy"),
+        "render": os.path.join(folder, base + "_raw.png"),
+    }
+
+# Function to tell whether an output is missing or older than its input
+def is_stale(input_path, output_path):
+    return not os.path.exists(output_path) or os.path.getmtime(output_path) < os.path.getmtime(input_path)
+
+# Pool initializer: cap the address space of the worker so one bad pass cannot take the machine down
+def limit_memory(max_bytes):
+    if not max_bytes:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows, the workers run without a cap
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+# Function to demodulate an IQ archive to int16 audio, block by block
+def demodulate_archive(input_path, wav_path):
+    with IQArchiveReader(input_path) as reader:
+        # Decimated archives hold the output of the wideband filter
+        decimated = reader.header["dtype"] != "uint8"
+        demodulator = NfmDemodulator(reader.rate * WIDEBAND_DECIMATION if decimated else reader.rate)
+        block = int(reader.rate * BLOCK_SECONDS)
+        audio = []
+        clipped = 0
+        for start in range(0, reader.samples, block):
+            samples = reader.read(start, block)
+            audio_block = demodulator.process_wideband(samples) if decimated else demodulator.process(samples)
+            data_int, clip = to_int16(audio_block)
+            clipped += clip
+            audio.append(data_int)
+    data = np.concatenate(audio) if audio else np.zeros(0, dtype=np.int16)
+    wavfile.write(wav_path, int(demodulator.audio_rate), data)
+    return {"audio_seconds": len(data) / demodulator.audio_rate, "clipped_blocks": clipped}
+
+# Function to tell the dtype (int16 or float32) and the sample rate of a headerless .bin recording
+def bin_format(input_path, bin_rate=None):
+    with open(input_path, "rb") as f:
+        head = f.read(1 << 16)
+    values = np.frombuffer(head[:len(head) // 4 * 4], dtype=np.float32)
+    values = values[values != 0]
+    # int16 pairs read as float32 give random exponents, real float32 samples stay in a sane range
+    with np.errstate(invalid="ignore", over="ignore"):
+        magnitude = np.abs(values)
+        plausible = np.isfinite(values) & (magnitude > 1e-12) & (magnitude < 1e6)
+    dtype = np.float32 if len(values) >= 100 and plausible.mean() > 0.99 else np.int16
+    if bin_rate is None:
+        samples = os.path.getsize(input_path) // np.dtype(dtype).itemsize
+        bin_rate = subcarrier_rate(input_path, dtype, samples)
+    if bin_rate is None:
+        # No signal to go by: the rate whose pass length is closest to a typical pass
+        bin_rate = min(BIN_RATES, key=lambda rate: abs(np.log(max(samples, 1) / rate / TYPICAL_PASS_SECONDS)))
+    return dtype, bin_rate
+
+# Function to tell the rate of a .bin from the strongest tone of the middle of the recording, the 2400 Hz APT
+# subcarrier when there is a signal; None if that tone matches no known rate
+def subcarrier_rate(input_path, dtype, samples):
+    count = min(samples, SNIFF_SAMPLES)
+    with open(input_path, "rb") as f:
+        f.seek((samples - count) // 2 * np.dtype(dtype).itemsize)
+        data = np.fromfile(f, dtype=dtype, count=count).astype(np.float32)
+    if len(data) < 4096:
+        return None
+    frequencies, power = welch(data, nperseg=min(len(data), 1 << 16))
+    peak = frequencies[16 + np.argmax(power[16:])]  # above DC and the frequency error of the receiver
+    rate = min(BIN_RATES, key=lambda known_rate: abs(np.log(APT_SUBCARRIER / peak / known_rate)))
+    return rate if abs(np.log(APT_SUBCARRIER / peak / rate)) < 0.05 else None
+
+# Function to read a .bin recording as audio at AUDIO_RATE, one block at a time
+def bin_audio(input_path, bin_rate=None):
+    dtype, rate = bin_format(input_path, bin_rate)
+    # Gain of the known rate within 1 % (a rate given on the command line is rounded)
+    known = min(BIN_RATES, key=lambda known_rate: abs(known_rate - rate))
+    gain = (BIN_RATES[known] if abs(known - rate) < 0.01 * rate else 1.0) / (32767 if dtype == np.int16 else 1)
+    resampler = StreamingResampler(rate, AUDIO_RATE, AUDIO_CUTOFF) if rate != AUDIO_RATE else None
+    block = int(rate * BLOCK_SECONDS)
+    with open(input_path, "rb") as f:
+        while True:
+            data = np.fromfile(f, dtype=dtype, count=block)
+            if not len(data):
+                break
+            audio = data.astype(np.float32) * np.float32(gain)
+            yield audio if resampler is None else resampler.process(audio)
+
+# Function to convert a .bin recording to WAV at AUDIO_RATE, block by block
+def convert_bin(input_path, wav_path, bin_rate=None):
+    dtype, rate = bin_format(input_path, bin_rate)
+    audio = []
+    clipped = 0
+    for block in bin_audio(input_path, rate):
+        data_int, clip = to_int16(block)
+        clipped += clip
+        audio.append(data_int)
+    data = np.concatenate(audio) if audio else np.zeros(0, dtype=np.int16)
+    wavfile.write(wav_path, AUDIO_RATE, data)
+    return {"audio_seconds": len(data) / AUDIO_RATE, "clipped_blocks": clipped, "bin_rate": rate,
+            "bin_dtype": np.dtype(dtype).name}
+
+# Function to run the stages of one pass, executed in a pool worker
+def reprocess_pass(input_path, force=False, bin_rate=None, wxtoimg=None):
+    start = time.time()
+    paths = stage_paths(input_path)
+    result = {"input": input_path, "stages": [], "stage_seconds": {}, "pid": os.getpid()}
+    clock = time.perf_counter()
+    if force or is_stale(input_path, paths["demod"]):
+        if input_path.endswith(".iqz"):
+            result.update(demodulate_archive(input_path, paths["demod"]))
+        else:
+            result.update(convert_bin(input_path, paths["demod"], bin_rate))
+        result["stages"].append("demod")
+        result["stage_seconds"]["demod"], clock = time.perf_counter() - clock, time.perf_counter()
+    if force or is_stale(paths["demod"], paths["decode"]):
+        rate, audio = wavfile.read(paths["demod"])
+        lines, sync = decode_audio(audio.astype(np.float32) / 32767, rate)
+        np.save(paths["decode"], lines)
+        result.update(lines=len(lines), synced_lines=sync.synced_lines, clock_ppm=(sync.clock_ratio - 1) * 1e6)
+        result["stages"].append("decode")
+        result["stage_seconds"]["decode"], clock = time.perf_counter() - clock, time.perf_counter()
+    if force or is_stale(paths["decode"], paths["render"]):
+        save_png(paths["render"], to_uint8(np.load(paths["decode"])))
+        if wxtoimg and "NOAA" in os.path.basename(input_path):
+            for image_type in WXTOIMG_TYPES:
+                output_path = paths["render"].replace("_raw.png", f"_{image_type}.png")
+                subprocess.run([wxtoimg, "-n", f"-e{image_type}", "-o", "-tNOAA", paths["demod"], output_path],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        result["stages"].append("render")
+        result["stage_seconds"]["render"] = time.perf_counter() - clock
+    result["seconds"] = time.time() - start
+    return result
+
+# Function to rebuild elevation and Doppler of a pass with the TLE nearest to its time
+def pass_geometry(tle_store, satellite_name, start_time, duration):
+    record = tle_store.nearest(satellite_name, start_time)
+    seconds = np.arange(0, duration, GEOMETRY_STEP)
+    azimuth, elevation, distance, range_rate = PropagationBatch([record]).look_angles(start_time.timestamp() + seconds, 0)
+    geometry = {"tle_epoch": record.epoch, "end_time": start_time + timedelta(seconds=duration),
+                "max_elevation": float(elevation.max())}
+    if satellite_name in FREQUENCIES:
+        geometry.update(doppler_summary(seconds, doppler_offsets(FREQUENCIES[satellite_name], range_rate)))
+    return geometry
+
+# Function to add a processed pass and its products to the catalog
+def catalog_pass(catalog, result, wxtoimg=None, tle_store=None):
+    parsed = parse_pass_name(result["input"])
+    if parsed is None:
+        return
+    satellite, start_time = parsed
+    fields = {key: result[key] for key in ("lines", "synced_lines", "clock_ppm") if key in result}
+    paths = stage_paths(result["input"])
+    known = catalog.find(satellite, since=start_time, until=start_time + timedelta(seconds=1))
+    if tle_store is not None and (not known or known[0]["max_elevation"] is None) and os.path.exists(paths["demod"]):
+        rate, audio = wavfile.read(paths["demod"], mmap=True)
+        try:
+            fields.update(pass_geometry(tle_store, satellite, start_time, len(audio) / rate))
+        except KeyError:
+            print(f"[Catalog] >no TLE for {satellite}, geometry of {os.path.basename(result['input'])} not rebuilt")
+    pass_id = catalog.add_pass(satellite, start_time, **fields)
+    catalog.add_file(pass_id, result["input"], "archive" if result["input"].endswith(".iqz") else "recording")
+    catalog.add_file(pass_id, paths["demod"], "wav")
+    catalog.add_file(pass_id, paths["decode"], "lines")
+    catalog.add_file(pass_id, paths["render"], "raw_image")
+    if wxtoimg:
+        for image_type in WXTOIMG_TYPES:
+            catalog.add_file(pass_id, paths["render"].replace("_raw.png", f"_{image_type}.png"), image_type)
+
+
+class Checkpoint:
+    """
+    Progress of a reprocessing run, rewritten atomically after every pass.
+
+    A pass is only skipped if it finished with the same input (path and
+    modification time), so a recording replaced since is processed again.
+    Failed passes are kept with their error and retried on the next run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.passes = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.passes = json.load(f).get("passes", {})
+
+    def is_done(self, input_path):
+        entry = self.passes.get(input_path)
+        return entry is not None and entry["status"] == "done" and entry["mtime"] == os.path.getmtime(input_path)
+
+    def mark(self, input_path, status, **info):
+        self.passes[input_path] = dict(info, status=status, mtime=os.path.getmtime(input_path))
+        write_atomic(self.path, json.dumps({"passes": self.passes}, indent=2))
+
+    @property
+    def failed(self):
+        return [path for path, entry in self.passes.items() if entry["status"] == "failed"]
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocess every recorded pass of an archive tree.")
+    parser.add_argument("root", help="archive root, containing the NOAA_xx folders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--memory-limit", type=float, default=2048, help="address space cap per worker in MB, 0 for none (ignored on Windows)")
+    parser.add_argument("--force", action="store_true", help="rerun every stage even if its output is up to date")
+    parser.add_argument("--fresh", action="store_true", help="ignore the checkpoint of an interrupted run")
+    parser.add_argument("--checkpoint", help=f"checkpoint file (default: <root>/{CHECKPOINT_NAME})")
+    parser.add_argument("--bin-rate", type=float, help="sample rate of every .bin recording (default: told per file from its size)")
+    parser.add_argument("--wxtoimg", help="path of wxtoimg, to render the enhanced images too")
+    parser.add_argument("--catalog", help=f"pass catalog to update (default: <root>/{CATALOG_NAME}, '' to disable)")
+    parser.add_argument("--tle", default=TLE_PATH, help="TLE store whose history rebuilds the geometry of old passes ('' to disable)")
+    args = parser.parse_args(argv)
+
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.root, CHECKPOINT_NAME))
+    if args.fresh:
+        checkpoint.passes = {}
+    inputs = find_passes(args.root)
+    todo = []
+    for input_path in inputs:
+        if checkpoint.is_done(input_path):
+            continue
+        paths = stage_paths(input_path)
+        if args.force or is_stale(input_path, paths["demod"]) or is_stale(paths["demod"], paths["decode"]) \
+                or is_stale(paths["decode"], paths["render"]):
+            todo.append(input_path)
+    print(f"{len(inputs)} passes found, {len(todo)} to process with {args.workers} workers")
+    if not todo:
+        checkpoint.remove()
+        return 0
+
+    catalog_path = os.path.join(args.root, CATALOG_NAME) if args.catalog is None else args.catalog
+    catalog = PassCatalog(catalog_path) if catalog_path else None
+    tle_store = TLEStore(args.tle) if catalog is not None and args.tle else None
+    start = time.time()
+    memory_limit = int(args.memory_limit * 2**20)
+    with ProcessPoolExecutor(args.workers, initializer=limit_memory, initargs=(memory_limit,)) as pool:
+        futures = {pool.submit(reprocess_pass, input_path, args.force, args.bin_rate, args.wxtoimg): input_path
+                   for input_path in todo}
+        for i, future in enumerate(as_completed(futures), 1):
+            input_path = futures[future]
+            try:
+                result = future.result()
+            except MemoryError:
+                checkpoint.mark(input_path, "failed", error=f"over the {args.memory_limit:.0f} MB memory limit")
+                print(f"[{i}/{len(todo)}] {input_path}: out of memory")
+                continue
+            except Exception as e:
+                checkpoint.mark(input_path, "failed", error=f"{type(e).__name__}: {e}")
+                print(f"[{i}/{len(todo)}] {input_path}: {type(e).__name__}: {e}")
+                continue
+            checkpoint.mark(input_path, "done", stages=result["stages"], seconds=result["seconds"])
+            if catalog is not None:
+                catalog_pass(catalog, result, args.wxtoimg, tle_store)
+            print(f"[{i}/{len(todo)}] {input_path}: {', '.join(result['stages']) or 'up to date'} in {result['seconds']:.1f} s")
+
+    if catalog is not None:
+        catalog.close()
+    failed = checkpoint.failed
+    print(f"done in {time.time() - start:.0f} s, {len(todo) - len(failed)} passes processed, {len(failed)} failed")
+    if failed:
+        print(f"failed passes are retried on the next run, see {checkpoint.path}")
+        return 1
+    checkpoint.remove()
+    return 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
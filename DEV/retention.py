@@ -0,0 +1,336 @@
+import os
+import sys
+import time
+import zlib
+import shutil
+import struct
+import argparse
+import functools
+from datetime import datetime, timezone
+import numpy as np
+from scipy.io import wavfile
+from nfm_dsp import NfmDemodulator, WIDEBAND_DECIMATION
+from apt_decoder import decode_audio, to_uint8, save_png
+from iq_archive import IQArchiveReader, IQArchiveWriter, zstandard
+from pass_catalog import PassCatalog, parse_pass_name
+from reprocess import demodulate_archive, convert_bin, bin_audio, bin_format, stage_paths, AUDIO_RATE, CATALOG_NAME
+
+# Retention tiers of a pass, from the most to the least reprocessable:
+#
+#     raw        2.4 MHz uint8 IQ archive (.iqz)
+#     decimated  150 kHz int16 IQ archive (.iqz), the input of the channel filter,
+#                or a .bin of an older script above the audio rate (discriminator output)
+#     audio      12.5 kHz WAV (and .bin), enough to decode the image again
+#     images     PNG products only
+#
+# A pass moves down one tier when it gets older than the tier allows. When free
+# space falls under the low watermark the oldest passes are also moved down early,
+# until free space is back over the high watermark, but never below the audio
+# tier: disk pressure alone never throws away data an image can be decoded from.
+# Passes still being recorded (a file modified in the last minutes, or an archive
+# without its footer) are left alone.
+TIERS = ("raw", "decimated", "audio", "images")
+PRESSURE_FLOOR = "audio"
+BLOCK_SECONDS = 10  # seconds of IQ re-encoded at a time
+# Errors of a damaged pass (truncated or corrupt archive, unreadable file): the pass is left alone, the others go on
+PASS_ERRORS = (OSError, ValueError, LookupError, RuntimeError, struct.error, zlib.error) + \
+              ((zstandard.ZstdError,) if zstandard is not None else ())
+RECORDING_GRACE = 300       # seconds since the last write before a pass is considered finished
+MAX_RECORDING = 1800        # seconds after which an archive without footer is an interrupted recording
+
+
+class RetentionPolicy:
+    """
+    Age limits of every tier and free-space watermarks.
+
+    Parameters:
+    raw_days (float): days a pass keeps its full-rate IQ.
+    decimated_days (float): days a pass keeps its decimated IQ.
+    audio_days (float): days a pass keeps its audio, None to keep it forever.
+    low_watermark (float): free space fraction under which passes are moved down early.
+    high_watermark (float): free space fraction at which early moves stop.
+    """
+
+    def __init__(self, raw_days=2, decimated_days=14, audio_days=90, low_watermark=0.10, high_watermark=0.20):
+        if high_watermark < low_watermark:
+            raise ValueError("the high watermark must not be lower than the low watermark")
+        self.max_age = {"raw": raw_days, "decimated": decimated_days, "audio": audio_days, "images": None}
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+
+
+# Function to lower the priority of this process so retention never competes with a capture
+def lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(19)
+    elif sys.platform == "win32":
+        import ctypes
+        IDLE_PRIORITY_CLASS = 0x40
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), IDLE_PRIORITY_CLASS)
+
+# Function to get the fraction of free space of the disk holding path
+def free_fraction(path):
+    usage = shutil.disk_usage(path)
+    return usage.free / usage.total
+
+# Function to list the passes of an archive tree with their files and current tier, the passes that
+# cannot be read are added to failed
+def scan_passes(root, failed=None):
+    passes = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.basename(dirpath) != "DATA_RAW":
+            continue
+        for filename in filenames:
+            base, ext = os.path.splitext(filename)
+            if ext not in (".iqz", ".bin"):
+                continue
+            passes.setdefault(os.path.join(dirpath, base), None)
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Passes whose recordings are gone but whose audio is still there
+        if os.path.basename(dirpath) == "DATA_RAW" or not os.path.isdir(os.path.join(dirpath, "DATA_RAW")):
+            continue
+        for filename in filenames:
+            base, ext = os.path.splitext(filename)
+            if ext == ".wav":
+                passes.setdefault(os.path.join(dirpath, "DATA_RAW", base), None)
+    result = []
+    for key in sorted(passes):
+        try:
+            recorded_pass = RecordedPass(key)
+            if recorded_pass.recording_in_progress():
+                print(f"[Retention] >{recorded_pass.base}: still being recorded, left alone")
+                continue
+            if recorded_pass.tier != "images":
+                result.append(recorded_pass)
+        except PASS_ERRORS as e:
+            print(f"[Retention] >{os.path.basename(key)}: {e}, left alone")
+            if failed is not None:
+                failed.add(os.path.basename(key))
+    return sorted(result, key=lambda recorded_pass: recorded_pass.start_time)
+
+
+class RecordedPass:
+    """
+    Files of one pass, named after <raw folder>/<base> as written by the receiver.
+    """
+
+    def __init__(self, key):
+        self.raw_folder, self.base = os.path.split(key)
+        self.archive = key + ".iqz"
+        self.recording = key + ".bin"
+        self.paths = stage_paths(self.archive)
+        parsed = parse_pass_name(self.base)
+        if parsed is not None:
+            self.satellite, self.start_time = parsed
+        else:
+            self.satellite = None
+            existing = [path for path in (self.archive, self.recording, self.paths["demod"]) if os.path.exists(path)]
+            self.start_time = datetime.fromtimestamp(min(os.path.getmtime(path) for path in existing), timezone.utc)
+
+    # Cached: reading the archive header or sniffing the .bin rate is too slow for every look,
+    # forget_tier() after the files changed
+    @functools.cached_property
+    def tier(self):
+        if os.path.exists(self.archive):
+            with IQArchiveReader(self.archive) as reader:
+                return "raw" if reader.header["dtype"] == "uint8" else "decimated"
+        if os.path.exists(self.recording) and bin_format(self.recording)[1] > AUDIO_RATE:
+            return "decimated"  # full-rate .bin, demodulated to audio like an archive
+        if os.path.exists(self.paths["demod"]) or os.path.exists(self.recording):
+            return "audio"
+        return "images"
+
+    def forget_tier(self):
+        self.__dict__.pop("tier", None)
+
+    def recording_in_progress(self, now=None):
+        now = now or time.time()
+        paths = [path for path in (self.archive, self.recording) if os.path.exists(path)]
+        last_write = max((os.path.getmtime(path) for path in paths), default=0)
+        if now - last_write < RECORDING_GRACE:
+            return True
+        if os.path.exists(self.archive) and now - last_write < MAX_RECORDING:
+            with IQArchiveReader(self.archive) as reader:
+                return not reader.finalized
+        return False
+
+    def age_days(self, now):
+        return (now - self.start_time).total_seconds() / 86400
+
+    def size(self):
+        paths = (self.archive, self.recording, self.paths["demod"], self.paths["decode"])
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+class RetentionManager:
+    """
+    Moves recorded passes down the retention tiers.
+
+    Every step writes and checks the smaller product before the larger one
+    is deleted, so an interrupted run leaves the pass in one tier or the
+    other, never in between. The catalog, if given, follows every file that
+    is added or removed.
+
+    Parameters:
+    root (str): archive root, containing the NOAA_xx folders.
+    policy (RetentionPolicy): tier ages and watermarks.
+    catalog (PassCatalog): optional, kept in sync with the files.
+    dry_run (bool): only print what would be done.
+    """
+
+    def __init__(self, root, policy=None, catalog=None, dry_run=False):
+        self.root = root
+        self.policy = policy or RetentionPolicy()
+        self.catalog = catalog
+        self.dry_run = dry_run
+        self.failed = set()  # passes left alone after an error, until the next run
+
+    def run_once(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        freed = 0
+        self.failed.clear()
+        passes = scan_passes(self.root, self.failed)
+        # Age policy
+        for recorded_pass in passes:
+            while recorded_pass.base not in self.failed:
+                tier = recorded_pass.tier
+                max_age = self.policy.max_age[tier]
+                if max_age is None or recorded_pass.age_days(now) <= max_age:
+                    break
+                freed += self.demote(recorded_pass, f"older than {max_age} days")
+                if self.dry_run:
+                    break
+        # Disk pressure, oldest passes first
+        if free_fraction(self.root) < self.policy.low_watermark:
+            for recorded_pass in passes:
+                while recorded_pass.base not in self.failed and free_fraction(self.root) < self.policy.high_watermark \
+                        and TIERS.index(recorded_pass.tier) < TIERS.index(PRESSURE_FLOOR):
+                    freed += self.demote(recorded_pass, f"free space under {self.policy.high_watermark:.0%}")
+                    if self.dry_run:
+                        break
+                if free_fraction(self.root) >= self.policy.high_watermark:
+                    break
+            if free_fraction(self.root) < self.policy.low_watermark:
+                print(f"[Retention] >free space still under {self.policy.low_watermark:.0%}, every pass is down to the {PRESSURE_FLOOR} tier")
+        return freed
+
+    def run(self, interval=600):
+        while True:
+            freed = self.run_once()
+            if freed:
+                print(f"[Retention] >{freed / 1e9:.2f} GB freed, {free_fraction(self.root):.0%} free")
+            time.sleep(interval)
+
+    def demote(self, recorded_pass, reason):
+        tier = recorded_pass.tier
+        target = TIERS[TIERS.index(tier) + 1]
+        print(f"[Retention] >{recorded_pass.base}: {tier} -> {target} ({reason})")
+        if self.dry_run:
+            return 0
+        before = recorded_pass.size()
+        try:
+            if tier == "raw":
+                self._decimate(recorded_pass)
+            elif tier == "decimated":
+                self._to_audio(recorded_pass)
+            else:
+                self._to_images(recorded_pass)
+        except PASS_ERRORS as e:
+            print(f"[Retention] >{recorded_pass.base}: {e}")
+            self.failed.add(recorded_pass.base)
+        finally:
+            recorded_pass.forget_tier()
+        return before - recorded_pass.size()
+
+    def _decimate(self, recorded_pass):
+        tmp_path = recorded_pass.archive + ".tmp"
+        with IQArchiveReader(recorded_pass.archive) as reader:
+            demodulator = NfmDemodulator(reader.rate)
+            metadata = {key: value for key, value in reader.header.items()
+                        if key not in ("rate", "dtype", "scale", "codec", "block_samples")}
+            samples = reader.samples
+            block = int(reader.rate * BLOCK_SECONDS)
+            with IQArchiveWriter(tmp_path, reader.rate / WIDEBAND_DECIMATION, "int16", decimated_from=reader.rate, **metadata) as writer:
+                for start in range(0, reader.samples, block):
+                    writer.write(demodulator.wideband(reader.read(start, block)))
+                writer.gaps = [(first // WIDEBAND_DECIMATION, -(-count // WIDEBAND_DECIMATION)) for first, count in reader.gaps]
+        with IQArchiveReader(tmp_path) as check:
+            complete = check.samples == -(-samples // WIDEBAND_DECIMATION)  # the last partial block keeps a sample
+        if not complete:
+            os.remove(tmp_path)
+            raise RuntimeError(f"re-encoding of {recorded_pass.archive} is incomplete, the raw archive is kept")
+        os.replace(tmp_path, recorded_pass.archive)
+        self._catalog(recorded_pass, added={recorded_pass.archive: "archive"})
+
+    def _to_audio(self, recorded_pass):
+        wav_path = recorded_pass.paths["demod"]
+        # An IQ archive, or else a full-rate .bin
+        source = recorded_pass.archive if os.path.exists(recorded_pass.archive) else recorded_pass.recording
+        if not os.path.exists(wav_path):
+            if source == recorded_pass.archive:
+                demodulate_archive(source, wav_path + ".tmp")
+            else:
+                convert_bin(source, wav_path + ".tmp")
+            os.replace(wav_path + ".tmp", wav_path)
+        os.remove(source)
+        self._catalog(recorded_pass, added={wav_path: "wav"}, removed=[source])
+
+    def _to_images(self, recorded_pass):
+        wav_path = recorded_pass.paths["demod"]
+        image_path = recorded_pass.paths["render"]
+        if not os.path.exists(image_path):
+            if os.path.exists(wav_path):
+                rate, audio = wavfile.read(wav_path)
+                audio = audio.astype(np.float32) / 32767
+            else:
+                rate, audio = AUDIO_RATE, np.concatenate([np.zeros(0, dtype=np.float32)] + list(bin_audio(recorded_pass.recording)))
+            lines, sync = decode_audio(audio, rate)
+            if not sync.synced_lines:
+                # Wrong sample rate or no signal: keep the audio rather than an empty image
+                raise RuntimeError(f"no APT line decoded from the audio of {recorded_pass.base}, the audio is kept")
+            save_png(image_path + ".tmp", to_uint8(lines))
+            os.replace(image_path + ".tmp", image_path)
+        removed = [path for path in (wav_path, recorded_pass.recording, recorded_pass.paths["decode"]) if os.path.exists(path)]
+        for path in removed:
+            os.remove(path)
+        self._catalog(recorded_pass, added={image_path: "raw_image"}, removed=removed)
+
+    def _catalog(self, recorded_pass, added=(), removed=()):
+        if self.catalog is None or recorded_pass.satellite is None:
+            return
+        pass_id = self.catalog.add_pass(recorded_pass.satellite, recorded_pass.start_time)
+        for path in removed:
+            self.catalog.remove_file(path)
+        for path, kind in dict(added).items():
+            self.catalog.add_file(pass_id, path, kind)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move recorded passes down the retention tiers (raw IQ, decimated IQ, audio, images).")
+    parser.add_argument("root", help="archive root, containing the NOAA_xx folders")
+    parser.add_argument("--raw-days", type=float, default=2)
+    parser.add_argument("--decimated-days", type=float, default=14)
+    parser.add_argument("--audio-days", type=float, default=90, help="negative to keep audio forever")
+    parser.add_argument("--low-watermark", type=float, default=0.10, help="free space fraction that starts early moves")
+    parser.add_argument("--high-watermark", type=float, default=0.20, help="free space fraction that stops them")
+    parser.add_argument("--interval", type=float, default=0, help="seconds between two runs, 0 to run once")
+    parser.add_argument("--catalog", help=f"pass catalog to update (default: <root>/{CATALOG_NAME}, '' to disable)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    lower_priority()
+    policy = RetentionPolicy(args.raw_days, args.decimated_days, args.audio_days if args.audio_days >= 0 else None,
+                             args.low_watermark, args.high_watermark)
+    catalog_path = os.path.join(args.root, CATALOG_NAME) if args.catalog is None else args.catalog
+    catalog = PassCatalog(catalog_path) if catalog_path else None
+    manager = RetentionManager(args.root, policy, catalog, args.dry_run)
+    if args.interval:
+        manager.run(args.interval)
+    freed = manager.run_once()
+    print(f"[Retention] >{freed / 1e9:.2f} GB freed, {free_fraction(args.root):.0%} free")
+    return 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+# Function to describe a frame as file:function:line
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread.
+
+    A daemon thread wakes up every `interval` seconds, takes the current stack
+    of the target thread from sys._current_frames() and counts it. Nothing is
+    hooked into the profiled thread, so its overhead does not depend on how
+    much Python code it runs. Time spent inside NumPy/SciPy is charged to the
+    Python line that called it. The result is written in collapsed-stack
+    format ("outer;inner;leaf count" per line), readable by flamegraph.pl and
+    speedscope.
+
+    Parameters:
+    thread (threading.Thread): thread to sample, must already be started.
+    interval (float): seconds between two samples.
+    """
+
+    def __init__(self, thread, interval=0.01):
+        self.thread = thread
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.sampler = None
+
+    def start(self):
+        self.running = True
+        self.sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.running = False
+        if self.sampler is not None:
+            self.sampler.join()
+
+    def _run(self):
+        target = self.thread.ident
+        while self.running and self.thread.is_alive():
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+
+# Dongles of this station: {"devices": [{"serial": "00000001", "ppm": 60, "gain": "auto", "bias_tee": false,
+#                                        "antenna": "QFH", "location": [44.384477, 7.542671, 500]}, ...]}
+DEVICES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sdr_devices.json")
+# 'rtlsdr' for the hardware, 'fake' to run everything without a dongle
+BACKEND = os.environ.get("SDR_BACKEND", "rtlsdr")
+# Options of the simulated dongles (fake_sdr.FakeRtlSdr), e.g. '{"drop_rate": 0.01, "retune_latency": 0.05}'
+FAKE_OPTIONS = json.loads(os.environ.get("SDR_FAKE", "{}"))
+TLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TLE.txt")
+
+
+class DeviceConfig:
+    """
+    Settings of one RTL-SDR dongle, identified by the serial number in its EEPROM.
+
+    Dongles leave the factory with the same serial, give each one its own
+    with `rtl_eeprom -s <serial>` so they can be told apart.
+
+    Parameters:
+    serial (str): serial number, None for the first dongle found.
+    ppm (int): frequency correction of the oscillator.
+    gain (float or str): tuner gain in dB, or 'auto'.
+    bias_tee (bool): power an LNA through the antenna input.
+    antenna (str): free description of the antenna.
+    location (tuple): latitude, longitude (degrees) and elevation (m) of the antenna, None for propagation.STATION.
+    """
+
+    def __init__(self, serial=None, ppm=60, gain='auto', bias_tee=False, antenna=None, location=None):
+        self.serial = serial
+        self.ppm = ppm
+        self.gain = gain
+        self.bias_tee = bias_tee
+        self.antenna = antenna
+        self.location = tuple(location) if location else None
+
+    def __repr__(self):
+        return f"DeviceConfig(serial={self.serial!r}, ppm={self.ppm}, gain={self.gain!r}, bias_tee={self.bias_tee})"
+
+
+# Function to read the configured dongles, a single default dongle if there is no configuration
+def load_devices(path=DEVICES_PATH):
+    if not os.path.exists(path):
+        return [DeviceConfig()]
+    with open(path) as f:
+        devices = [DeviceConfig(**entry) for entry in json.load(f)["devices"]]
+    serials = [device.serial for device in devices]
+    if len(set(serials)) != len(serials):
+        raise ValueError(f"{path}: every dongle needs its own serial number")
+    return devices
+
+# Function to find the configuration of a dongle, the first one if serial is None
+def find_device(serial=None, path=DEVICES_PATH):
+    devices = load_devices(path)
+    if serial is None:
+        return devices[0]
+    for device in devices:
+        if device.serial == serial:
+            return device
+    # Not configured: default settings
+    return DeviceConfig(serial)
+
+# Function to open and set up a dongle
+def open_device(device, backend=BACKEND):
+    if backend == "fake":
+        # NOAA 15, 18 and 19 transmit over the antenna of the dongle, with the TLEs of the station
+        from fake_sdr import FakeRtlSdr, default_transmitters
+        from propagation import STATION
+        from tle_store import TLEStore
+        transmitters = default_transmitters(TLEStore(TLE_PATH), device.location or STATION)
+        sdr = FakeRtlSdr(serial_number=device.serial, transmitters=transmitters, **FAKE_OPTIONS)
+    else:
+        from rtlsdr import RtlSdr
+        sdr = RtlSdr(serial_number=device.serial) if device.serial else RtlSdr()
+    sdr.freq_correction = device.ppm
+    sdr.gain = device.gain
+    if device.bias_tee:
+        sdr.set_bias_tee(True)
+    return sdr
+
+# Function to list the serial numbers of the attached dongles
+def attached_serials(backend=BACKEND):
+    if backend == "fake":
+        from fake_sdr import FakeRtlSdr
+        return FakeRtlSdr.get_device_serial_addresses()
+    from rtlsdr import RtlSdr
+    return RtlSdr.get_device_serial_addresses()
+
+
+class DevicePool:
+    """
+    Dongles of a station shared by concurrent captures.
+
+    A capture claims a free dongle for its whole duration and gives it back
+    when it ends, so passes that overlap go to different dongles and a pass
+    only waits when every dongle is busy, or when the dongle it asks for by
+    serial number is. Every capture runs its receiver in a process of its
+    own, bound to the claimed dongle by serial number.
+
+    Parameters:
+    devices (list): DeviceConfig of every dongle, load_devices() if None.
+    """
+
+    def __init__(self, devices=None):
+        self.devices = devices if devices is not None else load_devices()
+        self.free = list(self.devices)
+        self.released = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.devices)
+
+    @property
+    def available(self):
+        return len(self.free)
+
+    def _free_device(self, serial):
+        return next((device for device in self.free if serial is None or device.serial == serial), None)
+
+    @contextlib.asynccontextmanager
+    async def claim(self, serial=None):
+        # Any free dongle, or the one with that serial number
+        if serial is not None and serial not in {device.serial for device in self.devices}:
+            raise KeyError(f"no dongle {serial} in the pool")
+        async with self.released:
+            await self.released.wait_for(lambda: self._free_device(serial) is not None)
+            device = self._free_device(serial)
+            self.free.remove(device)
+        try:
+            yield device
+        finally:
+            async with self.released:
+                self.free.append(device)
+                self.released.notify_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the configured and the attached RTL-SDR dongles.")
+    parser.add_argument("--config", default=DEVICES_PATH, help="device configuration (JSON)")
+    parser.add_argument("--backend", default=BACKEND, choices=("rtlsdr", "fake"))
+    args = parser.parse_args(argv)
+
+    attached = attached_serials(args.backend)
+    for device in load_devices(args.config):
+        state = "attached" if device.serial is None or device.serial in attached else "NOT FOUND"
+        print(f"{device.serial or '(first)':<12} ppm {device.ppm:>4}  gain {device.gain!s:>5}  "
+              f"bias-tee {'on' if device.bias_tee else 'off':<3}  {device.antenna or '-':<16} {state}")
+    configured = {device.serial for device in load_devices(args.config)}
+    for serial in attached:
+        if serial not in configured:
+            print(f"{serial:<12} attached, not configured")
+    return 0
+
+# Main function
+if __name__ == "__main__":
+    sys.exit(main())
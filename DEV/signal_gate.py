@@ -0,0 +1,98 @@
+from collections import deque
+
+
+# Function to format pass seconds as m:ss
+def format_seconds(seconds):
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+
+class SignalGate:
+    """
+    AOS/LOS gate driven by the running carrier SNR.
+
+    The gate opens (acquisition of signal) once the SNR stays above
+    `open_snr` for `open_after` seconds and closes (loss of signal) once it
+    stays below `close_snr` for `close_after` seconds. While it is shut the
+    last `pre_roll` seconds of chunks are held back and handed over when it
+    opens, so the seconds of locked carrier it took to decide are kept.
+    A closed gate opens again the same way as long as the predicted pass is
+    in progress, the LOS is final at `pass_end` only. Everything outside the
+    open intervals is trimmed: not demodulated and not written.
+
+    Parameters:
+    open_snr (float): SNR in dB needed to open the gate.
+    close_snr (float): SNR in dB under which the signal counts as lost.
+    open_after (float): seconds above open_snr before opening.
+    close_after (float): seconds below close_snr before closing.
+    pre_roll (float): seconds of chunks held back while the gate is shut.
+    pass_end (float): predicted LOS in seconds from the start of the recording, None for a final first LOS.
+    """
+
+    WAITING, OPEN, CLOSED = 'waiting', 'open', 'closed'
+
+    def __init__(self, open_snr=6.0, close_snr=3.0, open_after=2.0, close_after=20.0, pre_roll=3.0, pass_end=None):
+        self.open_snr = open_snr
+        self.close_snr = close_snr
+        self.open_after = open_after
+        self.close_after = close_after
+        self.pre_roll = pre_roll
+        self.pass_end = pass_end
+        self.state = self.WAITING
+        self.timer = 0.0
+        self.held = deque()  # (position, duration, chunk) of the pre-roll
+        self.held_duration = 0.0
+        self.end = 0.0  # end of the last chunk seen
+        self.aos = None
+        self.los = None
+        self.trimmed = []  # (start, end, reason) in seconds from the start of the recording
+
+    @property
+    def finished(self):
+        return self.state == self.CLOSED and (self.pass_end is None or self.end >= self.pass_end)
+
+    def update(self, snr_db, position, duration, chunk=None):
+        # Returns the (position, chunk) pairs to keep for the chunk starting at `position` and lasting
+        # `duration` seconds: none while the gate is shut, the pre-roll and this chunk when it opens
+        self.end = position + duration
+        if self.state == self.OPEN:
+            self.timer = self.timer + duration if snr_db < self.close_snr else 0.0
+            if self.timer >= self.close_after:
+                self.state = self.CLOSED
+                self.timer = 0.0
+                self.los = position + duration
+            return [(position, chunk)]
+        if self.finished:
+            return []
+        # Waiting for the AOS, or for the signal to come back before the predicted LOS
+        self.timer = self.timer + duration if snr_db >= self.open_snr else 0.0
+        self.held.append((position, duration, chunk))
+        self.held_duration += duration
+        while len(self.held) > 1 and self.held_duration - self.held[0][1] >= self.pre_roll:
+            self.held_duration -= self.held.popleft()[1]
+        if self.timer < self.open_after:
+            return []
+        start = self.held[0][0]
+        if self.state == self.WAITING:
+            self.aos = start
+            self.log(0.0, start, "before AOS")
+        else:
+            self.log(self.los, start, "signal lost")
+            self.los = None
+        self.state = self.OPEN
+        self.timer = 0.0
+        kept = [(held_position, held_chunk) for held_position, _, held_chunk in self.held]
+        self.held.clear()
+        self.held_duration = 0.0
+        return kept
+
+    def finish(self, end):
+        # Log what was trimmed at the end of the recording
+        if self.state == self.WAITING:
+            self.log(0.0, end, "no signal")
+        elif self.state == self.CLOSED and end > self.los:
+            self.log(self.los, end, "after LOS")
+
+    def log(self, start, end, reason):
+        if end > start:
+            self.trimmed.append((start, end, reason))
+            print(f"\n[Gate] >trimmed {format_seconds(start)}-{format_seconds(end)} ({reason})")
@@ -0,0 +1,94 @@
+import numpy as np
+from scipy import fft
+from scipy.signal import get_window
+from apt_decoder import save_png
+
+
+class SpectrumMonitor:
+    """
+    Averaged spectrum, carrier SNR and waterfall of the decimated IQ stream.
+
+    Once every `interval` seconds of samples, the latest samples are cut in
+    segments of `nfft`, windowed and transformed in one batched FFT and the
+    periodograms are averaged (Welch). From the averaged spectrum the monitor
+    estimates the noise floor (median bin), the carrier offset (power centroid
+    around the strongest bin within `search_bandwidth`) and the SNR of the
+    signal band around it, and appends one uint8 row to the waterfall of the
+    pass.
+
+    Parameters:
+    rate (float): sample rate of the IQ fed to feed().
+    nfft (int): FFT size of every Welch segment.
+    interval (float): seconds of samples between two spectrum updates.
+    max_segments (int): maximum number of segments averaged per update.
+    signal_bandwidth (float): bandwidth of the APT signal used for the SNR.
+    search_bandwidth (float): the carrier is searched within +- half of this.
+    waterfall_width (int): bins per waterfall row.
+    waterfall_range (float): dB above the noise floor mapped to white.
+    """
+
+    def __init__(self, rate, nfft=1024, interval=1.0, max_segments=64, signal_bandwidth=34e3,
+                 search_bandwidth=60e3, waterfall_width=512, waterfall_range=40.0):
+        self.rate = rate
+        self.nfft = nfft
+        self.interval_samples = int(interval * rate)
+        self.max_segments = max_segments
+        self.window = get_window('hann', nfft).astype(np.float32)
+        self.freqs = fft.fftshift(fft.fftfreq(nfft, 1 / rate))
+        self.signal_half_bins = max(1, int(signal_bandwidth / 2 / (rate / nfft)))
+        self.search = np.abs(self.freqs) <= search_bandwidth / 2
+        self.waterfall_width = min(waterfall_width, nfft)
+        self.waterfall_range = waterfall_range
+        self.waterfall = []
+        self.pending = 0  # samples received since the last update
+
+        self.psd_db = None
+        self.noise_db = None
+        self.snr_db = 0.0
+        self.peak_offset = 0.0
+        self.updates = 0
+        self.snr_history = []  # snr_db of every update, for the statistics of the pass
+
+    def feed(self, samples):
+        self.pending += len(samples)
+        if self.pending < self.interval_samples:
+            return False
+        self.pending = 0
+        nseg = min(len(samples) // self.nfft, self.max_segments)
+        if nseg == 0:
+            return False
+        # Latest nseg segments as a 2D view, windowed and transformed in one call
+        segments = samples[len(samples) - nseg * self.nfft:].reshape(nseg, self.nfft) * self.window
+        spectrum = fft.fft(segments, axis=1, workers=-1)
+        psd = fft.fftshift(np.mean(np.abs(spectrum) ** 2, axis=0))
+        self._update(10 * np.log10(psd + 1e-20))
+        return True
+
+    def _update(self, psd_db):
+        self.psd_db = psd_db
+        self.noise_db = float(np.median(psd_db))
+        # Strongest bin of the lightly smoothed spectrum, within the search band
+        smooth = np.convolve(psd_db, np.ones(5) / 5, mode='same')
+        candidates = np.flatnonzero(self.search)
+        peak = int(candidates[np.argmax(smooth[candidates])])
+        lo = max(0, peak - self.signal_half_bins)
+        band = 10 ** (psd_db[lo:peak + self.signal_half_bins + 1] / 10)
+        self.snr_db = float(10 * np.log10(np.mean(band)) - self.noise_db)
+        # FM spreads the carrier power, the offset is the centroid of the power above the noise floor
+        excess = np.maximum(band - 10 ** (self.noise_db / 10), 0)
+        if excess.sum() > 0:
+            self.peak_offset = float(np.sum(excess * self.freqs[lo:lo + len(band)]) / excess.sum())
+        else:
+            self.peak_offset = float(self.freqs[peak])
+        self.updates += 1
+        self.snr_history.append(self.snr_db)
+
+        # Waterfall row: average neighbouring bins down to the row width, noise floor is black
+        row = psd_db[:len(psd_db) // self.waterfall_width * self.waterfall_width]
+        row = row.reshape(self.waterfall_width, -1).mean(axis=1)
+        scaled = (row - self.noise_db) * (255 / self.waterfall_range)
+        self.waterfall.append(np.clip(scaled, 0, 255).astype(np.uint8))
+
+    def save_waterfall(self, path):
+        if self.waterfall:
+            save_png(path, np.vstack(self.waterfall))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of DEV are scripts run from their folder, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,144 @@
+import os
+import socket
+import asyncio
+import importlib
+from datetime import datetime, timedelta, timezone
+from fleet import Station, assign, coordinate, send, serve_plans
+from propagation import Pass
+from tle_store import TLEStore
+from sdr_pool import DevicePool, DeviceConfig
+from event_scheduler import EventScheduler
+
+TLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "TLE.txt")
+START = datetime(2024, 5, 29, 12, 0, tzinfo=timezone.utc)
+
+
+# Function to make a pass of `minutes` from `offset` minutes after START
+def make_pass(norad, offset, minutes, max_elevation, name="NOAA 19"):
+    rise = START + timedelta(minutes=offset)
+    return Pass(norad, name, rise, rise + timedelta(minutes=minutes / 2), rise + timedelta(minutes=minutes), max_elevation)
+
+# Function to find a local port nobody listens on
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_assign_gives_each_pass_to_the_best_station():
+    home, hill = Station("home", (44.0, 7.5, 500)), Station("hill", (44.5, 7.0, 1200))
+    groups = [[(make_pass(33591, 0, 12, 40), home), (make_pass(33591, 0, 12, 70), hill)],
+              [(make_pass(28654, 60, 12, 80), home), (make_pass(28654, 60, 12, 50), hill)]]
+    plans, missed = assign(groups, [home, hill])
+    assert [p.max_elevation for p in plans["hill"]] == [70]
+    assert [p.max_elevation for p in plans["home"]] == [80]
+    assert missed == []
+
+
+def test_assign_falls_back_when_the_dongles_are_busy():
+    home, hill = Station("home", (44.0, 7.5, 500)), Station("hill", (44.5, 7.0, 1200))
+    # Two overlapping passes, both best from the hill which has a single dongle
+    groups = [[(make_pass(33591, 0, 12, 80), hill), (make_pass(33591, 0, 12, 40), home)],
+              [(make_pass(28654, 5, 12, 70), hill), (make_pass(28654, 5, 12, 35), home)],
+              [(make_pass(25338, 8, 12, 60), hill)]]
+    plans, missed = assign(groups, [home, hill])
+    assert [p.norad for p in plans["hill"]] == [33591]
+    assert [p.norad for p in plans["home"]] == [28654]
+    assert [p.norad for p in missed] == [25338]
+
+
+def test_assign_skips_stations_left_out():
+    home, hill = Station("home", (44.0, 7.5, 500)), Station("hill", (44.5, 7.0, 1200))
+    groups = [[(make_pass(33591, 0, 12, 80), hill), (make_pass(33591, 0, 12, 40), home)]]
+    plans, missed = assign(groups, [home])
+    assert list(plans) == ["home"]
+    assert [p.max_elevation for p in plans["home"]] == [40]
+
+
+def test_coordinate_reassigns_the_passes_of_a_failed_station():
+    store = TLEStore(TLE_PATH)
+    satellites = {"NOAA 15": "137.6200", "NOAA 18": "137.9125", "NOAA 19": "137.1000"}
+    # Same antenna site, the first station never answers and gets the passes first
+    down = Station("down", (44.384477, 7.542671, 500), f"127.0.0.1:{free_port()}", devices=1, min_elevation=0)
+    up = Station("up", (44.384477, 7.542671, 500), None, devices=3, min_elevation=0)
+    received = []
+
+    async def handler(message):
+        received.append(message)
+        return {"ok": True, "accepted": len(message["passes"])}
+
+    async def run():
+        port = free_port()
+        up.address = f"127.0.0.1:{port}"
+        agent = asyncio.create_task(serve_plans("127.0.0.1", port, handler, "secret"))
+        await asyncio.sleep(0.1)
+        try:
+            return await coordinate([down, up], satellites, store, hours=12, token="secret")
+        finally:
+            agent.cancel()
+
+    plans, missed = asyncio.run(run())
+    assert list(plans) == ["up"]
+    assert plans["up"] and missed == []
+    # The agent got the whole plan, without the token
+    assert len(received[-1]["passes"]) == len(plans["up"])
+    assert "token" not in received[-1]
+
+
+def test_serve_plans_refuses_a_wrong_token_and_other_hosts():
+    handled = []
+
+    async def handler(message):
+        handled.append(message)
+        return {"ok": True}
+
+    async def run():
+        port = free_port()
+        agent = asyncio.create_task(serve_plans("127.0.0.1", port, handler, "secret"))
+        other = asyncio.create_task(serve_plans("127.0.0.1", port + 1, handler, None, ("192.0.2.1",)))
+        await asyncio.sleep(0.1)
+        try:
+            return [await send(f"127.0.0.1:{port}", {"type": "plan"}),
+                    await send(f"127.0.0.1:{port}", {"type": "plan", "token": "guess"}),
+                    await send(f"127.0.0.1:{port + 1}", {"type": "plan"}),
+                    await send(f"127.0.0.1:{port}", {"type": "ping", "token": "secret"})]
+        finally:
+            agent.cancel()
+            other.cancel()
+
+    answers = asyncio.run(run())
+    assert [answer["ok"] for answer in answers] == [False, False, False, True]
+    assert answers[0]["error"] == "unauthorized"
+    assert handled == [{"type": "ping"}]
+
+
+def test_apply_plan_replaces_the_planned_captures():
+    agent = importlib.import_module("pass")
+    now = datetime.now(timezone.utc)
+    record = TLEStore(TLE_PATH).get("NOAA 19")
+
+    def entry(minutes):
+        rise = now + timedelta(minutes=minutes)
+        return {"satellite": "NOAA 19", "norad": record.norad, "frequency": "137.1000",
+                "rise": rise.isoformat(), "culmination": (rise + timedelta(minutes=6)).isoformat(),
+                "set": (rise + timedelta(minutes=12)).isoformat(), "max_elevation": 45.0,
+                "line1": record.line1, "line2": record.line2}
+
+    async def run():
+        scheduler = EventScheduler()
+        devices = DevicePool([DeviceConfig("00000001")])
+        scheduler.after(3600, agent.post_process, "stale", tag="capture")
+        scheduler.after(3600, agent.post_process, "refresh", tag="tle")
+        message = {"type": "plan", "station": "home", "location": [44.0, 7.5, 500],
+                   "passes": [entry(-5), entry(30), entry(130)]}
+        answer = await agent.apply_plan(scheduler, devices, message)
+        refused = await agent.apply_plan(scheduler, devices, {"type": "ping"})
+        return answer, refused, scheduler.planned("capture"), scheduler.planned("tle")
+
+    answer, refused, captures, others = asyncio.run(run())
+    assert answer == {"ok": True, "accepted": 2}
+    assert refused["ok"] is False
+    # The pass already under way is left out, the stale capture is gone, other jobs stay
+    assert [round(event.when - now.timestamp()) for event in captures] == [30 * 60, 130 * 60]
+    assert all(event.action.args[-2:] == ([44.0, 7.5, 500], event.time + timedelta(minutes=12)) for event in captures)
+    assert [event.name for event in others] == ["refresh"]
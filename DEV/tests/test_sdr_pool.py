@@ -0,0 +1,104 @@
+import asyncio
+import importlib
+from datetime import datetime, timedelta, timezone
+import pytest
+import sdr_pool
+from sdr_pool import DevicePool, DeviceConfig
+from fake_sdr import FakeRtlSdr, FAKE_SERIALS
+from event_scheduler import EventScheduler
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    # The dongles are simulated, as with SDR_BACKEND=fake
+    monkeypatch.setenv("SDR_BACKEND", "fake")
+    yield importlib.reload(sdr_pool)
+    monkeypatch.delenv("SDR_BACKEND")
+    importlib.reload(sdr_pool)
+
+
+def make_pool():
+    return DevicePool([DeviceConfig(serial) for serial in FAKE_SERIALS])
+
+
+def test_claim_by_serial_opens_that_dongle(fake_backend):
+    async def run():
+        pool = make_pool()
+        async with pool.claim(FAKE_SERIALS[1]) as device:
+            sdr = fake_backend.open_device(device)
+            return device.serial, sdr, pool.available
+
+    serial, sdr, available = asyncio.run(run())
+    assert serial == FAKE_SERIALS[1]
+    assert isinstance(sdr, FakeRtlSdr) and sdr.serial == FAKE_SERIALS[1]
+    assert available == 1
+
+
+def test_claim_of_an_unknown_serial_fails():
+    async def run():
+        async with make_pool().claim("12345678"):
+            pass
+
+    with pytest.raises(KeyError):
+        asyncio.run(run())
+
+
+def test_claim_waits_for_a_busy_dongle():
+    async def run():
+        pool = make_pool()
+        order = []
+
+        async def capture(serial, hold):
+            async with pool.claim(serial) as device:
+                order.append(("claimed", serial, device.serial))
+                await asyncio.sleep(hold)
+            order.append(("released", serial))
+
+        first = asyncio.create_task(capture(FAKE_SERIALS[0], 0.2))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(capture(FAKE_SERIALS[0], 0))
+        await asyncio.sleep(0.05)
+        # The same dongle waits, any dongle goes to the free one
+        assert not second.done()
+        async with pool.claim() as other:
+            assert other.serial == FAKE_SERIALS[1]
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(run()) == [("claimed", FAKE_SERIALS[0], FAKE_SERIALS[0]), ("released", FAKE_SERIALS[0]),
+                                  ("claimed", FAKE_SERIALS[0], FAKE_SERIALS[0]), ("released", FAKE_SERIALS[0])]
+
+
+def test_claim_releases_the_dongle_on_exception():
+    async def run():
+        pool = make_pool()
+        with pytest.raises(RuntimeError):
+            async with pool.claim(FAKE_SERIALS[0]):
+                raise RuntimeError("receiver crashed")
+        async with asyncio.timeout(1):
+            async with pool.claim(FAKE_SERIALS[0]) as device:
+                return device.serial, pool.available
+
+    assert asyncio.run(run()) == (FAKE_SERIALS[0], 1)
+
+
+def test_capture_after_the_set_is_skipped():
+    agent = importlib.import_module("pass")
+
+    async def run():
+        pool = DevicePool([DeviceConfig(FAKE_SERIALS[0])])
+        scheduler = EventScheduler()
+        end = datetime.now(timezone.utc) + timedelta(seconds=0.2)
+
+        async def busy():
+            async with pool.claim():
+                await asyncio.sleep(0.3)
+
+        holder = asyncio.create_task(busy())
+        await asyncio.sleep(0.05)
+        # The dongle comes back after the pass has set: no receiver, no post-processing
+        await agent.capture("NOAA 19", "137.1000", "1 33591U", "2 33591", pool, scheduler, end=end)
+        await holder
+        return pool.available, scheduler.planned("post")
+
+    assert asyncio.run(run()) == (1, [])
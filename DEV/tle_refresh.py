@@ -0,0 +1,120 @@
+import os
+import json
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from tle_store import parse_tle_text
+from pipeline_metrics import write_atomic
+
+CELESTRAK_URL = "https://celestrak.org/NORAD/elements/gp.php"
+RETRY_STATUS = (429, 500, 502, 503, 504)
+MAX_RETRY_AFTER = 60  # seconds, longest Retry-After honoured before the next attempt
+
+
+class TLERefresher:
+    """
+    Concurrent, conditional download of CelesTrak groups and single objects into a TLEStore.
+
+    Every feed (GROUP=... or CATNR=...) is fetched on a thread pool sharing
+    one pooled session. The ETag and Last-Modified of every feed are kept
+    next to the store and sent back as If-None-Match / If-Modified-Since, so
+    an unchanged feed costs a 304 and no parsing. Connection errors, 429 and
+    5xx are retried with exponential backoff (or the server's Retry-After,
+    capped at MAX_RETRY_AFTER).
+    Records are merged into the store only when their epoch is newer, and
+    the store is saved only if something changed.
+
+    Parameters:
+    store (TLEStore): local catalog to update.
+    groups (iterable): CelesTrak groups, e.g. ('weather', 'noaa').
+    catnrs (iterable): NORAD catalog numbers fetched one by one.
+    base_url (str): gp.php endpoint, a local server for tests.
+    timeout (float): seconds for connect and read.
+    retries (int): retries of a feed after the first attempt.
+    backoff (float): seconds before the first retry, doubled at every retry.
+    workers (int): concurrent downloads.
+    """
+
+    def __init__(self, store, groups=("weather",), catnrs=(), base_url=CELESTRAK_URL, timeout=10.0,
+                 retries=3, backoff=1.0, workers=4):
+        self.store = store
+        self.urls = [f"{base_url}?GROUP={group}&FORMAT=tle" for group in groups]
+        self.urls += [f"{base_url}?CATNR={int(catnr)}&FORMAT=tle" for catnr in catnrs]
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.state_path = store.path + ".http.json"
+        self.validators = {}  # url -> {"etag": ..., "last_modified": ...}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.validators = json.load(f)
+
+    def _fetch(self, url):
+        # Returns (status, text, validators), status None if every attempt failed
+        headers = {}
+        validators = self.validators.get(url, {})
+        # An empty store cannot rely on a 304, the data it refers to is gone
+        if len(self.store):
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 304:
+                    return 304, None, {}
+                if response.status_code == 200:
+                    return 200, response.text, {"etag": response.headers.get("ETag"),
+                                                "last_modified": response.headers.get("Last-Modified")}
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUS:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, min(float(retry_after), MAX_RETRY_AFTER))
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        print(f"[TLE] >{url}: {error}")
+        return None, None, {}
+
+    def refresh(self):
+        # Fetch every feed, merge the newer epochs, returns the NORAD numbers that changed
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="tle-refresh") as pool:
+            results = list(zip(self.urls, pool.map(self._fetch, self.urls)))
+        changed = set()
+        ok = 0
+        for url, (status, text, validators) in results:
+            if status is None:
+                continue
+            ok += 1
+            if status == 200:
+                records = parse_tle_text(text)
+                if records:
+                    # Only the refresher appends to the TLE history, reading the store never writes it
+                    self.store.archive.add(records)
+                    changed.update(self.store.update(records))
+                    self.validators[url] = validators
+        if ok:
+            self.store.updated = datetime.now()
+            write_atomic(self.state_path, json.dumps(self.validators, indent=2))
+        # The catalog file is only rewritten when an epoch changed
+        if changed:
+            self.store.save()
+        print(f"[TLE] >{ok}/{len(self.urls)} feeds fetched, {len(changed)} TLEs updated")
+        return sorted(changed)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,246 @@
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from skyfield.api import load, EarthSatellite
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # first line of TLE.txt, time of the last refresh
+TLE = namedtuple("TLE", "norad name line1 line2 epoch")
+# Name (up to 24 characters) followed by the two lines, for files whose line breaks were lost
+COLLAPSED_TLE = re.compile(r"(\S.{0,23}?)\s*(1 (\d{5})[A-Z ].{61})(2 \3 .{61})")
+# History of every TLE ever seen: ARCHIVE_MAGIC, then fixed size records appended in any order
+ARCHIVE_MAGIC = b"APTTLE\x00\x01"
+ARCHIVE_RECORD = np.dtype([("norad", "<u4"), ("epoch", "<f8"), ("line1", "S69"), ("line2", "S69")])
+
+
+# Function to read the epoch of a TLE from columns 19-32 of line 1 (YYDDD.DDDDDDDD)
+def tle_epoch(line1):
+    year = int(line1[18:20])
+    year += 2000 if year < 57 else 1900
+    return datetime(year, 1, 1, tzinfo=timezone.utc) + timedelta(days=float(line1[20:32]) - 1)
+
+# Function to build a TLE record from its lines
+def make_tle(name, line1, line2):
+    norad = int(line1[2:7])
+    return TLE(norad, (name or str(norad)).strip(), line1.strip(), line2.strip(), tle_epoch(line1))
+
+# Function to parse text in the 3-line (or 2-line) TLE format, any line ending
+def parse_tle_text(text):
+    records = []
+    lines = [line.rstrip() for line in text.splitlines()]
+    name = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("1 ") and i + 1 < len(lines) and lines[i + 1].startswith("2 ") and line[2:7] == lines[i + 1][2:7]:
+            records.append(make_tle(name, line, lines[i + 1]))
+            name = None
+            i += 2
+        else:
+            name = line.strip() or None
+            i += 1
+    if not records:
+        records = [make_tle(match.group(1), match.group(2), match.group(4)) for match in COLLAPSED_TLE.finditer(text)]
+    return records
+
+
+class TLEArchive:
+    """
+    Append-only history of every TLE epoch, with nearest-epoch lookup.
+
+    Records are 150 bytes (NORAD number, epoch as POSIX time, both lines)
+    appended as they are seen. The whole file is read in one np.fromfile
+    and indexed by NORAD number with the epochs sorted, so nearest() is a
+    binary search. A record cut short by a crash is ignored. The file is
+    created exclusively with its magic, so processes appending at the same
+    time never write it twice.
+
+    Parameters:
+    path (str): archive file, created on the first append.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}   # NORAD number -> (sorted epochs, records in the same order)
+        self.seen = set()
+        self.pending = []  # records appended since the index was built
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                    raise ValueError(f"{path} is not a TLE archive")
+                data = np.fromfile(f, dtype=np.uint8)
+            usable = len(data) // ARCHIVE_RECORD.itemsize * ARCHIVE_RECORD.itemsize
+            self._build(data[:usable].view(ARCHIVE_RECORD))
+
+    def _build(self, records):
+        if self.pending:
+            records = np.concatenate([records, np.array(self.pending, dtype=ARCHIVE_RECORD)])
+            self.pending = []
+        records = records[np.lexsort((records["epoch"], records["norad"]))]
+        norads, starts = np.unique(records["norad"], return_index=True)
+        bounds = list(starts[1:]) + [len(records)]
+        self.index = {int(norad): (records["epoch"][start:end], records[start:end])
+                      for norad, start, end in zip(norads, starts, bounds)}
+        self.seen = set(zip(records["norad"].tolist(), records["epoch"].tolist()))
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, records):
+        # Append the records never seen before, returns how many were added
+        new = [(record.norad, record.epoch.timestamp(), record.line1.encode(), record.line2.encode())
+               for record in records if (record.norad, record.epoch.timestamp()) not in self.seen]
+        if not new:
+            return 0
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0))
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(ARCHIVE_MAGIC)
+        with open(self.path, "ab") as f:
+            f.write(np.array(new, dtype=ARCHIVE_RECORD).tobytes())
+        self.seen.update((norad, epoch) for norad, epoch, line1, line2 in new)
+        self.pending.extend(new)
+        return len(new)
+
+    def nearest(self, norad, when):
+        # TLE of `norad` with the epoch closest to `when` (aware datetime), None if never seen
+        if self.pending:
+            self._build(np.concatenate([records for epochs, records in self.index.values()])
+                        if self.index else np.zeros(0, dtype=ARCHIVE_RECORD))
+        if norad not in self.index:
+            return None
+        epochs, records = self.index[norad]
+        t = when.timestamp()
+        i = int(np.searchsorted(epochs, t))
+        if i == len(epochs) or (i > 0 and t - epochs[i - 1] <= epochs[i] - t):
+            i -= 1
+        record = records[i]
+        return TLE(norad, None, record["line1"].decode(), record["line2"].decode(), tle_epoch(record["line1"].decode()))
+
+    def epochs(self, norad):
+        # Epochs on record for `norad`, oldest first
+        return [datetime.fromtimestamp(epoch, timezone.utc) for epoch in self.index.get(norad, ((), ()))[0]]
+
+
+class TLEStore:
+    """
+    Local TLE catalog indexed by NORAD catalog number and by name.
+
+    The file keeps the format the schedulers always read: the time of the
+    last refresh on the first line, then name, line 1 and line 2 of every
+    object. It is parsed once; files written collapsed on one line by older
+    versions are read too. Every save writes a temporary file and renames
+    it, so a reader never sees a half written catalog. EarthSatellite
+    objects (and their sgp4 Satrec, `.model`) are built on first use and
+    cached until their TLE changes. Every TLE downloaded by the refresher
+    is also kept in a TLEArchive, so old passes can be processed with the
+    TLE of their time (nearest()); reading the store never writes it.
+
+    Parameters:
+    path (str): catalog file, created on the first save.
+    ts (skyfield Timescale): shared timescale, loaded if not given.
+    archive_path (str): TLE history, defaults to <path without extension>_history.bin.
+    """
+
+    def __init__(self, path, ts=None, archive_path=None):
+        self.path = path
+        self.ts = ts or load.timescale()
+        self.archive = TLEArchive(archive_path or os.path.splitext(path)[0] + "_history.bin")
+        self.records = {}      # NORAD number -> TLE
+        self.names = {}        # name -> NORAD number
+        self.satellites = {}   # NORAD number -> EarthSatellite
+        self.updated = None
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as f:
+            text = f.read()
+        first, _, rest = text.partition("\n")
+        try:
+            self.updated = datetime.strptime(first.strip(), TIMESTAMP_FORMAT)
+        except ValueError:
+            self.updated, rest = None, text
+        self.records.clear()
+        self.names.clear()
+        self.satellites.clear()
+        self.update(parse_tle_text(rest))
+
+    def save(self):
+        lines = [(self.updated or datetime.now()).strftime(TIMESTAMP_FORMAT)]
+        for record in sorted(self.records.values()):
+            lines += [record.name, record.line1, record.line2]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+    @property
+    def age(self):
+        return datetime.now() - self.updated if self.updated else timedelta.max
+
+    def update(self, records):
+        # Add or replace records, returns the NORAD numbers whose TLE changed (older epochs are ignored)
+        changed = []
+        for record in records:
+            current = self.records.get(record.norad)
+            if current is not None and current.epoch >= record.epoch:
+                continue
+            self.records[record.norad] = record
+            self.names[record.name] = record.norad
+            self.satellites.pop(record.norad, None)
+            changed.append(record.norad)
+        return changed
+
+    def _norad(self, key):
+        if isinstance(key, int):
+            return key
+        if key in self.names:
+            return self.names[key]
+        if key.isdigit():
+            return int(key)
+        raise KeyError(f"no TLE for {key}")
+
+    def get(self, key):
+        # key: NORAD number or name, returns the TLE record
+        record = self.records.get(self._norad(key))
+        if record is None:
+            raise KeyError(f"no TLE for {key}")
+        return record
+
+    def __getitem__(self, key):
+        record = self.get(key)
+        return record.line1, record.line2
+
+    def __contains__(self, key):
+        try:
+            self.get(key)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.records)
+
+    def satellite(self, key):
+        record = self.get(key)
+        satellite = self.satellites.get(record.norad)
+        if satellite is None:
+            satellite = EarthSatellite(record.line1, record.line2, record.name, self.ts)
+            self.satellites[record.norad] = satellite
+        return satellite
+
+    def nearest(self, key, when):
+        # TLE with the epoch closest to `when`: from the history or the current one
+        record = self.get(key)
+        archived = self.archive.nearest(record.norad, when)
+        if archived is None or abs(record.epoch - when) <= abs(archived.epoch - when):
+            return record
+        return archived._replace(name=record.name)
+
+    def satrec(self, key):
+        return self.satellite(key).model